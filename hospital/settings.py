@@ -1,5 +1,5 @@
+import os
 from pathlib import Path
-import pymongo
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -19,6 +19,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'hospital_app.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -26,13 +27,16 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'hospital_app.profiling.MongoProfilerMiddleware',
 ]
 
 ROOT_URLCONF = 'hospital.urls'
 
+# The Django backend, plus render timings for /metrics (hospital_app.metrics)
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'hospital_app.metrics.DjangoTemplates',
+        'NAME': 'django',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -55,9 +59,102 @@ DATABASES = {
     }
 }
 
-# MongoDB connection for your application data
-MONGODB_CLIENT = pymongo.MongoClient('mongodb://localhost:27017/')
-MONGODB_DB = MONGODB_CLIENT['hospital_management']
+# MongoDB connection for your application data (see hospital_app/mongo.py)
+MONGODB_URI = os.environ.get('MONGODB_URI', 'mongodb://localhost:27017/')
+MONGODB_NAME = os.environ.get('MONGODB_NAME', 'hospital_management')
+MONGODB_MAX_POOL_SIZE = 100
+MONGODB_MIN_POOL_SIZE = 0
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = 5000
+MONGODB_CONNECT_TIMEOUT_MS = 5000
+MONGODB_SOCKET_TIMEOUT_MS = None
+MONGODB_WAIT_QUEUE_TIMEOUT_MS = None
+MONGODB_READ_PREFERENCE = 'primary'
+MONGODB_WRITE_CONCERN = {}
+
+# Caches. Point 'default' at a shared backend (Redis/Memcached) when running
+# several workers so doctor cache invalidations are seen by all of them.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'hospital',
+    }
+}
+HOSPITAL_DOCTOR_CACHE = 'default'
+HOSPITAL_DOCTOR_CACHE_SECONDS = 300
+
+# Serve the list, search and dashboard views from hospital_app.async_views
+# (use with hospital/asgi.py)
+HOSPITAL_ASYNC_VIEWS = os.environ.get('HOSPITAL_ASYNC_VIEWS', '') == '1'
+
+# Pagination for list and search views
+HOSPITAL_PAGE_SIZE = 25
+HOSPITAL_MAX_PAGE_SIZE = 200
+HOSPITAL_COUNT_CACHE_SECONDS = 30
+
+# Business IDs handed out per counter round trip (1 keeps IDs gap-free)
+HOSPITAL_ID_BLOCK_SIZE = 1
+
+# Dashboard statistics snapshot: served fresh for HOSPITAL_STATS_TTL seconds,
+# then served stale for up to HOSPITAL_STATS_STALE_SECONDS while it refreshes
+HOSPITAL_STATS_TTL = 60
+HOSPITAL_STATS_STALE_SECONDS = 300
+
+# Rows per bulk_write when importing patients (manage.py import_patients)
+HOSPITAL_IMPORT_BATCH_SIZE = 1000
+
+# Documents per cursor batch / output chunk when exporting
+HOSPITAL_EXPORT_BATCH_SIZE = 1000
+
+# How many days ahead "earliest free slot" looks
+HOSPITAL_SLOT_SEARCH_DAYS = 30
+
+# Mongo profiler (hospital_app.profiling): log requests slower than this,
+# and with DEBUG on, append a panel listing each page's Mongo commands
+HOSPITAL_SLOW_REQUEST_MS = 500
+HOSPITAL_MONGO_PANEL = DEBUG
+HOSPITAL_MONGO_PANEL_EXPLAIN = True
+
+# /metrics (hospital_app.metrics). Under a multi-process server point
+# HOSPITAL_METRICS_DIR at a directory shared by the workers (emptied on
+# deploy) so a scrape sums all of them; None reports the serving process.
+HOSPITAL_METRICS_DIR = os.environ.get('HOSPITAL_METRICS_DIR') or None
+HOSPITAL_METRICS_FLUSH_SECONDS = 5
+# When set, /metrics requires "Authorization: Bearer <token>"
+HOSPITAL_METRICS_TOKEN = os.environ.get('HOSPITAL_METRICS_TOKEN') or None
+
+# List pages answer 304 while their collections are unchanged and cache
+# their rendered rows (hospital_app.versions) for this long. Changing
+# HOSPITAL_RELEASE on deploy retires pages rendered by older templates.
+HOSPITAL_FRAGMENT_CACHE_SECONDS = 300
+HOSPITAL_RELEASE = os.environ.get('HOSPITAL_RELEASE', '')
+
+# JSON API (hospital_app.api). Partners send "Authorization: Bearer <token>";
+# set HOSPITAL_API_TOKENS to a comma-separated list of their tokens.
+HOSPITAL_API_TOKENS = [token for token in os.environ.get('HOSPITAL_API_TOKENS', '').split(',') if token]
+HOSPITAL_API_PAGE_SIZE = 1000
+HOSPITAL_API_MAX_PAGE_SIZE = 5000
+HOSPITAL_API_BATCH_SIZE = 1000
+
+# Change feed (hospital_app.changefeed): 'stream' needs a replica set,
+# 'watermark' works anywhere, 'auto' picks a change stream when available.
+HOSPITAL_CHANGE_FEED = os.environ.get('HOSPITAL_CHANGE_FEED', 'auto')
+HOSPITAL_CHANGE_FEED_MAX_WAIT = 25
+HOSPITAL_CHANGE_FEED_LAG_SECONDS = 2
+HOSPITAL_CHANGE_FEED_TOMBSTONE_DAYS = 30
+
+# Matches the appointment form pickers load per keystroke
+HOSPITAL_LOOKUP_LIMIT = 10
+
+# Most appointments one bulk change may touch
+HOSPITAL_BULK_APPOINTMENT_LIMIT = 5000
+
+# Days the analytics page covers when no range is given
+HOSPITAL_ANALYTICS_DAYS = 30
+
+# Deleted (archived) patients and doctors are moved to the *_archive
+# collections by `manage.py archive_records` after this many years
+HOSPITAL_ARCHIVE_AFTER_YEARS = 3
+HOSPITAL_ARCHIVE_BATCH_SIZE = 1000
 
 # Authentication settings
 LOGIN_URL = '/staff/login/'
@@ -0,0 +1,174 @@
+"""Doctor workload and revenue analytics from pre-aggregated daily buckets.
+
+``appointment_rollups`` holds one document per doctor and day::
+
+    {'doctor_id': ObjectId, 'date': 'YYYY-MM-DD', 'total': 9,
+     'scheduled': 2, 'confirmed': 1, 'completed': 5, 'cancelled': 1, 'revenue': 750.0}
+
+Every appointment write moves the appointment between buckets with
+:func:`record` (one unordered ``bulk_write`` of ``$inc`` upserts per
+write or bulk change), so the buckets stay current without rescanning
+appointments. ``revenue`` adds the doctor's ``consultation_fee`` when an
+appointment is completed (and takes it off again if it is un-completed).
+``manage.py backfill_appointment_rollups`` rebuilds the buckets from the
+appointments in batches, e.g. after a fee change or an import.
+
+:func:`report` reads the buckets of a date range through the
+``(date, doctor_id)`` index and rolls them up by doctor, department (from
+the cached doctor options, so a doctor who changes department moves their
+history with them) and day or week. An appointment still scheduled or
+confirmed on a past day counts as a no-show.
+"""
+from collections import defaultdict
+from datetime import date, timedelta
+
+from django.conf import settings
+from pymongo import UpdateOne
+
+from .mongo import collection
+from .scheduling import STATUSES, day_key
+
+rollups_collection = collection('appointment_rollups')
+
+# Days a report covers when no range is given
+REPORT_DAYS = getattr(settings, 'HOSPITAL_ANALYTICS_DAYS', 30)
+
+COUNTERS = tuple(status.lower() for status in STATUSES)
+BUCKET_FIELDS = ('total',) + COUNTERS + ('revenue',)
+GROUPINGS = ('day', 'week')
+PROJECTION = dict.fromkeys(('doctor_id', 'date') + BUCKET_FIELDS, 1)
+
+
+def fees(doctors):
+    """``consultation_fee`` by doctor ``_id`` from doctor documents or options."""
+    return {doctor['_id']: float(doctor.get('consultation_fee') or 0) for doctor in doctors}
+
+
+def _bucket(appointment):
+    """``(doctor_id, day)`` and the counter an appointment adds to, or ``None`` if it can't be bucketed."""
+    if not appointment or appointment.get('status') not in STATUSES or not appointment.get('doctor_id'):
+        return None
+    try:
+        day = day_key(appointment.get('appointment_date'))
+    except (TypeError, ValueError):
+        return None
+    return (appointment['doctor_id'], day), appointment['status'].lower()
+
+
+def bucket_increments(appointments, doctor_fees):
+    """Bucket counters for ``appointments`` (or ``(appointment, sign)`` pairs), by ``(doctor_id, day)``."""
+    increments = defaultdict(lambda: dict(dict.fromkeys(BUCKET_FIELDS, 0), revenue=0.0))
+    for item in appointments:
+        appointment, sign = item if isinstance(item, tuple) else (item, 1)
+        found = _bucket(appointment)
+        if found is None:
+            continue
+        key, counter = found
+        increments[key]['total'] += sign
+        increments[key][counter] += sign
+        if counter == 'completed':
+            increments[key]['revenue'] += sign * doctor_fees.get(appointment['doctor_id'], 0.0)
+    return increments
+
+
+def record(changes, doctors):
+    """Move each ``(before, after)`` appointment pair between buckets.
+
+    ``before`` is ``None`` for a booking and ``after`` ``None`` for a
+    delete. ``doctors`` supplies the fees (the cached doctor options do).
+    """
+    pairs = []
+    for before, after in changes:
+        if _bucket(before) != _bucket(after):
+            pairs.extend(item for item in ((before, -1), (after, 1)) if item[0])
+    increments = bucket_increments(pairs, fees(doctors))
+    requests = []
+    for (doctor_id, day), counters in increments.items():
+        changed = {field: value for field, value in counters.items() if value}
+        if changed:
+            requests.append(UpdateOne({'date': day, 'doctor_id': doctor_id}, {'$inc': changed}, upsert=True))
+    if requests:
+        rollups_collection.bulk_write(requests, ordered=False)
+
+
+# ===== REPORTING =====
+def _rates(row):
+    total = row['total']
+    # Past appointments that were kept or missed; only those can be no-shows
+    row['attended'] = attended = row['completed'] + row['no_show']
+    row['cancel_rate'] = row['cancelled'] / total if total else 0.0
+    row['no_show_rate'] = row['no_show'] / attended if attended else 0.0
+    row['daily_load'] = (total - row['cancelled']) / row['days'] if row['days'] else 0.0
+    return row
+
+
+def _empty_row(**fields):
+    row = dict.fromkeys(BUCKET_FIELDS, 0)
+    row.update(no_show=0, revenue=0.0, days=0, **fields)
+    return row
+
+
+def _add(row, bucket, past):
+    for field in BUCKET_FIELDS:
+        row[field] += bucket.get(field, 0)
+    if past:
+        row['no_show'] += bucket.get('scheduled', 0) + bucket.get('confirmed', 0)
+
+
+def period_of(day, grouping):
+    """The first day of ``day``'s period: the day itself, or the Monday of its week."""
+    day = date.fromisoformat(day)
+    return (day - timedelta(days=day.weekday()) if grouping == 'week' else day).isoformat()
+
+
+def report(start, end, doctors, grouping='day', department=None, today=None):
+    """Workload, cancel/no-show rates and revenue for ``start``..``end`` (``date`` values), in one query.
+
+    Returns ``{'doctors': [...], 'departments': [...], 'periods': [...], 'totals': {...}}``;
+    every row has the bucket counters, ``no_show``, ``cancel_rate``,
+    ``no_show_rate`` and ``daily_load`` (appointments kept per day worked).
+    """
+    if grouping not in GROUPINGS:
+        raise ValueError(f"grouping must be one of {', '.join(GROUPINGS)}")
+    today = (today or date.today()).isoformat()
+    by_id = {doctor['_id']: doctor for doctor in doctors}
+    criteria = {'date': {'$gte': start.isoformat(), '$lte': end.isoformat()}}
+    if department:
+        criteria['doctor_id'] = {'$in': [doctor['_id'] for doctor in doctors
+                                         if doctor.get('department') == department]}
+
+    groups = {'doctor': {}, 'department': {}, 'period': {}}
+    totals = _empty_row()
+    # Days with at least one appointment that wasn't cancelled, per row
+    worked = defaultdict(set)
+    for bucket in rollups_collection.find(criteria, PROJECTION):
+        doctor = by_id.get(bucket['doctor_id'], {})
+        keys = {
+            'doctor': bucket['doctor_id'],
+            'department': doctor.get('department'),
+            'period': period_of(bucket['date'], grouping),
+        }
+        for group, key in keys.items():
+            row = groups[group].get(key)
+            if row is None:
+                row = groups[group][key] = _empty_row(**{group: key})
+                if group == 'doctor':
+                    row.update(name=f"Dr. {doctor.get('first_name', '')} {doctor.get('last_name', '')}"
+                               if doctor else 'Unknown', department=doctor.get('department'))
+            _add(row, bucket, bucket['date'] < today)
+            if bucket.get('total', 0) > bucket.get('cancelled', 0):
+                worked[group, key].add(bucket['date'])
+        _add(totals, bucket, bucket['date'] < today)
+        if bucket.get('total', 0) > bucket.get('cancelled', 0):
+            worked['totals'].add(bucket['date'])
+
+    for group, rows in groups.items():
+        for key, row in rows.items():
+            row['days'] = len(worked[group, key])
+    totals['days'] = len(worked['totals'])
+    return {
+        'doctors': sorted(map(_rates, groups['doctor'].values()), key=lambda row: -row['total']),
+        'departments': sorted(map(_rates, groups['department'].values()), key=lambda row: -row['revenue']),
+        'periods': sorted(map(_rates, groups['period'].values()), key=lambda row: row['period']),
+        'totals': _rates(totals),
+    }
@@ -0,0 +1,567 @@
+"""Versioned JSON API for integration partners (lab, billing).
+
+Under ``/api/v1/<resource>/`` for ``patients``, ``doctors`` and
+``appointments``:
+
+* ``GET <resource>/`` - one page of records in ``_id`` order, which is
+  stable under concurrent inserts. ``?page_size=`` (up to
+  ``HOSPITAL_API_MAX_PAGE_SIZE``) and the ``next`` URL / ``next_cursor``
+  walk the whole collection; ``?fields=a,b`` returns only those fields.
+  Archived patients and doctors (see :mod:`hospital_app.archive`) are left
+  out; the change feed reports them as updates with ``archived: true``.
+* ``GET <resource>/<id>/`` - one record by API ``id`` or business ID.
+* ``POST <resource>/batch-get/`` with ``{"ids": [...], "fields": [...]}`` -
+  up to ``HOSPITAL_API_BATCH_SIZE`` records in one query, in request order,
+  plus the ids that were ``missing``.
+* ``POST <resource>/batch/`` with ``{"records": [...]}`` - create or update
+  up to ``HOSPITAL_API_BATCH_SIZE`` records with one ``bulk_write`` and get a
+  per-record report. A record with a business ID (``patient_id``, ...)
+  updates that record. Patients and doctors without one are upserted on
+  ``email`` among the active ones, so a retried batch doesn't create
+  duplicates. Appointments can
+  only be updated here, and only ``purpose``, ``notes`` and ``status``
+  changes that don't free or take a slot.
+
+``POST /api/v1/appointments/bulk/`` cancels, re-statuses or reschedules
+many appointments at once (see :mod:`hospital_app.bulk`): either
+``{"changes": [{"appointment_id": ..., "status": ...}, ...]}`` or
+``{"select": {"doctor_id": ..., "from": ..., "to": ..., "status": [...]},
+"set": {"status": "Cancelled"}}`` (``"shift_days": 7`` moves each one a
+week). ``"dry_run": true`` reports without writing.
+
+``GET /api/v1/patients/<id>/history/`` is a patient's summary (visit
+count, last visit, next appointment; see :mod:`hospital_app.history`)
+and their appointments newest first, paged like the lists.
+
+``GET /api/v1/changes/`` is the incremental change feed (see
+:mod:`hospital_app.changefeed`): the events after ``?since=<checkpoint>``,
+long-polling up to ``?wait=`` seconds (``HOSPITAL_CHANGE_FEED_MAX_WAIT``)
+for the first one. Every event carries its ``checkpoint`` and the response
+the ``checkpoint`` to continue from. With ``?consumer=<name>`` the server
+keeps the checkpoint: ``since`` acknowledges what was processed and a
+request without it continues from the last acknowledgement. With
+``Accept: text/event-stream`` events are sent as server-sent events whose
+``id`` is the checkpoint, so ``EventSource`` resumes by itself.
+
+Every record carries ``id`` (the ObjectId as hex) and its business ID.
+Responses are encoded by :mod:`hospital_app.encoding`. Partners
+authenticate with ``Authorization: Bearer <token>`` (``HOSPITAL_API_TOKENS``);
+logged-in staff can use the API from the browser with their session, CSRF
+token included.
+"""
+import time
+from datetime import datetime
+from functools import wraps
+
+from bson.objectid import ObjectId
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.middleware.csrf import CsrfViewMiddleware
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.csrf import csrf_exempt
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from . import archive, changefeed, doctor_cache, encoding, history, importer, versions, views
+from .bulk import BulkError, apply_changes, apply_edit
+from .importer import EMAIL_RE, RowError, normalize_patient
+from .pagination import paginate
+from .scheduling import INACTIVE_STATUSES, STATUSES
+
+PAGE_SIZE = getattr(settings, 'HOSPITAL_API_PAGE_SIZE', 1000)
+MAX_PAGE_SIZE = getattr(settings, 'HOSPITAL_API_MAX_PAGE_SIZE', 5000)
+BATCH_SIZE = getattr(settings, 'HOSPITAL_API_BATCH_SIZE', 1000)
+FEED_MAX_WAIT = getattr(settings, 'HOSPITAL_CHANGE_FEED_MAX_WAIT', 25)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+
+class RecordError(ValueError):
+    """A batch record that can't be written; reported for that record only."""
+
+
+# ===== RESOURCES =====
+def _text(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _number(record, field, kind):
+    value = record.get(field)
+    if value in (None, ''):
+        return kind(0)
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        raise RecordError(f"invalid {field} {value!r}")
+
+
+# What a patient's search subdocument is built from (see search.search_fields)
+PATIENT_SEARCH_SOURCES = ('first_name', 'last_name', 'email', 'phone')
+
+
+def normalize_patient_record(record, current):
+    if current is None:
+        try:
+            return normalize_patient(record)
+        except RowError as error:
+            raise RecordError(str(error))
+    # An update validates and sets only the fields the record carries, and
+    # rebuilds search from them merged over the stored values
+    given = [field for field in importer.FIELDS if field in record]
+    merged = {field: current.get(field) for field in PATIENT_SEARCH_SOURCES}
+    merged.update((field, record[field]) for field in given)
+    try:
+        patient = normalize_patient(merged, required=[field for field in importer.REQUIRED_FIELDS if field in record])
+    except RowError as error:
+        raise RecordError(str(error))
+    return dict({field: patient[field] for field in given}, search=patient['search'])
+
+
+DOCTOR_TEXT_FIELDS = ('first_name', 'last_name', 'email', 'phone', 'specialization', 'department',
+                      'qualification')
+
+
+def normalize_doctor_record(record, current):
+    # An update only sets the fields the record carries; a new doctor gets all of them
+    given = DOCTOR_TEXT_FIELDS if current is None else [field for field in DOCTOR_TEXT_FIELDS if field in record]
+    doctor = {field: _text(record.get(field)) for field in given}
+    required = ('first_name', 'last_name', 'email') if current is None else ('first_name', 'last_name')
+    missing = [field for field in required if field in doctor and not doctor[field]]
+    if missing:
+        raise RecordError(f"missing {', '.join(missing)}")
+    if doctor.get('email'):
+        doctor['email'] = doctor['email'].lower()
+        if not EMAIL_RE.match(doctor['email']):
+            raise RecordError(f"invalid email {doctor['email']!r}")
+    # Same types as the doctor forms store
+    for field, kind in (('experience', int), ('consultation_fee', float)):
+        if current is None or field in record:
+            doctor[field] = _number(record, field, kind)
+    # Left alone unless given; new doctors get Resource.defaults
+    for field in ('availability', 'status'):
+        if _text(record.get(field)):
+            doctor[field] = _text(record.get(field))
+    return doctor
+
+
+APPOINTMENT_WRITABLE = ('purpose', 'notes', 'status')
+
+
+def normalize_appointment_record(record, current):
+    unknown = sorted(set(record) - set(APPOINTMENT_WRITABLE) - {'id', 'appointment_id'})
+    if unknown:
+        raise RecordError(f"can't change {', '.join(unknown)} here; only {', '.join(APPOINTMENT_WRITABLE)}")
+    appointment = {field: record[field] for field in APPOINTMENT_WRITABLE if field in record}
+    if not appointment:
+        raise RecordError("nothing to change")
+    status = appointment.get('status')
+    if status is not None:
+        if status not in STATUSES:
+            raise RecordError(f"invalid status {status!r}")
+        # Those transitions release or reserve a doctor slot
+        if (status in INACTIVE_STATUSES) != (current.get('status') in INACTIVE_STATUSES):
+            raise RecordError("cancelling or reinstating an appointment moves its slot; "
+                              "use the appointment pages")
+    return appointment
+
+
+class Resource:
+    """How one collection is exposed through the API."""
+
+    def __init__(self, name, key, fields, normalize, match=None, allocator=None, created_field=None,
+                 defaults=None, archivable=False, current_fields=('status',)):
+        self.name = name
+        self.key = key
+        self.fields = fields
+        self.normalize = normalize
+        # Field new records are upserted on; None means records can only be updated
+        self.match = match
+        self.allocator = allocator
+        self.created_field = created_field
+        self.defaults = defaults or {}
+        # Soft-deleted records: left out of lists, never matched by upserts
+        self.archivable = archivable
+        # What normalize() reads from the stored record on update
+        self.current_fields = current_fields
+
+    @property
+    def collection(self):
+        # Looked up on each use so it is the same collection the HTML views use
+        return getattr(views, f'{self.name}_collection')
+
+    def projection(self, fields=None):
+        projection = {field: 1 for field in fields or self.fields}
+        projection[self.key] = 1
+        return projection
+
+
+RESOURCES = {
+    'patients': Resource(
+        'patients', 'patient_id',
+        ['patient_id', 'first_name', 'last_name', 'email', 'phone', 'date_of_birth', 'gender', 'address',
+         'blood_group', 'emergency_contact', 'registration_date', 'visit_count', 'last_visit', 'next_appointment',
+         'archived', 'archived_at'],
+        normalize_patient_record, match='email', allocator='patient_ids', created_field='registration_date',
+        archivable=True, current_fields=PATIENT_SEARCH_SOURCES,
+    ),
+    'doctors': Resource(
+        'doctors', 'doctor_id',
+        ['doctor_id', 'first_name', 'last_name', 'email', 'phone', 'specialization', 'department',
+         'qualification', 'experience', 'consultation_fee', 'availability', 'status', 'archived', 'archived_at'],
+        normalize_doctor_record, match='email', allocator='doctor_ids',
+        defaults={'availability': 'Available', 'status': 'Active'}, archivable=True,
+    ),
+    'appointments': Resource(
+        'appointments', 'appointment_id',
+        ['appointment_id', 'patient_id', 'doctor_id', 'appointment_date', 'time_slot', 'purpose', 'notes',
+         'status', 'created_at'],
+        normalize_appointment_record,
+    ),
+}
+
+
+def as_record(document):
+    """API representation of a document: ``id`` first, then its fields."""
+    record = {'id': document.pop('_id')}
+    record.update(document)
+    return record
+
+
+def requested_fields(resource, fields):
+    """Validate a sparse fieldset (comma-separated string or list); ``None`` means all."""
+    if isinstance(fields, str):
+        fields = [field.strip() for field in fields.split(',') if field.strip()]
+    if not fields:
+        return None
+    unknown = [field for field in fields if field not in resource.fields]
+    if unknown:
+        raise RecordError(f"Unknown fields: {', '.join(map(str, unknown))}. "
+                          f"Choose from {', '.join(resource.fields)}.")
+    return fields
+
+
+def id_criteria(resource, ids):
+    """One filter matching API ids (ObjectId hex) and business IDs alike."""
+    object_ids = [ObjectId(value) for value in ids if ObjectId.is_valid(value)]
+    business_ids = [value for value in ids if not ObjectId.is_valid(value)]
+    clauses = []
+    if object_ids:
+        clauses.append({'_id': {'$in': object_ids}})
+    if business_ids:
+        clauses.append({resource.key: {'$in': business_ids}})
+    return clauses[0] if len(clauses) == 1 else {'$or': clauses}
+
+
+def write_batch(resource, records):
+    """Create or update ``records`` with one ``bulk_write``; returns the per-record report."""
+    collection = resource.collection
+    report = [None] * len(records)
+    keys = [record.get(resource.key) for record in records if isinstance(record, dict) and record.get(resource.key)]
+    existing = {}
+    if keys:
+        # Appointments also need what their patient's history summary is built from
+        projection = (history.APPOINTMENT_FIELDS if resource.name == 'appointments'
+                      else resource.projection(resource.current_fields))
+        existing = {document[resource.key]: document
+                    for document in collection.find({resource.key: {'$in': keys}}, projection)}
+
+    # filter -> (index, update, upsert); a later record for the same
+    # target wins, as two writes to it would race in an unordered batch
+    planned = {}
+    for index, record in enumerate(records):
+        try:
+            if not isinstance(record, dict):
+                raise RecordError("expected an object")
+            key = record.get(resource.key)
+            if key:
+                current = existing.get(key)
+                if current is None:
+                    raise RecordError(f"{resource.key} {key!r} not found")
+                target = (resource.key, key)
+                fields, upsert = resource.normalize(record, current), False
+            elif resource.match:
+                fields, upsert = resource.normalize(record, None), True
+                target = (resource.match, fields[resource.match])
+            else:
+                raise RecordError(f"{resource.key} is required")
+        except RecordError as error:
+            report[index] = {'index': index, 'status': 'error', 'error': str(error)}
+            continue
+        if target in planned:
+            earlier = planned[target][0]
+            report[earlier] = {'index': earlier, 'status': 'error', 'error': f"superseded by record {index}"}
+        planned[target] = (index, fields, upsert)
+
+    operations, indexes, new_keys = [], [], {}
+    upserts = sum(1 for _, _, upsert in planned.values() if upsert)
+    allocated = iter(getattr(views, resource.allocator).take(upserts) if upserts else ())
+    now = datetime.now()
+    for (field, value), (index, fields, upsert) in planned.items():
+        update = {'$set': changefeed.stamp(fields)}
+        target = {field: value}
+        if upsert:
+            if resource.archivable:
+                # New records come out active from the filter
+                target.update(archive.ACTIVE)
+            new_keys[index] = next(allocated)
+            on_insert = {resource.key: new_keys[index]}
+            if resource.created_field:
+                on_insert[resource.created_field] = now
+            on_insert.update((name, default) for name, default in resource.defaults.items() if name not in fields)
+            update['$setOnInsert'] = on_insert
+        operations.append(UpdateOne(target, update, upsert=upsert))
+        indexes.append(index)
+
+    upserted, failed = {}, {}
+    if operations:
+        try:
+            result = collection.bulk_write(operations, ordered=False)
+            upserted = dict(result.upserted_ids or {})
+        except BulkWriteError as error:
+            upserted = {item['index']: item['_id'] for item in error.details.get('upserted', [])}
+            failed = {item['index']: item.get('errmsg', '') for item in error.details.get('writeErrors', [])}
+
+    for position, index in enumerate(indexes):
+        if position in failed:
+            report[index] = {'index': index, 'status': 'error', 'error': failed[position]}
+        elif position in upserted:
+            report[index] = {'index': index, 'status': 'created', 'id': upserted[position],
+                             resource.key: new_keys[index]}
+        else:
+            report[index] = {'index': index, 'status': 'updated', resource.key: records[index].get(resource.key)}
+
+    if any(item['status'] != 'error' for item in report):
+        versions.bump(resource.name)
+        if resource.name == 'doctors':
+            doctor_cache.invalidate()
+        if resource.name == 'appointments':
+            views.record_appointment_changes([(existing[value], dict(existing[value], **fields))
+                                              for position, ((_, value), (_, fields, _)) in enumerate(planned.items())
+                                              if position not in failed])
+    return report
+
+
+# ===== RESPONSES AND AUTHENTICATION =====
+def json_response(data, status=200):
+    return HttpResponse(encoding.dumps(data), status=status, content_type='application/json')
+
+
+def error_response(message, status=400):
+    return json_response({'error': message}, status=status)
+
+
+def authentication_error(request):
+    """``None`` if the request may use the API, otherwise the error response."""
+    header = request.headers.get('Authorization', '')
+    if header.startswith('Bearer '):
+        token = header[len('Bearer '):]
+        if any(constant_time_compare(token, known) for known in getattr(settings, 'HOSPITAL_API_TOKENS', ())):
+            return None
+        return error_response('Invalid API token.', status=401)
+    if not request.user.is_authenticated:
+        response = error_response('Authentication required.', status=401)
+        response['WWW-Authenticate'] = 'Bearer'
+        return response
+    # Session users get back the CSRF check the API views are exempt from
+    if request.method not in SAFE_METHODS:
+        rejected = CsrfViewMiddleware(lambda request: None).process_view(request, None, (), {})
+        if rejected is not None:
+            return error_response('CSRF verification failed.', status=403)
+    return None
+
+
+def read_body(request):
+    try:
+        body = encoding.loads(request.body or b'{}')
+    except ValueError:
+        raise RecordError("The request body must be JSON.")
+    if not isinstance(body, dict):
+        raise RecordError("The request body must be a JSON object.")
+    return body
+
+
+def api_view(*methods):
+    """Method check, authentication and (for ``<resource>`` URLs) resource lookup for an API view."""
+    def decorator(view):
+        @csrf_exempt
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                response = error_response(f"Method {request.method} not allowed.", status=405)
+                response['Allow'] = ', '.join(methods)
+                return response
+            error = authentication_error(request)
+            if error is not None:
+                return error
+            if 'resource' in kwargs:
+                if kwargs['resource'] not in RESOURCES:
+                    return error_response(f"Unknown resource {kwargs['resource']!r}.", status=404)
+                kwargs['resource'] = RESOURCES[kwargs['resource']]
+            try:
+                return view(request, *args, **kwargs)
+            except (RecordError, BulkError, changefeed.CheckpointError) as error:
+                return error_response(str(error))
+        return wrapper
+    return decorator
+
+
+def next_url(request, page):
+    if not page.has_next:
+        return None
+    query = request.GET.copy()
+    query['cursor'] = page.next_token
+    return request.build_absolute_uri(f'{request.path}?{query.urlencode()}')
+
+
+# ===== ENDPOINTS =====
+@api_view('GET')
+def record_list(request, resource):
+    fields = requested_fields(resource, request.GET.get('fields'))
+    page = paginate(resource.collection, archive.ACTIVE if resource.archivable else {}, '_id', request,
+                    resource.projection(fields), default_size=PAGE_SIZE, max_size=MAX_PAGE_SIZE)
+    return json_response({
+        'data': [as_record(document) for document in page],
+        'next_cursor': page.next_token,
+        'next': next_url(request, page),
+    })
+
+
+@api_view('GET')
+def record_detail(request, resource, record_id):
+    fields = requested_fields(resource, request.GET.get('fields'))
+    document = resource.collection.find_one(id_criteria(resource, [record_id]), resource.projection(fields))
+    if document is None:
+        return error_response(f"No {resource.name} record {record_id!r}.", status=404)
+    return json_response({'data': as_record(document)})
+
+
+@api_view('POST')
+def batch_get(request, resource):
+    body = read_body(request)
+    ids = body.get('ids')
+    if not isinstance(ids, list) or not all(isinstance(value, str) for value in ids):
+        raise RecordError('"ids" must be a list of strings.')
+    if len(ids) > BATCH_SIZE:
+        raise RecordError(f"At most {BATCH_SIZE} ids per request.")
+    fields = requested_fields(resource, body.get('fields'))
+    found = {}
+    if ids:
+        for document in resource.collection.find(id_criteria(resource, ids), resource.projection(fields)):
+            record = as_record(document)
+            found[str(record['id'])] = record
+            if record.get(resource.key):
+                found[record[resource.key]] = record
+    return json_response({
+        'data': [found[value] for value in ids if value in found],
+        'missing': [value for value in ids if value not in found],
+    })
+
+
+@api_view('POST')
+def batch_write(request, resource):
+    records = read_body(request).get('records')
+    if not isinstance(records, list):
+        raise RecordError('"records" must be a list.')
+    if len(records) > BATCH_SIZE:
+        raise RecordError(f"At most {BATCH_SIZE} records per request.")
+    report = write_batch(resource, records)
+    summary = {status: sum(1 for item in report if item['status'] == status)
+               for status in ('created', 'updated', 'error')}
+    return json_response({'results': report, 'summary': summary})
+
+
+# ===== CHANGE FEED =====
+def feed_projections():
+    """The record fields change events carry, per collection."""
+    return {name: resource.projection() for name, resource in RESOURCES.items()}
+
+
+def feed_event(checkpoint, event):
+    return dict(event, checkpoint=checkpoint)
+
+
+def _server_sent_events(checkpoint, limit, wait):
+    deadline = time.monotonic() + wait
+    projections = feed_projections()
+    while True:
+        remaining = deadline - time.monotonic()
+        events, end = changefeed.read_changes(checkpoint, limit, max(0, min(remaining, changefeed.POLL_SECONDS)),
+                                              projections)
+        for event_checkpoint, event in events:
+            yield b'id: %s\nevent: change\ndata: %s\n\n' % (event_checkpoint.encode(), encoding.dumps(event))
+        checkpoint = end or checkpoint
+        if remaining <= 0:
+            break
+        if not events and checkpoint:
+            # An id-only message moves the client's Last-Event-ID forward
+            # while idle and keeps proxies from timing the stream out
+            yield b'id: %s\n\n' % checkpoint.encode()
+
+
+@api_view('GET')
+def changes(request):
+    consumer = request.GET.get('consumer')
+    since = request.GET.get('since') or request.headers.get('Last-Event-ID')
+    try:
+        wait = min(max(float(request.GET.get('wait', FEED_MAX_WAIT)), 0), FEED_MAX_WAIT)
+        limit = min(max(int(request.GET.get('limit', BATCH_SIZE)), 1), BATCH_SIZE)
+    except ValueError:
+        return error_response('"wait" and "limit" must be numbers.')
+    if since:
+        changefeed.check_checkpoint(since)
+        if consumer:
+            changefeed.save_checkpoint(consumer, since)
+    elif consumer:
+        since = changefeed.load_checkpoint(consumer)
+        changefeed.check_checkpoint(since)
+
+    if 'text/event-stream' in request.headers.get('Accept', ''):
+        response = StreamingHttpResponse(_server_sent_events(since, limit, wait), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+    events, end = changefeed.read_changes(since, limit, wait, feed_projections())
+    return json_response({
+        'data': [feed_event(event_checkpoint, event) for event_checkpoint, event in events],
+        'checkpoint': end,
+    })
+
+
+# ===== BULK APPOINTMENT CHANGES =====
+@api_view('POST')
+def appointment_bulk(request):
+    body = read_body(request)
+    doctors = doctor_cache.doctor_options(views.doctors_collection)
+    dry_run = bool(body.get('dry_run'))
+    if 'changes' in body:
+        result = apply_changes(body['changes'], views.appointments_collection, doctors, dry_run=dry_run,
+                               patients=views.patients_collection)
+    elif 'select' in body:
+        result = apply_edit(body['select'], body.get('set'), views.appointments_collection, doctors, dry_run=dry_run,
+                            patients=views.patients_collection)
+    else:
+        raise RecordError('Send "changes", or "select" and "set".')
+    return json_response(result)
+
+
+# ===== PATIENT HISTORY =====
+@api_view('GET')
+def patient_history(request, record_id):
+    patients, appointments = RESOURCES['patients'], RESOURCES['appointments']
+    patient = patients.collection.find_one(id_criteria(patients, [record_id]),
+                                           patients.projection(('patient_id',) + history.SUMMARY_FIELDS))
+    if patient is None:
+        return error_response(f"No patients record {record_id!r}.", status=404)
+    summary = history.current_summary(patient, patients.collection, appointments.collection)
+    # Newest first, through the (patient_id, appointment_date) index
+    page = paginate(appointments.collection, {'patient_id': patient['_id']}, '-appointment_date', request,
+                    appointments.projection(), default_size=PAGE_SIZE, max_size=MAX_PAGE_SIZE)
+    return json_response({
+        'data': dict({'id': patient['_id'], 'patient_id': patient.get('patient_id')}, **summary),
+        'history': [as_record(document) for document in page],
+        'next_cursor': page.next_token,
+        'next': next_url(request, page),
+    })
@@ -0,0 +1,114 @@
+"""Soft delete for patients and doctors, and the cold archive behind it.
+
+Deleting a patient or doctor sets ``archived: True`` and ``archived_at``
+instead of removing the document, so appointments never point at a
+missing record. Lists, searches, pickers and counts ask for
+:data:`ACTIVE` records only, and the indexes serving them are partial on
+the same filter, so archived documents take no space in them.
+:func:`soft_delete` also cancels the person's upcoming appointments,
+which frees their slots.
+
+``manage.py archive_records`` moves documents archived more than
+``HOSPITAL_ARCHIVE_AFTER_YEARS`` years ago out of the hot collections into
+``patients_archive`` and ``doctors_archive`` (:func:`move_cold`), in
+batches. Appointments stay where they are, as patient histories and the
+analytics backfill read them, so names of archived people are looked up
+in the archive when they are no longer in the hot collection (see
+:mod:`.lookups`).
+"""
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from pymongo import UpdateOne
+
+from . import bulk, changefeed, history
+from .dates import today
+from .mongo import collection
+
+ARCHIVE_AFTER_YEARS = getattr(settings, 'HOSPITAL_ARCHIVE_AFTER_YEARS', 3)
+ARCHIVE_BATCH_SIZE = getattr(settings, 'HOSPITAL_ARCHIVE_BATCH_SIZE', 1000)
+
+# What every query for current patients and doctors includes; the partial
+# indexes in indexes.INDEXES are only used by queries that say so
+ACTIVE = {'archived': False}
+
+# Appointments referencing these fields are cancelled when the record is archived
+REFERENCES = {'patients': 'patient_id', 'doctors': 'doctor_id'}
+archive_collections = {name: collection(f'{name}_archive') for name in REFERENCES}
+
+
+def active(criteria=None):
+    """``criteria`` restricted to records that aren't archived."""
+    return dict(criteria or {}, **ACTIVE)
+
+
+def cutoff(years=ARCHIVE_AFTER_YEARS, now=None):
+    """When a record must have been archived by to count as cold."""
+    return (now or datetime.now()) - timedelta(days=round(365.25 * years))
+
+
+# ===== SOFT DELETE =====
+def soft_delete(name, hot, record_id, appointments, doctors, patients):
+    """Archive the ``name`` record ``record_id`` and cancel its upcoming appointments.
+
+    Returns ``(document, cancelled)``, with ``document`` ``None`` if there
+    is no such active record. ``doctors`` are the doctor options.
+    """
+    document = hot.find_one_and_update(
+        active({'_id': record_id}),
+        {'$set': changefeed.stamp({'archived': True, 'archived_at': datetime.now()})},
+        projection={REFERENCES[name]: 1},
+    )
+    if document is None:
+        return None, 0
+    return document, cancel_upcoming(REFERENCES[name], record_id, appointments, doctors, patients)
+
+
+def cancel_upcoming(field, record_id, appointments, doctors, patients):
+    """Cancel the scheduled and confirmed appointments from today on whose ``field`` is ``record_id``.
+
+    Goes through :func:`bulk.apply_changes`, so slots, history summaries
+    and analytics follow. Returns how many were cancelled.
+    """
+    criteria = {field: record_id, 'status': {'$in': sorted(history.UPCOMING_STATUSES)},
+                'appointment_date': {'$gte': today()}}
+    keys = [appointment['appointment_id'] for appointment in appointments.find(criteria, {'appointment_id': 1})]
+    cancelled = 0
+    for start in range(0, len(keys), bulk.MAX_CHANGES):
+        changes = [{'appointment_id': key, 'status': 'Cancelled'} for key in keys[start:start + bulk.MAX_CHANGES]]
+        cancelled += bulk.apply_changes(changes, appointments, doctors, patients=patients)['summary']['updated']
+    return cancelled
+
+
+# ===== COLD ARCHIVE =====
+def move_cold(name, hot, cold, before, batch_size=ARCHIVE_BATCH_SIZE):
+    """Move ``name`` records archived before ``before`` from ``hot`` to ``cold``; yields each batch's size.
+
+    Each batch is copied (upserted on ``_id``, so a run interrupted before
+    the delete just copies again) before it is deleted, and leaves change
+    feed tombstones.
+    """
+    criteria = {'archived': True, 'archived_at': {'$lt': before}}
+    while True:
+        documents = list(hot.find(criteria).sort('archived_at', 1).limit(batch_size))
+        if not documents:
+            return
+        cold.bulk_write([
+            UpdateOne({'_id': document['_id']},
+                      {'$set': {field: value for field, value in document.items() if field != '_id'}}, upsert=True)
+            for document in documents
+        ], ordered=False)
+        # Still matching the criteria, in case one was changed since it was read
+        hot.delete_many(dict(criteria, _id={'$in': [document['_id'] for document in documents]}))
+        changefeed.record_deletes(name, documents)
+        yield len(documents)
+        if len(documents) < batch_size:
+            return
+
+
+def mark_active(hot):
+    """Set ``archived: False`` on records written before soft delete existed; returns how many.
+
+    ``ensure_mongo_indexes`` runs this before building the partial indexes.
+    """
+    return hot.update_many({'archived': {'$exists': False}}, {'$set': ACTIVE}).modified_count
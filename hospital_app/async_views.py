@@ -0,0 +1,172 @@
+"""Async versions of the read-heavy list, search and dashboard views.
+
+Enabled with ``HOSPITAL_ASYNC_VIEWS = True`` when serving through
+``hospital/asgi.py``. They talk to MongoDB through pymongo's asyncio
+driver, so a slow query parks a coroutine instead of a worker thread, and
+independent queries on a page run concurrently with ``asyncio.gather``.
+They render the same templates with the same context as :mod:`.views`.
+"""
+import asyncio
+
+from django.contrib.auth.decorators import login_required
+from django.shortcuts import render
+from django.template.loader import render_to_string
+
+from . import doctor_cache, versions
+from .archive import ACTIVE, archive_collections
+from .lookups import aattach_names
+from .mongo import async_collection
+from .pagination import acount_results, apaginate
+from .rows import AppointmentRow, DoctorRow, PatientRow, rows as row_collection
+from .search import SEARCH_LIMIT, asearch_patients
+from .stats import adashboard_stats
+from .views import APPOINTMENT_LIST_SOURCES, appointment_search_criteria, doctor_search_criteria
+
+patients_collection = async_collection('patients')
+doctors_collection = async_collection('doctors')
+appointments_collection = async_collection('appointments')
+archives = {name: async_collection(f'{name}_archive') for name in archive_collections}
+
+
+async def arender(request, template_name, context):
+    # Load the user (and with it the session) without blocking so the
+    # template context processors don't hit the database synchronously.
+    request.user = await request.auser()
+    return render(request, template_name, context)
+
+
+def add_ids(documents):
+    for document in documents:
+        document['id'] = str(document['_id'])
+    return documents
+
+
+# ===== PATIENT MANAGEMENT =====
+@login_required
+@versions.conditional_list('patients')
+async def patient_list(request):
+    async def rows():
+        page = await apaginate(row_collection(patients_collection, PatientRow), ACTIVE, '-registration_date',
+                               request, PatientRow.projection)
+        return render_to_string('hospital_app/patient_rows.html',
+                                versions.fragment_context({'patients': page.items, 'page': page}), request)
+
+    rows_html = await versions.acached_fragment(request, 'patient_list', ('patients',), rows)
+    return await arender(request, 'hospital_app/patient_list.html', {'rows': rows_html})
+
+
+# ===== DOCTOR MANAGEMENT =====
+@login_required
+@versions.conditional_list('doctors')
+async def doctor_list(request):
+    async def rows():
+        page = await doctor_cache.adoctor_page(row_collection(doctors_collection, DoctorRow), ACTIVE,
+                                               'specialization', request, DoctorRow.projection)
+        return render_to_string('hospital_app/doctor_rows.html',
+                                versions.fragment_context({'doctors': page.items, 'page': page}), request)
+
+    rows_html = await versions.acached_fragment(request, 'doctor_list', ('doctors',), rows)
+    return await arender(request, 'hospital_app/doctor_list.html', {'rows': rows_html})
+
+
+# ===== APPOINTMENT MANAGEMENT =====
+@login_required
+@versions.conditional_list(*APPOINTMENT_LIST_SOURCES)
+async def appointment_list(request):
+    async def rows():
+        page = await apaginate(row_collection(appointments_collection, AppointmentRow), {}, '-appointment_date',
+                               request, AppointmentRow.projection)
+        await aattach_names(page.items, patients_collection, doctors_collection, archives)
+        return render_to_string('hospital_app/appointment_rows.html',
+                                versions.fragment_context({'appointments': page.items, 'page': page}), request)
+
+    rows_html = await versions.acached_fragment(request, 'appointment_list', APPOINTMENT_LIST_SOURCES, rows)
+    return await arender(request, 'hospital_app/appointment_list.html', {'rows': rows_html})
+
+
+# ===== SEARCH FUNCTIONALITY =====
+async def search_patients(request):
+    query = request.GET.get('q', '').strip()
+
+    if query:
+        patients = add_ids(await asearch_patients(patients_collection, query))
+        page = None
+        total_results = len(patients)
+    else:
+        page, total_results = await asyncio.gather(
+            apaginate(row_collection(patients_collection, PatientRow), ACTIVE, '-registration_date', request,
+                      PatientRow.projection),
+            acount_results(patients_collection, ACTIVE),
+        )
+        patients = page.items
+
+    return await arender(request, 'hospital_app/search_patients.html', {
+        'patients': patients,
+        'page': page,
+        'query': query,
+        'total_results': total_results,
+        'result_limit': SEARCH_LIMIT,
+    })
+
+
+@login_required
+async def search_doctors(request):
+    query = request.GET.get('q', '')
+    specialization_filter = request.GET.get('specialization', '')
+    department_filter = request.GET.get('department', '')
+
+    search_criteria = doctor_search_criteria(query, specialization_filter, department_filter)
+
+    page, facets, total_results = await asyncio.gather(
+        doctor_cache.adoctor_page(row_collection(doctors_collection, DoctorRow), search_criteria, 'specialization',
+                                  request, DoctorRow.projection),
+        doctor_cache.afacets(doctors_collection),
+        doctor_cache.adoctor_count(doctors_collection, search_criteria),
+    )
+
+    return await arender(request, 'hospital_app/search_doctors.html', {
+        'doctors': page.items,
+        'page': page,
+        'query': query,
+        'specializations': facets['specializations'],
+        'departments': facets['departments'],
+        'selected_specialization': specialization_filter,
+        'selected_department': department_filter,
+        'total_results': total_results,
+    })
+
+
+@login_required
+async def search_appointments(request):
+    query = request.GET.get('q', '')
+    status_filter = request.GET.get('status', '')
+    date_filter = request.GET.get('date', '')
+    date_from = request.GET.get('from', '')
+    date_to = request.GET.get('to', '')
+
+    search_criteria = appointment_search_criteria(query, status_filter, date_filter, date_from, date_to)
+
+    page, total_results = await asyncio.gather(
+        apaginate(row_collection(appointments_collection, AppointmentRow), search_criteria, '-appointment_date',
+                  request, AppointmentRow.projection),
+        acount_results(appointments_collection, search_criteria),
+    )
+    await aattach_names(page.items, patients_collection, doctors_collection, archives)
+
+    return await arender(request, 'hospital_app/search_appointments.html', {
+        'appointments': page.items,
+        'page': page,
+        'query': query,
+        'selected_status': status_filter,
+        'selected_date': date_filter,
+        'selected_from': date_from,
+        'selected_to': date_to,
+        'total_results': total_results,
+    })
+
+
+# ===== STAFF DASHBOARD =====
+@login_required
+async def staff_dashboard(request):
+    context = dict(await adashboard_stats(), user=await request.auser())
+    return await arender(request, 'hospital_app/staff_dashboard.html', context)
@@ -0,0 +1,177 @@
+"""Helpers for benchmarking views without a real MongoDB.
+
+``LatencyCollection`` and ``AsyncLatencyCollection`` stand in for pymongo
+collections: every round trip (cursor fetch, count, distinct) costs a fixed,
+configurable latency and returns canned documents. Filters are ignored, so
+the numbers measure how a view's query pattern behaves under I/O latency,
+not query correctness.
+
+:func:`compare_baselines` diffs two JSON baselines written by
+``manage.py benchmark_views``.
+"""
+import asyncio
+import copy
+import resource
+import statistics
+import sys
+import time
+
+from bson.codec_options import CodecOptions
+
+
+class LatencyCursor:
+    def __init__(self, collection, projection=None):
+        self.collection = collection
+        self.projection = projection
+        self._limit = 0
+
+    def sort(self, *args, **kwargs):
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def _documents(self):
+        documents = self.collection.documents
+        if self._limit:
+            documents = documents[:self._limit]
+        # Projected and decoded like pymongo would, so row classes get only their fields
+        wanted = {key.split('.')[0] for key, value in (self.projection or {}).items() if value}
+        document_class = self.collection.codec_options.document_class
+        return [document_class({key: value for key, value in document.items()
+                                if not wanted or key == '_id' or key in wanted})
+                for document in documents]
+
+    def __iter__(self):
+        time.sleep(self.collection.latency)
+        return iter(self._documents())
+
+
+class AsyncLatencyCursor(LatencyCursor):
+    async def to_list(self, length=None):
+        await asyncio.sleep(self.collection.latency)
+        return self._documents()
+
+
+class LatencyCollection:
+    """Blocking collection stand-in with a fixed latency per round trip."""
+
+    cursor_class = LatencyCursor
+
+    def __init__(self, name, documents, latency):
+        self.name = name
+        self.documents = list(documents)
+        self.latency = latency
+        self.codec_options = CodecOptions()
+
+    def with_options(self, codec_options=None, **kwargs):
+        # A view onto the same documents, like pymongo's
+        view = copy.copy(self)
+        if codec_options is not None:
+            view.codec_options = codec_options
+        return view
+
+    def find(self, criteria=None, projection=None, *args, **kwargs):
+        return self.cursor_class(self, projection)
+
+    def _wait(self):
+        time.sleep(self.latency)
+
+    def count_documents(self, criteria=None):
+        self._wait()
+        return len(self.documents)
+
+    def estimated_document_count(self):
+        self._wait()
+        return len(self.documents)
+
+    def distinct(self, field, criteria=None):
+        self._wait()
+        return sorted({document.get(field) for document in self.documents if document.get(field)})
+
+    def aggregate(self, pipeline):
+        self._wait()
+        return iter([])
+
+
+class AsyncLatencyCollection(LatencyCollection):
+    """Asyncio collection stand-in with a fixed latency per round trip."""
+
+    cursor_class = AsyncLatencyCursor
+
+    async def _wait(self):
+        await asyncio.sleep(self.latency)
+
+    async def count_documents(self, criteria=None):
+        await self._wait()
+        return len(self.documents)
+
+    async def estimated_document_count(self):
+        await self._wait()
+        return len(self.documents)
+
+    async def distinct(self, field, criteria=None):
+        await self._wait()
+        return sorted({document.get(field) for document in self.documents if document.get(field)})
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of ``values``."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(percent / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+
+def summarize(latencies, elapsed):
+    """Throughput and latency percentiles (in milliseconds) for one run."""
+    return {
+        'requests': len(latencies),
+        'rps': len(latencies) / elapsed if elapsed else 0.0,
+        'mean_ms': statistics.fmean(latencies) * 1000 if latencies else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+
+async def drive(call, total, concurrency):
+    """Await ``call()`` ``total`` times with at most ``concurrency`` in flight."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def peak_rss_kb():
+    """Peak resident set size of this process so far, in KiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak  # bytes on macOS
+
+
+def compare_baselines(old, new, threshold=10.0):
+    """Per-endpoint changes between two baselines.
+
+    Returns ``(endpoint, old, new, p95_change_percent, regressed)`` rows for
+    endpoints present in both. An endpoint regressed if its p95 latency
+    grew by more than ``threshold`` percent or it issues more queries.
+    """
+    rows = []
+    for endpoint, after in new['endpoints'].items():
+        before = old['endpoints'].get(endpoint)
+        if before is None:
+            continue
+        change = (after['p95_ms'] / before['p95_ms'] - 1) * 100 if before['p95_ms'] else 0.0
+        regressed = change > threshold or after['queries_max'] > before['queries_max']
+        rows.append((endpoint, before, after, change, regressed))
+    return rows
@@ -0,0 +1,375 @@
+"""Bulk appointment changes: status transitions and reschedules.
+
+When a doctor calls in sick the front desk has dozens of appointments to
+cancel or move. :func:`apply_changes` takes a list of changes, each naming
+an appointment by ``appointment_id`` plus any of ``status``,
+``appointment_date``, ``time_slot`` and ``doctor_id``. :func:`apply_edit`
+selects appointments (by doctor, date range, status or ids) and applies
+one edit to all of them, ``shift_days`` moving each by that many days.
+Either way the batch costs the same handful of round trips whatever its
+size:
+
+1. one ``$in`` query loads the appointments (``apply_edit``'s selection
+   query does this);
+2. one query loads the ``doctor_schedules`` days the batch moves into,
+   and slot conflicts are checked over the whole batch in memory. A slot
+   freed by one change can be taken by another (two appointments can
+   swap), and two changes can't claim the same slot;
+3. one unordered ``bulk_write`` claims the new slots. Each claim is the
+   conditional upsert :func:`scheduling.reserve` uses, so a slot booked
+   concurrently fails its claim instead of being double booked;
+4. one unordered ``bulk_write`` updates the appointments. Each update is
+   filtered on the fields that were read, so an appointment edited
+   meanwhile is left alone;
+5. one unordered ``bulk_write`` releases the old slots of the appointments
+   that were written (and the new slots of those that weren't), so a
+   failed move never gives up the slot its appointment still holds;
+6. the patients' history summaries and the analytics rollups are
+   updated with a few more (:func:`history.record`, :func:`analytics.record`).
+
+Every change gets an outcome: ``updated``, ``unchanged``, ``conflict``
+(the slot is taken, or another writer got there first; its slot changes
+are undone) or ``error`` (invalid). With ``dry_run`` nothing is written
+and ``updated`` means "would be updated".
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from . import analytics, changefeed, history, scheduling, versions
+from .dates import day_range, parse_day
+from .mongo import patients_collection
+from .scheduling import SLOTS, STATUSES, holds_slot, slot_of, working_slots
+
+MAX_CHANGES = getattr(settings, 'HOSPITAL_BULK_APPOINTMENT_LIMIT', 5000)
+
+FIELDS = ('status', 'appointment_date', 'time_slot', 'doctor_id')
+READ_FIELDS = {'appointment_id': 1, 'patient_id': 1, 'doctor_id': 1, 'appointment_date': 1, 'time_slot': 1,
+               'status': 1}
+SELECTORS = ('doctor_id', 'from', 'to', 'status', 'appointment_ids')
+OUTCOMES = ('updated', 'unchanged', 'conflict', 'error')
+
+
+class BulkError(ValueError):
+    """A change that can't be applied, or a request that can't be run at all."""
+
+
+def _outcome(index, key, status, error=None):
+    outcome = {'index': index, 'appointment_id': key, 'status': status}
+    if error:
+        outcome['error'] = error
+    return outcome
+
+
+def doctor_index(doctors):
+    """Doctors by ObjectId hex and by ``doctor_id``."""
+    index = {}
+    for doctor in doctors:
+        index[str(doctor['_id'])] = doctor
+        if doctor.get('doctor_id'):
+            index[doctor['doctor_id']] = doctor
+    return index
+
+
+def _doctor(doctors, value):
+    doctor = doctors.get(str(value))
+    if doctor is None:
+        raise BulkError(f"doctor {value!r} not found")
+    return doctor
+
+
+def _day(value):
+    try:
+        return parse_day(value)
+    except (TypeError, ValueError):
+        raise BulkError(f"invalid date {value!r}; use YYYY-MM-DD")
+
+
+def normalize_change(change, doctors):
+    """The validated ``$set`` fields of one change; raises :class:`BulkError`."""
+    unknown = sorted(set(change) - set(FIELDS) - {'appointment_id'})
+    if unknown:
+        raise BulkError(f"unknown fields: {', '.join(unknown)}")
+    fields = {}
+    if 'status' in change:
+        if change['status'] not in STATUSES:
+            raise BulkError(f"invalid status {change['status']!r}")
+        fields['status'] = change['status']
+    if 'appointment_date' in change:
+        fields['appointment_date'] = _day(change['appointment_date'])
+    if 'time_slot' in change:
+        if change['time_slot'] not in SLOTS:
+            raise BulkError(f"invalid time slot {change['time_slot']!r}")
+        fields['time_slot'] = change['time_slot']
+    if 'doctor_id' in change:
+        doctor = _doctor(doctors, change['doctor_id'])
+        if doctor.get('archived'):
+            raise BulkError(f"doctor {change['doctor_id']!r} is archived")
+        fields['doctor_id'] = doctor['_id']
+    if not fields:
+        raise BulkError("nothing to change")
+    return fields
+
+
+def selection_criteria(selection, doctors):
+    """The appointments filter for a ``{doctor_id, from, to, status, appointment_ids}`` selection."""
+    if not isinstance(selection, dict) or not any(selection.get(key) for key in SELECTORS):
+        raise BulkError(f"select appointments by {', '.join(SELECTORS)}")
+    unknown = sorted(set(selection) - set(SELECTORS))
+    if unknown:
+        raise BulkError(f"unknown selectors: {', '.join(unknown)}")
+    criteria = {}
+    if selection.get('doctor_id'):
+        criteria['doctor_id'] = _doctor(doctors, selection['doctor_id'])['_id']
+    if selection.get('from') or selection.get('to'):
+        try:
+            criteria['appointment_date'] = day_range(selection.get('from'), selection.get('to'))
+        except (TypeError, ValueError):
+            raise BulkError("invalid from/to; use YYYY-MM-DD")
+    if selection.get('status'):
+        statuses = selection['status'] if isinstance(selection['status'], list) else [selection['status']]
+        invalid = [status for status in statuses if status not in STATUSES]
+        if invalid:
+            raise BulkError(f"invalid status {invalid[0]!r}")
+        criteria['status'] = {'$in': statuses}
+    if selection.get('appointment_ids'):
+        criteria['appointment_id'] = {'$in': list(selection['appointment_ids'])}
+    return criteria
+
+
+def apply_changes(changes, appointments, doctors, dry_run=False, schedules=None, patients=None):
+    """Apply per-appointment ``changes``; returns ``{'results': [...], 'summary': {...}}``.
+
+    ``doctors`` are the doctor options (see :func:`doctor_cache.doctor_options`); ``schedules``
+    and ``patients`` (whose history summaries are kept up to date) default to the
+    ``doctor_schedules`` and ``patients`` collections.
+    """
+    if not isinstance(changes, list):
+        raise BulkError('"changes" must be a list')
+    if len(changes) > MAX_CHANGES:
+        raise BulkError(f"At most {MAX_CHANGES} changes per request.")
+    doctors = doctor_index(doctors)
+    report = [None] * len(changes)
+    planned = {}
+    for index, change in enumerate(changes):
+        key = change.get('appointment_id') if isinstance(change, dict) else None
+        try:
+            if not key:
+                raise BulkError("appointment_id is required")
+            fields = normalize_change(change, doctors)
+        except BulkError as error:
+            report[index] = _outcome(index, key, 'error', str(error))
+            continue
+        if key in planned:
+            earlier = planned[key][0]
+            report[earlier] = _outcome(earlier, key, 'error', f"superseded by change {index}")
+        planned[key] = (index, fields)
+    current = {}
+    if planned:
+        current = {appointment['appointment_id']: appointment for appointment in
+                   appointments.find({'appointment_id': {'$in': list(planned)}}, READ_FIELDS)}
+    return _execute(planned, current, appointments, doctors, report, dry_run, schedules, patients)
+
+
+def apply_edit(selection, edit, appointments, doctors, dry_run=False, schedules=None, patients=None):
+    """Apply ``edit`` (change fields, or ``shift_days``) to every appointment matching ``selection``."""
+    doctors_by_id = doctor_index(doctors)
+    criteria = selection_criteria(selection, doctors_by_id)
+    if not isinstance(edit, dict) or not edit:
+        raise BulkError('"set" must name the fields to change')
+    shift = edit.get('shift_days')
+    if shift is not None and (not isinstance(shift, int) or isinstance(shift, bool) or 'appointment_date' in edit):
+        raise BulkError('"shift_days" must be a whole number of days, without "appointment_date"')
+    edit = {field: value for field, value in edit.items() if field != 'shift_days'}
+    fields = normalize_change(edit, doctors_by_id) if edit else {}
+
+    found = list(appointments.find(criteria, READ_FIELDS).sort('appointment_date', 1).limit(MAX_CHANGES + 1))
+    if len(found) > MAX_CHANGES:
+        raise BulkError(f"The selection matches more than {MAX_CHANGES} appointments; narrow it.")
+    planned, current = {}, {}
+    for index, appointment in enumerate(found):
+        changed = dict(fields)
+        if shift:
+            changed['appointment_date'] = parse_day(appointment['appointment_date']) + timedelta(days=shift)
+        planned[appointment['appointment_id']] = (index, changed)
+        current[appointment['appointment_id']] = appointment
+    return _execute(planned, current, appointments, doctors_by_id, [None] * len(found), dry_run, schedules,
+                    patients)
+
+
+# ===== EXECUTION =====
+def _execute(planned, current, appointments, doctors, report, dry_run, schedules, patients):
+    schedules = scheduling.schedules_collection if schedules is None else schedules
+    patients = patients_collection if patients is None else patients
+    moves = {}
+    for key, (index, fields) in planned.items():
+        appointment = current.get(key)
+        if appointment is None:
+            report[index] = _outcome(index, key, 'error', "appointment not found")
+            continue
+        if all(appointment.get(field) == value for field, value in fields.items()):
+            report[index] = _outcome(index, key, 'unchanged')
+            continue
+        updated = dict(appointment, **fields)
+        before = slot_of(appointment) if holds_slot(appointment) else None
+        after = slot_of(updated) if holds_slot(updated) else None
+        if before == after:
+            before = after = None
+        if after:
+            doctor = doctors.get(str(updated['doctor_id']))
+            if doctor is None:
+                report[index] = _outcome(index, key, 'error', "doctor not found")
+                continue
+            if updated['time_slot'] not in working_slots(doctor):
+                report[index] = _outcome(index, key, 'error', f"Dr. {doctor.get('last_name', '')} does not work "
+                                                               f"the {updated['time_slot']} slot")
+                continue
+        moves[index] = {'key': key, 'appointment': appointment, 'fields': fields, 'before': before, 'after': after}
+
+    for index, reason in _slot_conflicts(moves, schedules).items():
+        report[index] = _outcome(index, moves.pop(index)['key'], 'conflict', reason)
+
+    if moves and not dry_run:
+        for index in _write(moves, appointments, schedules):
+            report[index] = _outcome(index, moves.pop(index)['key'], 'conflict',
+                                     "changed by someone else meanwhile; retry")
+        if moves:
+            changes = [(move['appointment'], dict(move['appointment'], **move['fields'])) for move in moves.values()]
+            history.record(changes, patients, appointments)
+            analytics.record(changes, doctors.values())
+            versions.bump('appointments')
+    for index, move in moves.items():
+        report[index] = _outcome(index, move['key'], 'updated')
+
+    summary = {status: sum(1 for item in report if item['status'] == status) for status in OUTCOMES}
+    return {'results': report, 'summary': summary, 'dry_run': dry_run}
+
+
+def _slot_conflicts(moves, schedules):
+    """Why each move that can't get its new slot fails, by index, checked in one pass over one query."""
+    targets = [move['after'] for move in moves.values() if move['after']]
+    if not targets:
+        return {}
+    booked = {}
+    query = {'doctor_id': {'$in': list({doctor_id for doctor_id, _, _ in targets})},
+             'date': {'$in': list({day for _, day, _ in targets})}}
+    for schedule in schedules.find(query, {'doctor_id': 1, 'date': 1, 'booked': 1}):
+        booked[schedule['doctor_id'], schedule['date']] = set(schedule['booked'])
+
+    failed = {}
+    while True:
+        # Slots given up by the moves still going ahead can be taken by others
+        released = {move['before'] for index, move in moves.items() if index not in failed and move['before']}
+        claimed, newly = {}, {}
+        for index in sorted(moves):
+            after = moves[index]['after']
+            if index in failed or not after:
+                continue
+            doctor_id, day, slot = after
+            if after in claimed:
+                newly[index] = f"{slot} on {day} is also requested by change {claimed[after]}"
+            elif slot in booked.get((doctor_id, day), ()) and after not in released:
+                newly[index] = f"{slot} on {day} is already booked"
+            else:
+                claimed[after] = index
+        if not newly:
+            return failed
+        # A failed move keeps its slot, which may undo a claim that relied on it
+        failed.update(newly)
+
+
+def _write(moves, appointments, schedules):
+    """Write the slot changes and appointments of ``moves``; returns the indexes that lost a race.
+
+    New slots are claimed before old ones are released, as in
+    :func:`scheduling.move`, so a move that fails never gives up the slot
+    its appointment still holds. A slot one move gives up and another takes
+    (a swap) stays booked throughout.
+    """
+    releasers = {move['before']: index for index, move in moves.items() if move['before']}
+    # Index of the move taking a slot -> index of the move giving it up
+    handed = {index: releasers[move['after']] for index, move in moves.items()
+              if move['after'] in releasers and releasers[move['after']] != index}
+    claims = defaultdict(list)
+    for index, move in moves.items():
+        if move['after'] and index not in handed:
+            claims[move['after'][:2]].append((move['after'][2], index))
+    lost = _claim(claims, schedules)
+    # A move that keeps its old slot leaves the move counting on that slot without one
+    while True:
+        newly = {index for index, releaser in handed.items() if releaser in lost and index not in lost}
+        if not newly:
+            break
+        lost |= newly
+
+    written = [index for index in moves if index not in lost]
+    stale = set()
+    if written:
+        requests = []
+        for index in written:
+            move = moves[index]
+            expected = {field: move['appointment'].get(field) for field in READ_FIELDS}
+            expected['_id'] = move['appointment']['_id']
+            requests.append(UpdateOne(expected, {'$set': changefeed.stamp(dict(move['fields']))}))
+        result = appointments.bulk_write(requests, ordered=False)
+        if result.matched_count < len(requests):
+            stale = _unmatched([moves[index] for index in written], written, appointments)
+
+    done = {index for index in written if index not in stale}
+    # Slots taken over by a written move stay booked
+    kept = {moves[index]['after'] for index in handed if index in done}
+    releases = defaultdict(list)
+    for index in done:
+        before = moves[index]['before']
+        if before and before not in kept:
+            releases[before[:2]].append(before[2])
+    # Stale moves' appointments still sit in their old slots; free the new slots they claimed
+    for index in stale:
+        if moves[index]['after'] and index not in handed:
+            releases[moves[index]['after'][:2]].append(moves[index]['after'][2])
+    if releases:
+        schedules.bulk_write([
+            UpdateOne({'doctor_id': doctor_id, 'date': day}, {'$pull': {'booked': {'$in': slots}}})
+            for (doctor_id, day), slots in releases.items()
+        ], ordered=False)
+    return lost | stale
+
+
+def _claim(claims, schedules):
+    """Claim ``claims`` (``{(doctor_id, day): [(slot, index)]}``), one conditional upsert per day.
+
+    Returns the indexes whose day couldn't take their slots.
+    """
+    if not claims:
+        return set()
+    groups = list(claims.items())
+    updates = []
+    for (doctor_id, day), items in groups:
+        slots = [slot for slot, _ in items]
+        updates.append(({'doctor_id': doctor_id, 'date': day, 'booked': {'$nin': slots}},
+                        {'$addToSet': {'booked': {'$each': slots}}}))
+    lost = set()
+    try:
+        schedules.bulk_write([UpdateOne(criteria, update, upsert=True) for criteria, update in updates],
+                             ordered=False)
+    except BulkWriteError as error:
+        for write_error in error.details.get('writeErrors', []):
+            # As in scheduling.reserve: a concurrent first booking of that day
+            # created its document, so try once more as a plain update
+            if write_error.get('code') == 11000 and schedules.update_one(*updates[write_error['index']]).matched_count:
+                continue
+            # A slot on that day was booked since it was read
+            lost.update(index for _, index in groups[write_error['index']][1])
+    return lost
+
+
+def _unmatched(moves, indexes, appointments):
+    """Indexes of ``moves`` whose appointment doesn't hold the new values (edited by someone else)."""
+    stored = {document['_id']: document for document in
+              appointments.find({'_id': {'$in': [move['appointment']['_id'] for move in moves]}}, READ_FIELDS)}
+    return {index for index, move in zip(indexes, moves)
+            if any((stored.get(move['appointment']['_id']) or {}).get(field) != value
+                   for field, value in move['fields'].items())}
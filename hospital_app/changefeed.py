@@ -0,0 +1,282 @@
+"""Incremental change feed over patients, doctors and appointments.
+
+Downstream systems read the changes since their last checkpoint instead of
+re-pulling whole collections. Two sources produce the same events:
+
+* ``stream`` - a MongoDB change stream on the database (replica sets
+  only), filtered to the three collections, with ``updateLookup`` so each
+  event carries the current document;
+* ``watermark`` - works on any deployment. Every write stamps
+  ``updated_at`` on the document (:func:`stamp`), deletes leave a tombstone
+  in ``deleted_records`` (:func:`record_delete`), and the feed reads both
+  in ``(updated_at, _id)`` order through the ``updated_at`` indexes. Writes
+  stamped within the last ``HOSPITAL_CHANGE_FEED_LAG_SECONDS`` are held
+  back so one still in flight isn't skipped.
+
+``HOSPITAL_CHANGE_FEED`` picks the source; ``auto`` uses a change stream
+when the server supports one. Each event::
+
+    {'collection': 'patients', 'operation': 'upsert' | 'delete', 'id': ObjectId,
+     'key': 'PAT000042', 'document': {...} | None, 'at': datetime}
+
+comes with an opaque checkpoint (a resume token or a watermark position).
+Reading from an event's checkpoint returns exactly the events after it,
+so a consumer that saves the checkpoint after processing a batch
+(:func:`save_checkpoint`) gets every change at least once across
+restarts. Deleted documents only appear as tombstones for
+``HOSPITAL_CHANGE_FEED_TOMBSTONE_DAYS``; consumers further behind resync
+through the API.
+"""
+import base64
+import heapq
+import time
+from datetime import datetime, timedelta, timezone
+
+from bson import json_util
+from django.conf import settings
+from pymongo.errors import ConnectionFailure, OperationFailure
+
+from . import mongo
+from .mongo import collection
+
+SOURCE = getattr(settings, 'HOSPITAL_CHANGE_FEED', 'auto')
+LAG_SECONDS = getattr(settings, 'HOSPITAL_CHANGE_FEED_LAG_SECONDS', 2)
+POLL_SECONDS = getattr(settings, 'HOSPITAL_CHANGE_FEED_POLL_SECONDS', 1)
+TOMBSTONE_DAYS = getattr(settings, 'HOSPITAL_CHANGE_FEED_TOMBSTONE_DAYS', 30)
+
+KEYS = {'patients': 'patient_id', 'doctors': 'doctor_id', 'appointments': 'appointment_id'}
+UPSERT = 'upsert'
+DELETE = 'delete'
+
+# The watermark feed reads these; the change stream watches the same names
+feed_collections = {name: collection(name) for name in KEYS}
+tombstones_collection = collection('deleted_records')
+checkpoints_collection = collection('change_checkpoints')
+
+_detected_source = None
+
+
+class CheckpointError(ValueError):
+    pass
+
+
+def now():
+    # At BSON's millisecond precision, so checkpoints match stored values
+    value = datetime.now(timezone.utc)
+    return value.replace(microsecond=value.microsecond // 1000 * 1000)
+
+
+def _utc(value):
+    return value if value is None or value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+# ===== WRITING =====
+def stamp(fields):
+    """Set ``updated_at`` on a document or ``$set`` dict; returns it."""
+    fields['updated_at'] = now()
+    return fields
+
+
+def _tombstone(name, document):
+    return {
+        'collection': name,
+        'record_id': document['_id'],
+        'key': document.get(KEYS[name]),
+        'updated_at': now(),
+    }
+
+
+def record_delete(name, document):
+    """Leave a tombstone for a deleted ``name`` document (the watermark feed can't see deletes)."""
+    tombstones_collection.insert_one(_tombstone(name, document))
+
+
+def record_deletes(name, documents):
+    """:func:`record_delete` for a batch of documents, in one insert."""
+    if documents:
+        tombstones_collection.insert_many([_tombstone(name, document) for document in documents], ordered=False)
+
+
+# ===== CHECKPOINTS =====
+def encode_checkpoint(position):
+    payload = json_util.dumps(position)
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_checkpoint(checkpoint):
+    """The position behind an opaque checkpoint (``None`` for none); raises :class:`CheckpointError`."""
+    if not checkpoint:
+        return None
+    try:
+        padded = checkpoint + '=' * (-len(checkpoint) % 4)
+        position = json_util.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, TypeError):
+        raise CheckpointError("Malformed checkpoint.")
+    if not isinstance(position, dict) or position.get('s') not in ('stream', 'watermark'):
+        raise CheckpointError("Malformed checkpoint.")
+    return position
+
+
+def load_checkpoint(consumer):
+    document = checkpoints_collection.find_one({'_id': consumer})
+    return document['checkpoint'] if document else None
+
+
+def save_checkpoint(consumer, checkpoint):
+    checkpoints_collection.update_one(
+        {'_id': consumer},
+        {'$set': {'checkpoint': checkpoint, 'updated_at': now()}},
+        upsert=True,
+    )
+
+
+# ===== READING =====
+def source():
+    """``'stream'`` or ``'watermark'``, probing the server once when set to ``auto``."""
+    global _detected_source
+    if SOURCE != 'auto':
+        return SOURCE
+    if _detected_source is None:
+        watch = getattr(mongo.get_db(), 'watch', None)
+        if not callable(watch):
+            # A stand-in database without change streams
+            _detected_source = 'watermark'
+            return _detected_source
+        try:
+            with watch(_stream_pipeline(), max_await_time_ms=1) as stream:
+                stream.try_next()
+            _detected_source = 'stream'
+        except OperationFailure:
+            # Standalone servers have no oplog to stream from
+            _detected_source = 'watermark'
+        except ConnectionFailure:
+            # Not remembered: the server may support streams once it's reachable
+            return 'watermark'
+    return _detected_source
+
+
+def _project(document, projections, name):
+    fields = (projections or {}).get(name)
+    if fields:
+        document = {field: value for field, value in document.items() if field == '_id' or field in fields}
+    return document
+
+
+def _event(name, operation, record_id, key, document, at):
+    if document is not None:
+        document = {field: value for field, value in document.items() if field != '_id'}
+    return {'collection': name, 'operation': operation, 'id': record_id, 'key': key, 'document': document,
+            'at': _utc(at)}
+
+
+def _stream_pipeline():
+    return [{'$match': {'ns.coll': {'$in': list(KEYS)},
+                        'operationType': {'$in': ['insert', 'update', 'replace', 'delete']}}}]
+
+
+def _from_stream(change, projections):
+    name = change['ns']['coll']
+    record_id = change['documentKey']['_id']
+    document = change.get('fullDocument')
+    at = change.get('wallTime') or now()
+    if change['operationType'] == 'delete' or document is None:
+        # With updateLookup a document deleted in the meantime comes back empty
+        return _event(name, DELETE, record_id, None, None, at)
+    return _event(name, UPSERT, record_id, document.get(KEYS[name]), _project(document, projections, name), at)
+
+
+def _read_stream(position, limit, wait, projections):
+    options = {'full_document': 'updateLookup', 'max_await_time_ms': int(min(wait, POLL_SECONDS) * 1000) or 1}
+    if position:
+        options['resume_after'] = position['r']
+    changes = []
+    deadline = time.monotonic() + wait
+    with mongo.get_db().watch(_stream_pipeline(), **options) as stream:
+        while len(changes) < limit:
+            change = stream.try_next()
+            if change is None:
+                if changes or time.monotonic() >= deadline:
+                    break
+                continue
+            changes.append((encode_checkpoint({'s': 'stream', 'r': change['_id']}),
+                            _from_stream(change, projections)))
+        # The post-batch token moves an idle consumer's checkpoint forward too
+        token = stream.resume_token or (position or {}).get('r')
+        end = encode_checkpoint({'s': 'stream', 'r': token}) if token else None
+    return changes, (changes[-1][0] if changes else end)
+
+
+def _after(position, upper):
+    criteria = {'updated_at': {'$lte': upper}}
+    if position is None:
+        return criteria
+    since = _utc(position['t'])
+    if position.get('id') is None:
+        seek = {'updated_at': {'$gt': since}}
+    else:
+        seek = {'$or': [{'updated_at': {'$gt': since}}, {'updated_at': since, '_id': {'$gt': position['id']}}]}
+    return {'$and': [criteria, seek]}
+
+
+def _ordered(name, documents):
+    for document in documents:
+        yield _utc(document['updated_at']), document['_id'], name, document
+
+
+def _watermark_batch(position, limit, projections):
+    upper = now() - timedelta(seconds=LAG_SECONDS)
+    criteria = _after(position, upper)
+    order = [('updated_at', 1), ('_id', 1)]
+    streams = []
+    for name, feed_collection in feed_collections.items():
+        fields = (projections or {}).get(name)
+        projection = dict({field: 1 for field in fields}, updated_at=1) if fields else None
+        streams.append(_ordered(name, feed_collection.find(criteria, projection).sort(order).limit(limit)))
+    streams.append(_ordered(None, tombstones_collection.find(criteria).sort(order).limit(limit)))
+
+    changes = []
+    for at, sequence_id, name, document in heapq.merge(*streams, key=lambda item: (item[0], item[1])):
+        if len(changes) >= limit:
+            break
+        if name is None:
+            event = _event(document['collection'], DELETE, document['record_id'], document.get('key'), None, at)
+        else:
+            event = _event(name, UPSERT, document['_id'], document.get(KEYS[name]),
+                           _project(document, projections, name), at)
+        changes.append((encode_checkpoint({'s': 'watermark', 't': at, 'id': sequence_id}), event))
+    if changes:
+        return changes, changes[-1][0]
+    # Everything up to ``upper`` has been seen
+    return changes, encode_checkpoint({'s': 'watermark', 't': upper, 'id': None})
+
+
+def _read_watermark(position, limit, wait, projections):
+    deadline = time.monotonic() + wait
+    while True:
+        changes, end = _watermark_batch(position, limit, projections)
+        if changes or time.monotonic() >= deadline:
+            return changes, end
+        time.sleep(min(POLL_SECONDS, max(0.0, deadline - time.monotonic())))
+
+
+def check_checkpoint(checkpoint):
+    """Decode ``checkpoint`` and check it belongs to this server's feed."""
+    position = decode_checkpoint(checkpoint)
+    feed = source()
+    if position is not None and position['s'] != feed:
+        raise CheckpointError(f"That checkpoint is from the {position['s']} feed; this server uses the {feed} "
+                              "feed. Resync and start a new checkpoint.")
+    return position
+
+
+def read_changes(checkpoint=None, limit=500, wait=0, projections=None):
+    """Up to ``limit`` changes after ``checkpoint``, waiting up to ``wait`` seconds for the first.
+
+    Returns ``([(checkpoint, event), ...], end_checkpoint)``; ``end_checkpoint``
+    is where to continue from. ``projections`` maps collection names to the
+    document fields to include (all fields when missing).
+    """
+    position = check_checkpoint(checkpoint)
+    if source() == 'stream':
+        return _read_stream(position, limit, wait, projections)
+    return _read_watermark(position, limit, wait, projections)
@@ -0,0 +1,37 @@
+"""Calendar-day values for ``appointment_date``.
+
+Appointment dates are stored as BSON dates at midnight (naive, i.e. UTC
+midnight, which is what pymongo writes for a naive ``datetime``) rather
+than as the ``YYYY-MM-DD`` strings the forms post. Day ranges are then
+plain ``$gte``/``$lt`` bounds that an index on ``appointment_date`` can
+scan, and ordering no longer depends on how the string was formatted.
+``manage.py migrate_appointment_dates`` converts older string values.
+"""
+from datetime import date, datetime, timedelta
+
+
+def parse_day(value):
+    """``YYYY-MM-DD`` (or a ``date``/``datetime``) as a midnight ``datetime``.
+
+    Raises ``ValueError`` for anything else.
+    """
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    return datetime.combine(date.fromisoformat(str(value).strip()), datetime.min.time())
+
+
+def today():
+    return parse_day(date.today())
+
+
+def day_range(date_from=None, date_to=None):
+    """Bounds matching every instant of the days ``date_from`` through ``date_to``.
+
+    Either end may be omitted; returns ``{}`` when both are.
+    """
+    bounds = {}
+    if date_from:
+        bounds['$gte'] = parse_day(date_from)
+    if date_to:
+        bounds['$lt'] = parse_day(date_to) + timedelta(days=1)
+    return bounds
@@ -0,0 +1,173 @@
+"""Read-through cache for doctor reference data.
+
+Doctors change rarely but are read on almost every page (booking forms,
+doctor list, search facets). Cached values live in the Django cache
+configured by ``HOSPITAL_DOCTOR_CACHE`` (locmem by default, any shared
+backend in production) under keys that embed a version number.
+:func:`invalidate` bumps the version, which orphans every cached entry at
+once without having to know their keys; orphans simply expire.
+"""
+import asyncio
+import hashlib
+import threading
+
+from bson import json_util
+from django.conf import settings
+from django.core.cache import caches
+
+from .archive import ACTIVE
+from .pagination import apaginate, page_params, paginate
+
+CACHE_ALIAS = getattr(settings, 'HOSPITAL_DOCTOR_CACHE', 'default')
+CACHE_SECONDS = getattr(settings, 'HOSPITAL_DOCTOR_CACHE_SECONDS', 300)
+VERSION_KEY = 'doctors:version'
+
+# Fields the booking forms need to render a doctor option
+# and to compute its free slots (plus the fee analytics needs)
+OPTION_FIELDS = {'doctor_id': 1, 'first_name': 1, 'last_name': 1, 'specialization': 1, 'department': 1,
+                 'working_slots': 1, 'consultation_fee': 1, 'archived': 1}
+
+
+class CacheStats:
+    """Process-local hit/miss counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def snapshot(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_ratio': self.hits / total if total else 0.0,
+            }
+
+
+stats = CacheStats()
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def current_version():
+    cache = get_cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, 1, None)
+        version = cache.get(VERSION_KEY, 1)
+    return version
+
+
+def invalidate():
+    """Drop every cached doctor value by moving to a new version."""
+    cache = get_cache()
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        # Key evicted or never set: any fresh version number works as long
+        # as it can't collide with entries still cached under the old one.
+        cache.set(VERSION_KEY, current_version() + 1, None)
+    with stats._lock:
+        stats.invalidations += 1
+
+
+def _key(version, parts):
+    digest = hashlib.md5(json_util.dumps(parts, sort_keys=True).encode()).hexdigest()
+    return f'doctors:v{version}:{digest}'
+
+
+def make_key(*parts):
+    return _key(current_version(), parts)
+
+
+def cached(parts, producer):
+    """Return the cached value for ``parts``, computing it with ``producer`` on a miss."""
+    cache = get_cache()
+    key = make_key(*parts)
+    value = cache.get(key)
+    stats.record(hit=value is not None)
+    if value is None:
+        value = producer()
+        cache.set(key, value, CACHE_SECONDS)
+    return value
+
+
+def doctor_options(collection):
+    """All doctors, archived ones included (their appointments still name them),
+    projected to the fields needed for a select box."""
+    return cached(('options',), lambda: list(collection.find({}, OPTION_FIELDS).sort('last_name', 1)))
+
+
+def active_doctor_options(collection):
+    """The :func:`doctor_options` that can still be booked."""
+    return [doctor for doctor in doctor_options(collection) if doctor.get('archived') is False]
+
+
+def facets(collection):
+    """Distinct specializations and departments of active doctors for the search filters."""
+    return cached(('facets',), lambda: {
+        'specializations': collection.distinct('specialization', ACTIVE),
+        'departments': collection.distinct('department', ACTIVE),
+    })
+
+
+def doctor_page(collection, criteria, ordering, request, projection=None):
+    """A page of doctors as selected by the request's cursor."""
+    _, page_size = page_params(request)
+    parts = ('page', criteria, ordering, request.GET.get('cursor', ''), page_size, projection)
+    return cached(parts, lambda: paginate(collection, criteria, ordering, request, projection))
+
+
+def doctor_count(collection, criteria):
+    if not criteria:
+        return cached(('count',), collection.estimated_document_count)
+    return cached(('count', criteria), lambda: collection.count_documents(criteria))
+
+
+async def acached(parts, producer):
+    """Async counterpart of :func:`cached`; ``producer`` returns an awaitable."""
+    cache = get_cache()
+    version = await cache.aget(VERSION_KEY)
+    if version is None:
+        await cache.aadd(VERSION_KEY, 1, None)
+        version = await cache.aget(VERSION_KEY, 1)
+    key = _key(version, parts)
+    value = await cache.aget(key)
+    stats.record(hit=value is not None)
+    if value is None:
+        value = await producer()
+        await cache.aset(key, value, CACHE_SECONDS)
+    return value
+
+
+async def afacets(collection):
+    async def produce():
+        specializations, departments = await asyncio.gather(
+            collection.distinct('specialization', ACTIVE), collection.distinct('department', ACTIVE))
+        return {'specializations': specializations, 'departments': departments}
+    return await acached(('facets',), produce)
+
+
+async def adoctor_page(collection, criteria, ordering, request, projection=None):
+    _, page_size = page_params(request)
+    parts = ('page', criteria, ordering, request.GET.get('cursor', ''), page_size, projection)
+    return await acached(parts, lambda: apaginate(collection, criteria, ordering, request, projection))
+
+
+async def adoctor_count(collection, criteria):
+    if not criteria:
+        return await acached(('count',), collection.estimated_document_count)
+    return await acached(('count', criteria), lambda: collection.count_documents(criteria))
@@ -0,0 +1,244 @@
+"""Streaming export of patients and appointments.
+
+:func:`export_chunks` yields the encoded output a batch at a time: a
+batched cursor feeds fixed-size lists of documents, appointment batches
+get their patient and doctor names with one ``$in`` lookup per collection
+(:func:`hospital_app.lookups.attach_names`), and each batch is encoded and
+(optionally) gzip-compressed before the next one is fetched. Memory use is
+bounded by the batch size, not the collection size, so the same generator
+backs both a ``StreamingHttpResponse`` and the ``export_data`` command.
+
+Formats:
+
+* ``csv`` - header row plus one row per document;
+* ``jsonl`` - one JSON object per line;
+* ``parquet`` - columnar file with one row group per batch. Needs the
+  optional ``pyarrow`` package; :data:`FORMATS` only lists it when that is
+  installed.
+"""
+import csv
+import json
+import zlib
+from datetime import date, datetime
+
+from bson.objectid import ObjectId
+from django.conf import settings
+
+from .archive import ACTIVE, archive_collections
+from .dates import day_range
+from .lookups import attach_names
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover - optional dependency
+    pyarrow = None
+
+EXPORT_BATCH_SIZE = getattr(settings, 'HOSPITAL_EXPORT_BATCH_SIZE', 1000)
+
+FORMATS = ('csv', 'jsonl', 'parquet') if pyarrow else ('csv', 'jsonl')
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+EXPORTS = {
+    'patients': {
+        'fields': ['patient_id', 'first_name', 'last_name', 'email', 'phone', 'date_of_birth', 'gender',
+                   'address', 'blood_group', 'emergency_contact', 'registration_date'],
+        'date_field': 'registration_date',
+        'timestamps': {'registration_date'},
+        # Current patients only, which is also what the registration_date index holds
+        'criteria': ACTIVE,
+    },
+    'appointments': {
+        'fields': ['appointment_id', 'appointment_date', 'time_slot', 'patient_name', 'doctor_name',
+                   'purpose', 'status', 'created_at'],
+        'date_field': 'appointment_date',
+        'timestamps': {'appointment_date', 'created_at'},
+    },
+}
+# Computed by attach_names rather than stored
+NAME_FIELDS = {'patient_name': 'patient_id', 'doctor_name': 'doctor_id'}
+
+
+class ExportError(ValueError):
+    pass
+
+
+def export_fields(name, requested=None):
+    """Validate a comma-separated field list against the export's columns."""
+    allowed = EXPORTS[name]['fields']
+    if not requested:
+        return list(allowed)
+    fields = [field.strip() for field in requested.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise ExportError(f"Unknown fields: {', '.join(unknown)}. Choose from {', '.join(allowed)}.")
+    return fields
+
+
+def date_criteria(name, date_from=None, date_to=None):
+    """Inclusive day range on the export's date field."""
+    try:
+        bounds = day_range(date_from, date_to)
+    except ValueError:
+        raise ExportError("Invalid date; use YYYY-MM-DD.")
+    criteria = dict(EXPORTS[name].get('criteria', {}))
+    if bounds:
+        criteria[EXPORTS[name]['date_field']] = bounds
+    return criteria
+
+
+def projection_for(fields):
+    projection = {field: 1 for field in fields if field not in NAME_FIELDS}
+    for name_field, id_field in NAME_FIELDS.items():
+        if name_field in fields:
+            projection[id_field] = 1
+    return projection
+
+
+def iter_batches(collection, criteria, projection, sort_field, batch_size):
+    """Yield lists of up to ``batch_size`` documents from one batched cursor."""
+    cursor = collection.find(criteria, projection, batch_size=batch_size)
+    cursor = cursor.sort([(sort_field, 1), ('_id', 1)])
+    batch = []
+    for document in cursor:
+        batch.append(document)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def plain(value):
+    """Convert BSON values to JSON/CSV friendly ones."""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+class _Lines:
+    """Write target for ``csv.writer`` that hands back each encoded row."""
+
+    def write(self, value):
+        return value
+
+
+def _encode_csv(fields):
+    writer = csv.writer(_Lines())
+    header = writer.writerow(fields)
+
+    def encode(rows, first):
+        lines = [writer.writerow(['' if row.get(f) is None else plain(row.get(f)) for f in fields]) for row in rows]
+        return ''.join(([header] if first else []) + lines).encode()
+    return encode
+
+
+def _encode_jsonl(fields):
+    def encode(rows, first):
+        return ''.join(json.dumps({f: row.get(f) for f in fields}, default=plain) + '\n' for row in rows).encode()
+    return encode
+
+
+class _Drain:
+    """File-like sink for ParquetWriter whose contents can be taken as they arrive."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data, self.chunks = b''.join(self.chunks), []
+        return data
+
+
+def _parquet_chunks(batches, fields, timestamps):
+    schema = pyarrow.schema([
+        (field, pyarrow.timestamp('us') if field in timestamps else pyarrow.string()) for field in fields
+    ])
+    sink = _Drain()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    for rows in batches:
+        columns = {
+            field: [_as_timestamp(row.get(field)) if field in timestamps else _as_text(row.get(field))
+                    for row in rows]
+            for field in fields
+        }
+        writer.write_table(pyarrow.table(columns, schema=schema))
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+def _as_text(value):
+    return None if value is None else str(plain(value))
+
+
+def _as_timestamp(value):
+    return value if isinstance(value, datetime) else None
+
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(wbits=31)  # 31: gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_chunks(name, file_format, collection, fields, criteria=None, compress=False,
+                  patients_collection=None, doctors_collection=None, batch_size=EXPORT_BATCH_SIZE):
+    """Yield the encoded export of ``collection`` a batch at a time.
+
+    ``patients_collection`` and ``doctors_collection`` are needed when
+    exporting appointments with name columns.
+    """
+    if file_format not in FORMATS:
+        raise ExportError(f"Unsupported format {file_format!r}; choose from {', '.join(FORMATS)}.")
+    spec = EXPORTS[name]
+    batches = iter_batches(collection, criteria or {}, projection_for(fields), spec['date_field'], batch_size)
+    if any(field in NAME_FIELDS for field in fields):
+        batches = (attach_names(batch, patients_collection, doctors_collection, archive_collections)
+                   for batch in batches)
+
+    if file_format == 'parquet':
+        chunks = _parquet_chunks(batches, fields, spec['timestamps'])
+    else:
+        encode = (_encode_csv if file_format == 'csv' else _encode_jsonl)(fields)
+
+        def encoded():
+            first = True
+            for batch in batches:
+                yield encode(batch, first)
+                first = False
+            if first and file_format == 'csv':
+                yield encode([], True)
+        chunks = encoded()
+    return _gzip(chunks) if compress else chunks
+
+
+def export_filename(name, file_format, compress=False):
+    filename = f"{name}-{date.today().isoformat()}.{file_format}"
+    return filename + '.gz' if compress else filename
@@ -0,0 +1,172 @@
+"""Per-patient appointment history and the summary kept on each patient.
+
+A patient document carries a small summary of their appointments so a
+chart opens with one read of the patient:
+
+* ``visit_count`` - completed appointments;
+* ``last_visit`` - date of the latest completed appointment, or ``None``;
+* ``next_appointment`` - the earliest scheduled or confirmed appointment
+  from today on (``appointment_id``, ``appointment_date``, ``time_slot``,
+  ``doctor_id`` and ``starts_at``, the slot's start time), or ``None``.
+
+The booking, update, delete and bulk paths call :func:`record` with each
+appointment before and after the write. Most changes are one conditional
+update of the patient (``$inc``/``$max``, or "replace the next appointment
+if this one is sooner"); a change that may remove the last visit or the
+next appointment re-reads that patient's appointments through the
+``(patient_id, appointment_date)`` index instead (:func:`refresh`). The
+next appointment also goes stale once its day has passed;
+:func:`current_summary` notices and refreshes it on read.
+``manage.py rebuild_patient_history`` recomputes every summary.
+"""
+from collections import defaultdict
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+from . import changefeed
+from .dates import parse_day, today
+
+VISIT_STATUSES = {'Completed'}
+UPCOMING_STATUSES = {'Scheduled', 'Confirmed'}
+
+# What the summaries are computed from
+APPOINTMENT_FIELDS = {'appointment_id': 1, 'patient_id': 1, 'doctor_id': 1, 'appointment_date': 1, 'time_slot': 1,
+                      'status': 1}
+SUMMARY_FIELDS = ('visit_count', 'last_visit', 'next_appointment')
+EMPTY_SUMMARY = {'visit_count': 0, 'last_visit': None, 'next_appointment': None}
+
+
+def _day(appointment):
+    try:
+        return parse_day(appointment.get('appointment_date'))
+    except (TypeError, ValueError):
+        return None
+
+
+def is_visit(appointment):
+    return bool(appointment) and appointment.get('status') in VISIT_STATUSES and _day(appointment) is not None
+
+
+def is_upcoming(appointment, day=None):
+    if not appointment or appointment.get('status') not in UPCOMING_STATUSES:
+        return False
+    appointment_day = _day(appointment)
+    return appointment_day is not None and appointment_day >= (day or today())
+
+
+def starts_at(appointment):
+    """When the appointment's slot starts (midnight if the slot can't be read)."""
+    start = _day(appointment)
+    try:
+        slot_start = datetime.strptime(str(appointment.get('time_slot', '')).split(' - ')[0], '%I:%M %p')
+    except ValueError:
+        return start
+    return start.replace(hour=slot_start.hour, minute=slot_start.minute)
+
+
+def next_entry(appointment):
+    return {
+        'appointment_id': appointment.get('appointment_id'),
+        'appointment_date': _day(appointment),
+        'time_slot': appointment.get('time_slot'),
+        'doctor_id': appointment.get('doctor_id'),
+        'starts_at': starts_at(appointment),
+    }
+
+
+def summarize(appointments, day=None):
+    """The summary of one patient's ``appointments``."""
+    day = day or today()
+    summary = dict(EMPTY_SUMMARY)
+    upcoming = []
+    for appointment in appointments:
+        if is_visit(appointment):
+            summary['visit_count'] += 1
+            summary['last_visit'] = max(filter(None, (summary['last_visit'], _day(appointment))))
+        elif is_upcoming(appointment, day):
+            upcoming.append(appointment)
+    if upcoming:
+        summary['next_appointment'] = next_entry(min(upcoming, key=starts_at))
+    return summary
+
+
+# ===== MAINTENANCE =====
+def refresh(patient_ids, patients, appointments, current=None):
+    """Recompute the summaries of ``patient_ids``: one indexed read and one ``bulk_write``.
+
+    With ``current`` (the stored summaries by patient ``_id``) only the
+    summaries that differ are written. Returns the summaries by ``_id``.
+    """
+    patient_ids = list(patient_ids)
+    if not patient_ids:
+        return {}
+    by_patient = defaultdict(list)
+    for appointment in appointments.find({'patient_id': {'$in': patient_ids}}, APPOINTMENT_FIELDS):
+        by_patient[appointment['patient_id']].append(appointment)
+    summaries = {patient_id: summarize(by_patient[patient_id]) for patient_id in patient_ids}
+    requests = [UpdateOne({'_id': patient_id}, {'$set': changefeed.stamp(dict(summary))})
+                for patient_id, summary in summaries.items()
+                if current is None or current.get(patient_id) != summary]
+    if requests:
+        patients.bulk_write(requests, ordered=False)
+    return summaries
+
+
+def _delta(patient_id, before, after):
+    """The update bringing a summary from ``before`` to ``after``, or ``None`` if it needs a :func:`refresh`."""
+    if is_visit(before) and not (is_visit(after) and _day(after) >= _day(before)):
+        # This may have been the last visit
+        return None
+    if is_upcoming(before) and not (is_upcoming(after) and starts_at(after) <= starts_at(before)):
+        # This may have been the next appointment
+        return None
+    if is_visit(after):
+        update = {'$max': {'last_visit': _day(after)}, '$set': changefeed.stamp({})}
+        if not is_visit(before):
+            update['$inc'] = {'visit_count': 1}
+        return UpdateOne({'_id': patient_id}, update)
+    if is_upcoming(after):
+        entry = next_entry(after)
+        return UpdateOne({'_id': patient_id, '$or': [
+            {'next_appointment': None},
+            {'next_appointment.starts_at': {'$gt': entry['starts_at']}},
+            {'next_appointment.appointment_id': entry['appointment_id']},
+            {'next_appointment.appointment_date': {'$lt': today()}},
+        ]}, {'$set': changefeed.stamp({'next_appointment': entry})})
+    return False
+
+
+def record(changes, patients, appointments):
+    """Update the summaries for ``changes``, ``(before, after)`` appointment pairs.
+
+    ``before`` is ``None`` for a booking and ``after`` ``None`` for a
+    delete. Costs at most one ``bulk_write`` of patients plus one
+    :func:`refresh`, however many changes there are.
+    """
+    updates, stale = [], set()
+    for before, after in changes:
+        for patient_id in {appointment.get('patient_id') for appointment in (before, after) if appointment}:
+            if patient_id is None:
+                continue
+            update = _delta(patient_id,
+                            before if before and before.get('patient_id') == patient_id else None,
+                            after if after and after.get('patient_id') == patient_id else None)
+            if update is None:
+                stale.add(patient_id)
+            elif update:
+                updates.append(update)
+    if updates:
+        patients.bulk_write(updates, ordered=False)
+    # After the deltas, which it would overwrite anyway
+    refresh(stale, patients, appointments)
+
+
+def current_summary(patient, patients, appointments):
+    """``patient``'s summary, refreshed first if it was never built or its next appointment has passed."""
+    summary = {field: patient.get(field, EMPTY_SUMMARY[field]) for field in SUMMARY_FIELDS}
+    upcoming = summary['next_appointment']
+    if 'visit_count' not in patient or (upcoming and upcoming.get('appointment_date')
+                                        and upcoming['appointment_date'] < today()):
+        summary = refresh([patient['_id']], patients, appointments)[patient['_id']]
+    return summary
@@ -0,0 +1,84 @@
+"""Business ID allocation (``PAT000001``, ``DOC000001``, ``APT000001``).
+
+Each ID sequence is a single document in the ``counters`` collection that is
+advanced with an atomic ``find_one_and_update($inc)``, so concurrent
+requests can never be handed the same number and allocation costs one
+round trip instead of a sort over the target collection.
+
+An allocator can also reserve a block of numbers at a time and hand them
+out locally. That saves a round trip per ID at the cost of gaps (unused
+numbers are lost when the process exits) and IDs from different workers
+interleaving out of order.
+"""
+import re
+import threading
+
+from pymongo import ReturnDocument
+
+ID_WIDTH = 6
+
+
+def format_id(prefix, number, width=ID_WIDTH):
+    return f"{prefix}{number:0{width}d}"
+
+
+def parse_id(business_id, prefix):
+    """Return the numeric part of ``business_id`` or ``None`` if it doesn't match."""
+    match = re.fullmatch(re.escape(prefix) + r'(\d+)', business_id or '')
+    return int(match.group(1)) if match else None
+
+
+class IdAllocator:
+    """Hands out sequential business IDs backed by a counter document."""
+
+    def __init__(self, counters, name, prefix, block_size=1, width=ID_WIDTH):
+        self.counters = counters
+        self.name = name
+        self.prefix = prefix
+        self.block_size = max(1, block_size)
+        self.width = width
+        self._lock = threading.Lock()
+        self._next = 0
+        self._end = 0
+
+    def reserve(self, count):
+        """Atomically claim ``count`` numbers and return them as a range."""
+        counter = self.counters.find_one_and_update(
+            {'_id': self.name},
+            {'$inc': {'seq': count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        end = counter['seq'] + 1
+        return range(end - count, end)
+
+    def next_number(self):
+        with self._lock:
+            if self._next >= self._end:
+                block = self.reserve(self.block_size)
+                self._next, self._end = block.start, block.stop
+            number = self._next
+            self._next += 1
+        return number
+
+    def next_id(self):
+        return format_id(self.prefix, self.next_number(), self.width)
+
+    def take(self, count):
+        """Return ``count`` new IDs using a single reservation."""
+        return [format_id(self.prefix, n, self.width) for n in self.reserve(count)]
+
+
+def seed_counter(counters, collection, name, field, prefix):
+    """Raise the ``name`` counter to at least the highest ID in ``collection``.
+
+    Uses ``$max`` so re-running it never moves a counter backwards. Returns
+    the highest number found (0 for an empty collection).
+    """
+    highest = 0
+    for document in collection.find({field: {'$regex': '^' + re.escape(prefix)}}, {field: 1}):
+        number = parse_id(document.get(field), prefix)
+        if number is not None and number > highest:
+            highest = number
+    counters.update_one({'_id': name}, {'$max': {'seq': highest}}, upsert=True)
+    return highest
@@ -0,0 +1,279 @@
+"""Bulk patient import from CSV or JSONL.
+
+Rows are read one at a time from the open file, so a partner clinic's
+export of several hundred thousand patients never has to fit in memory.
+Each row is validated and normalized, then written in batches:
+
+* one ``find_one_and_update`` reserves a block of patient IDs per batch
+  (see :class:`hospital_app.ids.IdAllocator`);
+* one unordered ``bulk_write`` upserts the batch keyed on the lowercased
+  email, so re-importing a file updates existing patients instead of
+  duplicating them, and one bad row doesn't stop the rest of the batch.
+
+Numbers reserved for rows that turn out to update an existing patient are
+left unused, which only leaves gaps in the sequence.
+
+After every batch the caller gets the :class:`ImportReport` so far, which
+records the last input line written; passing that back as ``start_after``
+resumes an interrupted import. Upserts are idempotent, so replaying the
+batch that was in flight is harmless.
+"""
+import csv
+import io
+import json
+import re
+import time
+from datetime import datetime
+
+from django.conf import settings
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from . import changefeed
+from .archive import ACTIVE
+from .search import search_fields
+
+IMPORT_BATCH_SIZE = getattr(settings, 'HOSPITAL_IMPORT_BATCH_SIZE', 1000)
+# Per-batch error details kept in the report; counts are always complete
+MAX_REPORTED_ERRORS = 20
+
+FORMATS = ('csv', 'jsonl')
+FIELDS = ['first_name', 'last_name', 'email', 'phone', 'date_of_birth', 'gender',
+          'address', 'blood_group', 'emergency_contact']
+REQUIRED_FIELDS = ['first_name', 'last_name', 'email']
+GENDERS = {'m': 'Male', 'male': 'Male', 'f': 'Female', 'female': 'Female', 'other': 'Other'}
+BLOOD_GROUPS = {'A+', 'A-', 'B+', 'B-', 'O+', 'O-', 'AB+', 'AB-'}
+DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y', '%d.%m.%Y')
+EMAIL_RE = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+
+
+class RowError(ValueError):
+    pass
+
+
+def detect_format(filename):
+    """Guess the input format from a file name (``.csv``, ``.jsonl``/``.ndjson``)."""
+    name = (filename or '').lower()
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    return None
+
+
+def read_rows(stream, file_format):
+    """Yield ``(line_number, row)`` pairs from a text stream.
+
+    A JSONL line that isn't a JSON object is yielded as a :class:`RowError`
+    in place of the row so it is reported like any other invalid row.
+    """
+    if file_format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif file_format == 'jsonl':
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as error:
+                row = RowError(f"invalid JSON: {error}")
+            if not isinstance(row, (dict, RowError)):
+                row = RowError("expected a JSON object")
+            yield line_number, row
+    else:
+        raise ValueError(f"Unsupported format {file_format!r}; expected one of {', '.join(FORMATS)}.")
+
+
+def text_stream(binary):
+    """Wrap an uploaded or opened binary file for :func:`read_rows` (BOM-tolerant)."""
+    return io.TextIOWrapper(binary, encoding='utf-8-sig', newline='')
+
+
+def _clean(value):
+    if value is None:
+        return ''
+    return ' '.join(str(value).split())
+
+
+def _parse_date(value):
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).date()
+        except ValueError:
+            continue
+    raise RowError(f"unrecognized date_of_birth {value!r}")
+
+
+def normalize_patient(row, required=REQUIRED_FIELDS):
+    """Return the patient fields for one input row, or raise :class:`RowError`."""
+    if isinstance(row, RowError):
+        raise row
+    patient = {field: _clean(row.get(field)) for field in FIELDS}
+
+    missing = [field for field in required if not patient[field]]
+    if missing:
+        raise RowError(f"missing {', '.join(missing)}")
+
+    if patient['email']:
+        patient['email'] = patient['email'].lower()
+        if not EMAIL_RE.match(patient['email']):
+            raise RowError(f"invalid email {patient['email']!r}")
+
+    if patient['gender']:
+        gender = GENDERS.get(patient['gender'].lower())
+        if gender is None:
+            raise RowError(f"invalid gender {patient['gender']!r}")
+        patient['gender'] = gender
+
+    if patient['blood_group']:
+        blood_group = patient['blood_group'].upper().replace(' ', '')
+        if blood_group not in BLOOD_GROUPS:
+            raise RowError(f"invalid blood_group {patient['blood_group']!r}")
+        patient['blood_group'] = blood_group
+
+    if patient['date_of_birth']:
+        date_of_birth = _parse_date(patient['date_of_birth'])
+        if date_of_birth > datetime.now().date():
+            raise RowError("date_of_birth is in the future")
+        # Same representation as the add-patient form's date input
+        patient['date_of_birth'] = date_of_birth.isoformat()
+
+    patient['search'] = search_fields(patient)
+    return patient
+
+
+class ImportReport:
+    """Running totals, per-batch errors and throughput of one import."""
+
+    def __init__(self, start_after=0):
+        self.start_after = start_after
+        self.last_line = start_after
+        self.rows = 0
+        self.inserted = 0
+        self.updated = 0
+        self.invalid = 0
+        self.failed = 0
+        self.batches = []
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def add_batch(self, number, first_line, last_line, errors, inserted, updated, write_failures):
+        self.last_line = last_line
+        self.inserted += inserted
+        self.updated += updated
+        self.failed += write_failures
+        self.elapsed = time.perf_counter() - self.started
+        if errors:
+            self.batches.append({
+                'batch': number,
+                'lines': (first_line, last_line),
+                'error_count': len(errors),
+                'errors': errors[:MAX_REPORTED_ERRORS],
+            })
+
+    def as_dict(self):
+        return {
+            'start_after': self.start_after,
+            'last_line': self.last_line,
+            'rows': self.rows,
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'invalid': self.invalid,
+            'failed': self.failed,
+            'elapsed_seconds': round(self.elapsed, 3),
+            'rows_per_second': round(self.rows_per_second, 1),
+            'batches_with_errors': self.batches,
+        }
+
+
+def _upsert(patient, patient_id, now):
+    """The update for one patient's row.
+
+    Optional fields the row leaves blank are only written for a new
+    patient, so re-importing a sparser export keeps what is stored.
+    """
+    fields = {field: value for field, value in patient.items() if value != ''}
+    on_insert = {field: '' for field, value in patient.items() if value == ''}
+    on_insert.update(patient_id=patient_id, registration_date=now)
+    if not patient['phone']:
+        # Keep the stored phone searchable too
+        search = fields.pop('search')
+        fields.update((f'search.{key}', value) for key, value in search.items() if key != 'phone')
+        on_insert['search.phone'] = search['phone']
+    return {'$set': changefeed.stamp(fields), '$setOnInsert': on_insert}
+
+
+def _write_batch(collection, allocator, batch, errors):
+    """Upsert one batch of ``(line_number, patient)``; return (inserted, updated, failed)."""
+    # The last row for an email wins; earlier ones would race on the
+    # unique email index inside an unordered batch.
+    by_email = {}
+    for line_number, patient in batch:
+        previous = by_email.get(patient['email'])
+        if previous is not None:
+            errors.append({'line': previous[0], 'error': f"superseded by line {line_number} (same email)"})
+        by_email[patient['email']] = (line_number, patient)
+    rows = list(by_email.values())
+
+    now = datetime.now()
+    requests = [
+        # Archived patients keep their email but don't match; new ones come out active
+        UpdateOne({'email': patient['email'], **ACTIVE}, _upsert(patient, patient_id, now), upsert=True)
+        for (line_number, patient), patient_id in zip(rows, allocator.take(len(rows)))
+    ]
+    try:
+        result = collection.bulk_write(requests, ordered=False)
+        return result.upserted_count, result.matched_count, 0
+    except BulkWriteError as error:
+        details = error.details
+        for write_error in details.get('writeErrors', []):
+            errors.append({'line': rows[write_error['index']][0], 'error': write_error.get('errmsg', '')})
+        return details.get('nUpserted', 0), details.get('nMatched', 0), len(details.get('writeErrors', []))
+
+
+def import_patients(rows, collection, allocator, batch_size=IMPORT_BATCH_SIZE, start_after=0, on_batch=None):
+    """Validate and upsert ``(line_number, row)`` pairs in unordered batches.
+
+    Rows at or before line ``start_after`` are skipped. ``on_batch(report)``
+    is called after each batch is written, e.g. to save a checkpoint.
+    """
+    report = ImportReport(start_after)
+    batch, errors = [], []
+    first_line = None
+    number = 0
+
+    def flush(last_line):
+        nonlocal batch, errors, first_line, number
+        number += 1
+        inserted = updated = failures = 0
+        if batch:
+            inserted, updated, failures = _write_batch(collection, allocator, batch, errors)
+        report.add_batch(number, first_line, last_line, errors, inserted, updated, failures)
+        if on_batch:
+            on_batch(report)
+        batch, errors, first_line = [], [], None
+
+    line_number = start_after
+    for line_number, row in rows:
+        if line_number <= start_after:
+            continue
+        report.rows += 1
+        if first_line is None:
+            first_line = line_number
+        try:
+            batch.append((line_number, normalize_patient(row)))
+        except RowError as error:
+            report.invalid += 1
+            errors.append({'line': line_number, 'error': str(error)})
+        if report.rows % batch_size == 0:
+            flush(line_number)
+    if first_line is not None:
+        flush(line_number)
+    report.elapsed = time.perf_counter() - report.started
+    return report
@@ -0,0 +1,229 @@
+"""Declarative MongoDB index specification for the hospital collections.
+
+``INDEXES`` is the single source of truth for the indexes the views rely
+on; ``manage.py ensure_mongo_indexes`` provisions it, diffs it against the
+live database and explains the representative view queries in
+``VIEW_QUERIES`` to show that none of them falls back to a collection scan.
+"""
+from datetime import datetime, timedelta, timezone
+
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+
+from .archive import ACTIVE
+from .changefeed import TOMBSTONE_DAYS
+from .dates import today
+
+# Emails are optional on older records, so uniqueness only applies to
+# documents that actually have one (and aren't archived, so an email can
+# be registered again).
+HAS_EMAIL = {'email': {'$type': 'string'}, **ACTIVE}
+# Archived patients and doctors are left out of the indexes that serve
+# lists and searches (see hospital_app.archive); the archiver finds them
+# through ``archived_at``.
+ARCHIVED = {'archived': True}
+
+INDEXES = {
+    'patients': [
+        IndexModel([('patient_id', ASCENDING)], name='patient_id_unique', unique=True),
+        IndexModel([('email', ASCENDING)], name='email_unique', unique=True,
+                   partialFilterExpression=HAS_EMAIL),
+        IndexModel([('registration_date', DESCENDING), ('_id', DESCENDING)], name='registration_date',
+                   partialFilterExpression=ACTIVE),
+        # Patient search (see hospital_app.search)
+        IndexModel([('search.prefixes', ASCENDING)], name='search_prefixes', partialFilterExpression=ACTIVE),
+        IndexModel([('search.email', ASCENDING)], name='search_email', partialFilterExpression=ACTIVE),
+        IndexModel([('search.phone', ASCENDING)], name='search_phone', partialFilterExpression=ACTIVE),
+        IndexModel([('search.names', TEXT)], name='search_names_text', default_language='none',
+                   partialFilterExpression=ACTIVE),
+        IndexModel([('archived_at', ASCENDING)], name='archived_at', partialFilterExpression=ARCHIVED),
+        # Change feed watermark (see hospital_app.changefeed)
+        IndexModel([('updated_at', ASCENDING), ('_id', ASCENDING)], name='updated_at'),
+    ],
+    'doctors': [
+        IndexModel([('doctor_id', ASCENDING)], name='doctor_id_unique', unique=True),
+        IndexModel([('email', ASCENDING)], name='email_unique', unique=True,
+                   partialFilterExpression=HAS_EMAIL),
+        IndexModel([('specialization', ASCENDING), ('department', ASCENDING)], name='specialization_department',
+                   partialFilterExpression=ACTIVE),
+        IndexModel([('specialization', ASCENDING), ('_id', ASCENDING)], name='specialization_page',
+                   partialFilterExpression=ACTIVE),
+        IndexModel([('department', ASCENDING)], name='department', partialFilterExpression=ACTIVE),
+        IndexModel([('archived_at', ASCENDING)], name='archived_at', partialFilterExpression=ARCHIVED),
+        IndexModel([('updated_at', ASCENDING), ('_id', ASCENDING)], name='updated_at'),
+    ],
+    'appointments': [
+        IndexModel([('appointment_id', ASCENDING)], name='appointment_id_unique', unique=True),
+        IndexModel([('appointment_date', DESCENDING), ('_id', DESCENDING)], name='appointment_date'),
+        IndexModel([('doctor_id', ASCENDING), ('appointment_date', ASCENDING), ('time_slot', ASCENDING)],
+                   name='doctor_date_slot'),
+        IndexModel([('status', ASCENDING), ('appointment_date', DESCENDING), ('_id', DESCENDING)],
+                   name='status_date'),
+        # A patient's history, newest first; also serves plain patient_id lookups
+        IndexModel([('patient_id', ASCENDING), ('appointment_date', DESCENDING), ('_id', DESCENDING)],
+                   name='patient_history'),
+        IndexModel([('updated_at', ASCENDING), ('_id', ASCENDING)], name='updated_at'),
+    ],
+    # One document per doctor and day; uniqueness is what makes slot
+    # reservations atomic (see hospital_app.scheduling)
+    'doctor_schedules': [
+        IndexModel([('doctor_id', ASCENDING), ('date', ASCENDING)], name='doctor_date_unique', unique=True),
+    ],
+    # Daily per-doctor analytics buckets: date ranges for reports, (date, doctor) for upserts
+    'appointment_rollups': [
+        IndexModel([('date', ASCENDING), ('doctor_id', ASCENDING)], name='date_doctor_unique', unique=True),
+    ],
+    # Tombstones for the watermark change feed, dropped once no consumer
+    # should still be that far behind
+    'deleted_records': [
+        IndexModel([('updated_at', ASCENDING), ('_id', ASCENDING)], name='updated_at'),
+        IndexModel([('updated_at', ASCENDING)], name='expire', expireAfterSeconds=TOMBSTONE_DAYS * 24 * 3600),
+    ],
+}
+
+# Index options that matter when comparing the spec with a live index.
+COMPARED_OPTIONS = ('unique', 'sparse', 'partialFilterExpression', 'expireAfterSeconds', 'default_language')
+
+
+def _sample_date():
+    return today()
+
+
+# (label, command) for the queries the views issue. Commands are
+# explained with ``db.command('explain', ...)``.
+VIEW_QUERIES = [
+    ('patient_list page',
+     lambda: {'find': 'patients', 'filter': ACTIVE, 'sort': {'registration_date': -1, '_id': -1}, 'limit': 26}),
+    ('patient by business id',
+     lambda: {'find': 'patients', 'filter': {'patient_id': 'PAT000001'}, 'limit': 1}),
+    ('doctor_list page',
+     lambda: {'find': 'doctors', 'filter': ACTIVE, 'sort': {'specialization': 1, '_id': 1}, 'limit': 26}),
+    ('search_patients name prefix',
+     lambda: {'find': 'patients', 'filter': {'search.prefixes': {'$all': ['jo', 'sm']}, **ACTIVE}, 'limit': 200}),
+    ('search_patients phone prefix',
+     lambda: {'find': 'patients', 'filter': {'search.phone': {'$regex': '^5550'}, **ACTIVE}, 'limit': 50}),
+    ('search_doctors filters',
+     lambda: {'find': 'doctors', 'filter': {'specialization': 'Cardiology', 'department': 'Cardiology', **ACTIVE},
+              'sort': {'specialization': 1, '_id': 1}, 'limit': 26}),
+    ('search_doctors specializations',
+     lambda: {'distinct': 'doctors', 'key': 'specialization', 'query': ACTIVE}),
+    ('appointment_list page',
+     lambda: {'find': 'appointments', 'filter': {}, 'sort': {'appointment_date': -1, '_id': -1}, 'limit': 26}),
+    ('search_appointments by status',
+     lambda: {'find': 'appointments', 'filter': {'status': 'Scheduled'},
+              'sort': {'appointment_date': -1, '_id': -1}, 'limit': 26}),
+    ('search_appointments date range',
+     lambda: {'find': 'appointments',
+              'filter': {'appointment_date': {'$gte': _sample_date() - timedelta(days=30), '$lt': _sample_date()}},
+              'sort': {'appointment_date': -1, '_id': -1}, 'limit': 26}),
+    ('search_appointments status and date range count',
+     lambda: {'count': 'appointments',
+              'query': {'status': 'Scheduled',
+                        'appointment_date': {'$gte': _sample_date() - timedelta(days=30), '$lt': _sample_date()}}}),
+    ('search_appointments by id',
+     lambda: {'find': 'appointments', 'filter': {'appointment_id': 'APT000001'}, 'limit': 1}),
+    ('patient history page',
+     lambda: {'find': 'appointments', 'filter': {'patient_id': ObjectId()},
+              'sort': {'appointment_date': -1, '_id': -1}, 'limit': 26}),
+    ('patient history refresh',
+     lambda: {'find': 'appointments', 'filter': {'patient_id': {'$in': [ObjectId(), ObjectId()]}}}),
+    ('appointments for doctor on date',
+     lambda: {'find': 'appointments', 'filter': {'doctor_id': ObjectId(), 'appointment_date': _sample_date()}}),
+    ('free slots for doctor on date',
+     lambda: {'find': 'doctor_schedules', 'filter': {'doctor_id': ObjectId(), 'date': _sample_date().strftime('%Y-%m-%d')},
+              'limit': 1}),
+    ('earliest free slot window',
+     lambda: {'find': 'doctor_schedules', 'filter': {'doctor_id': {'$in': [ObjectId(), ObjectId()]},
+                                                     'date': {'$gte': _sample_date().strftime('%Y-%m-%d')}}}),
+    ('analytics report range',
+     lambda: {'find': 'appointment_rollups',
+              'filter': {'date': {'$gte': (_sample_date() - timedelta(days=29)).strftime('%Y-%m-%d'),
+                                  '$lte': _sample_date().strftime('%Y-%m-%d')}}}),
+    ('archiver cold patients',
+     lambda: {'find': 'patients', 'filter': {'archived': True, 'archived_at': {'$lt': datetime(2020, 1, 1)}},
+              'sort': {'archived_at': 1}, 'limit': 1000}),
+    ('change feed watermark',
+     lambda: {'find': 'appointments', 'filter': {'updated_at': {'$gt': datetime(2024, 1, 1, tzinfo=timezone.utc)}},
+              'sort': {'updated_at': 1, '_id': 1}, 'limit': 500}),
+    ('staff_dashboard today count',
+     lambda: {'count': 'appointments',
+              'query': {'appointment_date': {'$gte': _sample_date(), '$lt': _sample_date() + timedelta(days=1)}}}),
+]
+
+
+def index_signature(keys, options):
+    """Normalize an index definition so spec and live indexes compare equal."""
+    return (
+        tuple((field, int(direction) if isinstance(direction, (int, float)) else direction)
+              for field, direction in keys),
+        tuple((option, options[option]) for option in COMPARED_OPTIONS if option in options),
+    )
+
+
+def live_keys(info):
+    """Key list of a live index as it was declared.
+
+    Text indexes are reported by the server as ``_fts``/``_ftsx`` keys, with
+    the indexed fields listed under ``weights``.
+    """
+    keys = list(info['key'])
+    if ('_fts', 'text') in keys:
+        return [(field, TEXT) for field in sorted(info.get('weights', {}))]
+    return keys
+
+
+def diff_indexes(spec, live):
+    """Compare a list of ``IndexModel`` with ``collection.index_information()``.
+
+    Returns ``(missing, changed, extra)`` lists of index names. ``changed``
+    indexes exist under the same name with different keys or options.
+    """
+    missing, changed = [], []
+    wanted = {}
+    for model in spec:
+        document = dict(model.document)
+        name = document.pop('name')
+        keys = list(document.pop('key').items())
+        wanted[name] = index_signature(keys, document)
+
+    for name, signature in wanted.items():
+        if name not in live:
+            missing.append(name)
+        elif index_signature(live_keys(live[name]), live[name]) != signature:
+            changed.append(name)
+    extra = [name for name in live if name != '_id_' and name not in wanted]
+    return missing, changed, extra
+
+
+def plan_stages(plan):
+    """Collect every ``stage`` name in an explain plan tree."""
+    stages = []
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            stages.append(plan['stage'])
+        for value in plan.values():
+            stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(plan_stages(item))
+    return stages
+
+
+def classify_plan(explain):
+    """Summarize an explain result as ``COVERED``, ``INDEXED`` or ``COLLSCAN``."""
+    stages = plan_stages(explain.get('queryPlanner', {}).get('winningPlan', {}))
+    if 'COLLSCAN' in stages or not stages:
+        return 'COLLSCAN', stages
+    if 'FETCH' in stages:
+        return 'INDEXED', stages
+    return 'COVERED', stages
+
+
+def explain_view_queries(db):
+    """Explain every entry of ``VIEW_QUERIES`` and return ``(label, verdict, stages)``."""
+    report = []
+    for label, build_command in VIEW_QUERIES:
+        explain = db.command('explain', build_command(), verbosity='queryPlanner')
+        verdict, stages = classify_plan(explain)
+        report.append((label, verdict, stages))
+    return report
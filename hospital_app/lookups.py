@@ -0,0 +1,87 @@
+"""Batched lookups for documents that reference patients and doctors.
+
+Appointments only store the ``patient_id``/``doctor_id`` ObjectIds. Rather
+than issuing one ``find_one`` per appointment, the helpers here collect the
+distinct ids of a whole result set and resolve them with a single ``$in``
+query per collection, projected down to the name fields. Patients and
+doctors moved to the cold archive (see :mod:`.archive`) are looked up
+there, with one more query only when some ids weren't found.
+"""
+import asyncio
+
+NAME_PROJECTION = {'first_name': 1, 'last_name': 1}
+
+
+def collect_ids(documents, field):
+    """Return the distinct, non-empty values of ``field`` across ``documents``."""
+    seen = set()
+    ids = []
+    for document in documents:
+        value = document.get(field)
+        if value is not None and value not in seen:
+            seen.add(value)
+            ids.append(value)
+    return ids
+
+
+def fetch_names(collection, ids, prefix='', archive=None):
+    """Map each ``_id`` in ``ids`` to a display name using one ``$in`` query.
+
+    Ids not in ``collection`` are looked up in ``archive``, if given.
+    """
+    if not ids:
+        return {}
+    names = {}
+    for person in collection.find({'_id': {'$in': ids}}, NAME_PROJECTION):
+        names[person['_id']] = f"{prefix}{person.get('first_name', '')} {person.get('last_name', '')}"
+    missing = [value for value in ids if value not in names]
+    if missing and archive is not None:
+        names.update(fetch_names(archive, missing, prefix))
+    return names
+
+
+def attach_names(appointments, patients_collection, doctors_collection, archives=None):
+    """Set ``patient_name`` and ``doctor_name`` on every appointment in place.
+
+    Issues one query per collection regardless of how many appointments
+    are passed in, plus one per archive collection (``archives`` by
+    collection name) for people moved there. References found in neither,
+    left by hard deletes from before soft delete, fall back to "Unknown".
+    """
+    archives = archives or {}
+    patient_names = fetch_names(patients_collection, collect_ids(appointments, 'patient_id'),
+                                archive=archives.get('patients'))
+    doctor_names = fetch_names(doctors_collection, collect_ids(appointments, 'doctor_id'), prefix='Dr. ',
+                               archive=archives.get('doctors'))
+
+    for appointment in appointments:
+        appointment['patient_name'] = patient_names.get(appointment.get('patient_id'), "Unknown")
+        appointment['doctor_name'] = doctor_names.get(appointment.get('doctor_id'), "Unknown")
+    return appointments
+
+
+async def afetch_names(collection, ids, prefix='', archive=None):
+    """Async counterpart of :func:`fetch_names`."""
+    if not ids:
+        return {}
+    people = await collection.find({'_id': {'$in': ids}}, NAME_PROJECTION).to_list()
+    names = {person['_id']: f"{prefix}{person.get('first_name', '')} {person.get('last_name', '')}"
+             for person in people}
+    missing = [value for value in ids if value not in names]
+    if missing and archive is not None:
+        names.update(await afetch_names(archive, missing, prefix))
+    return names
+
+
+async def aattach_names(appointments, patients_collection, doctors_collection, archives=None):
+    """Async counterpart of :func:`attach_names`; both lookups run concurrently."""
+    archives = archives or {}
+    patient_names, doctor_names = await asyncio.gather(
+        afetch_names(patients_collection, collect_ids(appointments, 'patient_id'), archive=archives.get('patients')),
+        afetch_names(doctors_collection, collect_ids(appointments, 'doctor_id'), prefix='Dr. ',
+                     archive=archives.get('doctors')),
+    )
+    for appointment in appointments:
+        appointment['patient_name'] = patient_names.get(appointment.get('patient_id'), "Unknown")
+        appointment['doctor_name'] = doctor_names.get(appointment.get('doctor_id'), "Unknown")
+    return appointments
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from hospital_app import archive, doctor_cache
+from hospital_app.mongo import doctors_collection, patients_collection
+
+
+class Command(BaseCommand):
+    help = ("Move patients and doctors archived (deleted) more than --years years ago out of the hot collections "
+            "into patients_archive and doctors_archive, in batches. Safe to run repeatedly, e.g. nightly from cron.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--years', type=float, default=archive.ARCHIVE_AFTER_YEARS,
+                            help="How long ago a record must have been archived (default: "
+                                 "HOSPITAL_ARCHIVE_AFTER_YEARS).")
+        parser.add_argument('--batch-size', type=int, default=archive.ARCHIVE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if options['years'] < 0 or options['batch_size'] < 1:
+            raise CommandError("--years can't be negative and --batch-size must be positive.")
+        hot = {'patients': patients_collection, 'doctors': doctors_collection}
+        before = archive.cutoff(options['years'])
+        for name, collection in hot.items():
+            moved = sum(archive.move_cold(name, collection, archive.archive_collections[name], before,
+                                          options['batch_size']))
+            if moved and name == 'doctors':
+                doctor_cache.invalidate()
+            self.stdout.write(self.style.SUCCESS(f"{name}: moved {moved} records archived before "
+                                                 f"{before:%Y-%m-%d} to {name}_archive."))
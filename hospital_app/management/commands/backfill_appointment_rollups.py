@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+from pymongo import UpdateOne
+
+from hospital_app import analytics
+from hospital_app.dates import day_range, parse_day
+from hospital_app.mongo import appointments_collection, doctors_collection
+
+SOURCE_FIELDS = {'doctor_id': 1, 'appointment_date': 1, 'status': 1}
+
+
+class Command(BaseCommand):
+    help = ("Rebuild the appointment_rollups analytics buckets from the appointments collection, for every "
+            "day or just --from/--to. Appointments are streamed in batches and buckets written in batches. "
+            "Run it while bookings are paused; a write racing the backfill can leave its day off by one.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', help="First day, YYYY-MM-DD.")
+        parser.add_argument('--to', dest='date_to', help="Last day, YYYY-MM-DD.")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            bounds = day_range(options['date_from'], options['date_to'])
+            days = {}
+            if options['date_from']:
+                days['$gte'] = parse_day(options['date_from']).date().isoformat()
+            if options['date_to']:
+                days['$lte'] = parse_day(options['date_to']).date().isoformat()
+        except ValueError:
+            raise CommandError("Dates must be YYYY-MM-DD.")
+        batch_size = options['batch_size']
+
+        fees = analytics.fees(doctors_collection.find({}, {'consultation_fee': 1}))
+        appointments = appointments_collection.find({'appointment_date': bounds} if bounds else {}, SOURCE_FIELDS,
+                                                    batch_size=batch_size)
+        buckets = analytics.bucket_increments(appointments, fees)
+
+        requests = [
+            UpdateOne({'date': day, 'doctor_id': doctor_id},
+                      {'$set': counters}, upsert=True)
+            for (doctor_id, day), counters in buckets.items()
+        ]
+        # Buckets whose appointments are all gone
+        empty = dict.fromkeys(analytics.BUCKET_FIELDS, 0)
+        for bucket in analytics.rollups_collection.find({'date': days} if days else {}, {'date': 1, 'doctor_id': 1}):
+            if (bucket['doctor_id'], bucket['date']) not in buckets:
+                requests.append(UpdateOne({'_id': bucket['_id']}, {'$set': empty}))
+
+        for start in range(0, len(requests), batch_size):
+            analytics.rollups_collection.bulk_write(requests[start:start + batch_size], ordered=False)
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {len(buckets)} doctor days ({len(requests) - len(buckets)} emptied)."))
@@ -0,0 +1,101 @@
+import asyncio
+from datetime import datetime
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from bson.objectid import ObjectId
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory, override_settings
+
+from hospital_app import async_views, doctor_cache, stats, versions, views
+from hospital_app.benchmarking import AsyncLatencyCollection, LatencyCollection, drive
+
+VIEWS = ['patient_list', 'appointment_list', 'search_appointments', 'search_doctors', 'staff_dashboard']
+PATHS = {
+    'patient_list': '/patients/',
+    'appointment_list': '/appointments/',
+    'search_appointments': '/search/appointments/?status=Scheduled',
+    'search_doctors': '/search/doctors/?q=car',
+    'staff_dashboard': '/staff/dashboard/',
+}
+
+
+def sample_documents(count):
+    people = [{'_id': ObjectId(), 'patient_id': f'PAT{i:06d}', 'doctor_id': f'DOC{i:06d}',
+               'first_name': f'First{i}', 'last_name': f'Last{i}', 'email': f'person{i}@example.com',
+               'specialization': ('Cardiology', 'Neurology', 'Pediatrics')[i % 3],
+               'department': ('Heart', 'Brain', 'Children')[i % 3],
+               'registration_date': datetime.now()} for i in range(count)]
+    appointments = [{'_id': ObjectId(), 'appointment_id': f'APT{i:06d}', 'patient_id': people[i]['_id'],
+                     'doctor_id': people[-i]['_id'], 'appointment_date': datetime(2025, 1, 1),
+                     'time_slot': '09:00 AM - 10:00 AM', 'purpose': 'Consultation',
+                     'status': 'Scheduled'} for i in range(count)]
+    return people, appointments
+
+
+class Command(BaseCommand):
+    help = ("Compare requests per second of the sync views (run the way Django's ASGI handler runs "
+            "them, on the thread-sensitive executor) and the async views, against a Mongo stand-in "
+            "with injected latency.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--latency-ms', type=float, default=5.0, help="Latency per Mongo round trip.")
+        parser.add_argument('--requests', type=int, default=200, help="Requests per view and mode.")
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--view', action='append', choices=VIEWS, help="Limit to these views.")
+
+    def handle(self, *args, **options):
+        latency = options['latency_ms'] / 1000
+        people, appointments = sample_documents(100)
+        user = User(username='benchmark')
+        factory = RequestFactory()
+
+        async def auser():
+            return user
+
+        def make_request(view_name):
+            request = factory.get(PATHS[view_name])
+            request.user = user
+            request.auser = auser
+            return request
+
+        patches = []
+        for module, collection_class in ((views, LatencyCollection), (async_views, AsyncLatencyCollection)):
+            for attribute, documents in (('patients_collection', people), ('doctors_collection', people),
+                                         ('appointments_collection', appointments)):
+                stand_in = collection_class(attribute.split('_')[0], documents, latency)
+                patches.append(mock.patch.object(module, attribute, stand_in))
+        # The dashboard reads a cached snapshot; point its refresh at a stand-in too
+        patches.append(mock.patch.object(stats, 'patients_collection', LatencyCollection('patients', [], latency)))
+        # The list pages read the change versions for their ETag first
+        patches.append(mock.patch.object(versions, 'versions_collection',
+                                         LatencyCollection('change_versions', [], latency)))
+        patches.append(mock.patch.object(versions, 'async_versions_collection',
+                                         AsyncLatencyCollection('change_versions', [], latency)))
+
+        self.stdout.write(f"{'view':<22}{'mode':<7}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+        # Fragments rendered from the stand-in data must not land in the real caches
+        local_caches = {alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                'LOCATION': f'benchmark-async-views-{alias}'} for alias in settings.CACHES}
+        with mock.patch.object(doctor_cache, 'CACHE_SECONDS', 0), override_settings(CACHES=local_caches):
+            for patch in patches:
+                patch.start()
+            try:
+                for view_name in options['view'] or VIEWS:
+                    sync_view = getattr(views, view_name).__wrapped__
+                    async_view = getattr(async_views, view_name).__wrapped__
+                    runs = {
+                        'sync': sync_to_async(lambda: sync_view(make_request(view_name)), thread_sensitive=True),
+                        'async': lambda: async_view(make_request(view_name)),
+                    }
+                    for mode, call in runs.items():
+                        result = asyncio.run(drive(call, options['requests'], options['concurrency']))
+                        self.stdout.write(
+                            f"{view_name:<22}{mode:<7}{result['rps']:>9.1f}{result['p50_ms']:>9.1f}"
+                            f"{result['p95_ms']:>9.1f}{result['p99_ms']:>9.1f}"
+                        )
+            finally:
+                for patch in patches:
+                    patch.stop()
@@ -0,0 +1,103 @@
+import random
+import time
+from datetime import timedelta
+
+from bson import ObjectId
+from django.core.management.base import BaseCommand
+from pymongo import ASCENDING, IndexModel, InsertOne
+
+from hospital_app import scheduling
+from hospital_app.benchmarking import percentile
+from hospital_app.bulk import OUTCOMES, apply_changes
+from hospital_app.dates import parse_day, today
+from hospital_app.mongo import get_db
+from hospital_app.scheduling import SLOTS, day_key
+
+
+class Command(BaseCommand):
+    help = ("Time a batch of appointment cancellations and reschedules applied with the bulk path against "
+            "the same batch applied one appointment at a time, on scratch collections in the configured "
+            "database (dropped afterwards).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--changes', type=int, default=1000)
+        parser.add_argument('--doctors', type=int, default=50)
+        parser.add_argument('--days', type=int, default=30, help="Days of existing bookings per doctor.")
+        parser.add_argument('--repeat', type=int, default=5, help="Timed runs per path (data reloaded each run).")
+        parser.add_argument('--keep', action='store_true', help="Keep the scratch collections.")
+
+    def handle(self, *args, **options):
+        db = get_db()
+        appointments, schedules = db['bench_bulk_appointments'], db['bench_bulk_schedules']
+        doctors = [{'_id': ObjectId(), 'doctor_id': f'BENCH{n:04d}', 'last_name': f'Bench{n}'}
+                   for n in range(options['doctors'])]
+        try:
+            self.stdout.write(f"{'path':<24}{'changes':>8}{'p50 ms':>9}{'p95 ms':>9}  outcomes")
+            for label, run in (('bulk_write', self.run_bulk), ('one at a time', self.run_single)):
+                latencies = []
+                for attempt in range(options['repeat']):
+                    changes = self.load(appointments, schedules, doctors, options, seed=attempt)
+                    started = time.perf_counter()
+                    outcomes = run(changes, appointments, schedules, doctors)
+                    latencies.append(time.perf_counter() - started)
+                self.stdout.write(f"{label:<24}{len(changes):>8}{percentile(latencies, 50) * 1000:>9.1f}"
+                                  f"{percentile(latencies, 95) * 1000:>9.1f}  {outcomes}")
+        finally:
+            if not options['keep']:
+                appointments.drop()
+                schedules.drop()
+
+    def load(self, appointments, schedules, doctors, options, seed):
+        """Fresh bookings plus a random batch of cancellations and moves to later days."""
+        appointments.drop()
+        schedules.drop()
+        appointments.create_indexes([IndexModel([('appointment_id', ASCENDING)], unique=True)])
+        schedules.create_indexes([IndexModel([('doctor_id', ASCENDING), ('date', ASCENDING)], unique=True)])
+        rng = random.Random(seed)
+        start = today()
+        inserts, booked = [], {}
+        for doctor in doctors:
+            for offset in range(options['days']):
+                day = start + timedelta(days=offset)
+                for slot in rng.sample(SLOTS, len(SLOTS) // 2):
+                    inserts.append(InsertOne({
+                        'appointment_id': f'BA{len(inserts):07d}', 'doctor_id': doctor['_id'],
+                        'appointment_date': day, 'time_slot': slot, 'status': 'Scheduled',
+                    }))
+                    booked.setdefault((doctor['_id'], day_key(day)), []).append(slot)
+        appointments.bulk_write(inserts, ordered=False)
+        schedules.insert_many([{'doctor_id': doctor_id, 'date': day, 'booked': slots}
+                               for (doctor_id, day), slots in booked.items()])
+
+        changes = []
+        for number in rng.sample(range(len(inserts)), min(options['changes'], len(inserts))):
+            change = {'appointment_id': f'BA{number:07d}'}
+            if rng.random() < 0.4:
+                change['status'] = 'Cancelled'
+            else:
+                # Past the booked days, with the odd collision between moves
+                change['appointment_date'] = str((start + timedelta(days=options['days'] + rng.randrange(7))).date())
+                change['time_slot'] = rng.choice(SLOTS)
+            changes.append(change)
+        return changes
+
+    def run_bulk(self, changes, appointments, schedules, doctors):
+        result = apply_changes(changes, appointments, doctors, schedules=schedules)
+        return ', '.join(f"{result['summary'][outcome]} {outcome}" for outcome in OUTCOMES)
+
+    def run_single(self, changes, appointments, schedules, doctors):
+        """What the update view does, once per change."""
+        updated = conflicts = 0
+        for change in changes:
+            appointment = appointments.find_one({'appointment_id': change['appointment_id']})
+            fields = {field: value for field, value in change.items() if field != 'appointment_id'}
+            if 'appointment_date' in fields:
+                fields['appointment_date'] = parse_day(fields['appointment_date'])
+            try:
+                scheduling.move(appointment, dict(appointment, **fields), schedules=schedules)
+            except scheduling.SlotUnavailable:
+                conflicts += 1
+                continue
+            appointments.update_one({'_id': appointment['_id']}, {'$set': fields})
+            updated += 1
+        return f"{updated} updated, {conflicts} conflict"
@@ -0,0 +1,84 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from pymongo import ASCENDING, DESCENDING, IndexModel, InsertOne
+
+from hospital_app.benchmarking import percentile
+from hospital_app.dates import day_range, today
+from hospital_app.mongo import get_db
+
+STATUSES = ['Scheduled', 'Confirmed', 'Completed', 'Cancelled']
+INDEXES = [
+    IndexModel([('appointment_date', DESCENDING), ('_id', DESCENDING)], name='appointment_date'),
+    IndexModel([('status', ASCENDING), ('appointment_date', DESCENDING), ('_id', DESCENDING)], name='status_date'),
+]
+
+
+class Command(BaseCommand):
+    help = ("Compare range-count latency of appointment_date stored as YYYY-MM-DD strings against BSON "
+            "dates, on two scratch collections in the configured database (dropped afterwards).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--documents', type=int, default=200000)
+        parser.add_argument('--days', type=int, default=730, help="Spread appointments over this many days.")
+        parser.add_argument('--repeat', type=int, default=50, help="Timed runs per query.")
+        parser.add_argument('--keep', action='store_true', help="Keep the scratch collections.")
+
+    def handle(self, *args, **options):
+        db = get_db()
+        strings, typed = db['bench_appointment_dates_str'], db['bench_appointment_dates_date']
+        end = today()
+        try:
+            self.load(strings, typed, end, options['documents'], options['days'])
+            self.stdout.write(f"{'query':<40}{'storage':<22}{'count':>8}{'p50 ms':>9}{'p95 ms':>9}")
+            for days in (7, 30, 90):
+                start = end - timedelta(days=days - 1)
+                day_strings = [str((start + timedelta(days=n)).date()) for n in range(days)]
+                for status in (None, 'Scheduled'):
+                    label = f"last {days} days" + (f", {status}" if status else "")
+                    with_status = {'status': status} if status else {}
+                    runs = [
+                        # The old equality-only filter needs one value per day
+                        ('string, $in per day', strings, {'appointment_date': {'$in': day_strings}}),
+                        ('string, $gte/$lte', strings,
+                         {'appointment_date': {'$gte': day_strings[0], '$lte': day_strings[-1]}}),
+                        ('date, $gte/$lt', typed, {'appointment_date': day_range(start, end)}),
+                    ]
+                    for storage, collection, criteria in runs:
+                        count, p50, p95 = self.time_count(collection, dict(criteria, **with_status), options['repeat'])
+                        self.stdout.write(f"{label:<40}{storage:<22}{count:>8}{p50:>9.2f}{p95:>9.2f}")
+        finally:
+            if not options['keep']:
+                strings.drop()
+                typed.drop()
+
+    def load(self, strings, typed, end, documents, days):
+        strings.drop()
+        typed.drop()
+        strings.create_indexes(INDEXES)
+        typed.create_indexes(INDEXES)
+        rng = random.Random(13)
+        batch_str, batch_date = [], []
+        for _ in range(documents):
+            day = end - timedelta(days=rng.randrange(days))
+            status = rng.choice(STATUSES)
+            batch_str.append(InsertOne({'appointment_date': str(day.date()), 'status': status}))
+            batch_date.append(InsertOne({'appointment_date': day, 'status': status}))
+            if len(batch_str) >= 10000:
+                strings.bulk_write(batch_str, ordered=False)
+                typed.bulk_write(batch_date, ordered=False)
+                batch_str, batch_date = [], []
+        if batch_str:
+            strings.bulk_write(batch_str, ordered=False)
+            typed.bulk_write(batch_date, ordered=False)
+
+    def time_count(self, collection, criteria, repeat):
+        count = collection.count_documents(criteria)  # warm-up
+        latencies = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            collection.count_documents(criteria)
+            latencies.append(time.perf_counter() - started)
+        return count, percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000
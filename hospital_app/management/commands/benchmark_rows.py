@@ -0,0 +1,86 @@
+import gc
+import time
+import tracemalloc
+from itertools import islice
+
+import bson
+from bson.codec_options import CodecOptions
+from django.core.management.base import BaseCommand
+
+from hospital_app.rows import AppointmentRow, DoctorRow, PatientRow
+from hospital_app.synthetic import HospitalData
+
+KINDS = {
+    'patients': (PatientRow, 'patient_batches'),
+    'doctors': (DoctorRow, 'doctor_batches'),
+    'appointments': (AppointmentRow, 'appointment_batches'),
+}
+
+
+class Command(BaseCommand):
+    help = ("Measure what one large list page costs to decode: whole documents decoded to dicts (with "
+            "the id key the views used to add) against projected documents decoded straight into the "
+            "hospital_app.rows classes. Uses synthetic documents encoded as BSON, so no server is needed.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=50000)
+        parser.add_argument('--repeat', type=int, default=5, help="Timed decodes per variant (best is shown).")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        count = options['rows']
+        data = HospitalData(patients=count, doctors=count, appointments=count, seed=options['seed'])
+        self.stdout.write(f"{count} rows per page")
+        self.stdout.write(f"{'collection':<14}{'variant':<18}{'wire KiB':>10}{'decode ms':>11}{'retained KiB':>14}")
+        for name, (row_class, batches) in KINDS.items():
+            documents = self.documents(getattr(data, batches), count)
+            full = b''.join(bson.encode(document) for document in documents)
+            projected = b''.join(
+                bson.encode({key: value for key, value in document.items()
+                             if key == '_id' or key in row_class.projection})
+                for document in documents
+            )
+            variants = [
+                ('documents', full, self.decode_documents),
+                ('projected rows', projected, lambda raw: bson.decode_all(raw, CodecOptions(document_class=row_class))),
+            ]
+            for label, raw, decode in variants:
+                elapsed = self.best_time(decode, raw, options['repeat'])
+                retained = self.retained(decode, raw)
+                self.stdout.write(f"{name:<14}{label:<18}{len(raw) // 1024:>10}{elapsed * 1000:>11.1f}"
+                                  f"{retained // 1024:>14}")
+
+    def documents(self, batches, count):
+        documents = []
+        for batch in batches(5000):
+            # Appointment batches come with their doctor_schedules
+            documents.extend(batch[0] if isinstance(batch, tuple) else batch)
+            if len(documents) >= count:
+                break
+        return list(islice(documents, count))
+
+    def decode_documents(self, raw):
+        documents = bson.decode_all(raw)
+        for document in documents:
+            document['id'] = str(document['_id'])
+        return documents
+
+    def best_time(self, decode, raw, repeat):
+        timings = []
+        for _ in range(repeat):
+            gc.collect()
+            started = time.perf_counter()
+            decode(raw)
+            timings.append(time.perf_counter() - started)
+        return min(timings)
+
+    def retained(self, decode, raw):
+        gc.collect()
+        tracemalloc.start()
+        try:
+            result = decode(raw)
+            size = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        del result
+        return size
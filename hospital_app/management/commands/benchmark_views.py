@@ -0,0 +1,235 @@
+import json
+import logging
+import platform
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime
+from unittest import mock
+
+import django
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import URLPattern, reverse
+
+from hospital_app import api, changefeed, doctor_cache, mongo, profiling, urls
+from hospital_app.benchmarking import compare_baselines, peak_rss_kb, summarize
+from hospital_app.dates import today
+from hospital_app.testing import MemoryDatabase
+from hospital_app.synthetic import HospitalData, load
+
+# Views that change or end state on GET, need a token from an email, or are POST-only
+SKIPPED = {'delete-patient', 'delete-doctor', 'delete-appointment', 'staff_logout',
+           'password_reset_confirm', 'api-batch-get', 'api-batch', 'api-appointment-bulk'}
+QUERIES = {
+    'search-patients': 'q=smi',
+    'search-doctors': 'q=cardio',
+    'search-appointments': 'status=Scheduled',
+    'earliest-slot': 'specialization=Cardiology',
+    'api-changes': 'wait=0',
+    'patient-lookup': 'q=smi',
+    'doctor-lookup': 'q=cardio',
+}
+EXPORTS = ['patients', 'appointments']
+# Views that run an aggregation pipeline, which the --in-memory fakes can't
+AGGREGATING = {'staff_dashboard'}
+
+
+class Command(BaseCommand):
+    help = ("Drive every GET view in hospital_app.urls through the Django test client and report "
+            "p50/p95/p99 latency, Mongo queries per request and peak memory per endpoint. Runs "
+            "against the configured database (fill it with generate_hospital_data) or, with "
+            "--in-memory, against a generated in-memory data set. --output saves a JSON baseline; "
+            "--compare diffs against one.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--in-memory', action='store_true',
+                            help="Use an in-memory stand-in instead of MongoDB. Views that aggregate, like "
+                                 "the staff dashboard, are skipped.")
+        parser.add_argument('--patients', type=int, default=2000, help="In-memory data set size.")
+        parser.add_argument('--doctors', type=int, default=50)
+        parser.add_argument('--appointments', type=int, default=10000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--requests', type=int, default=50, help="Timed requests per endpoint.")
+        parser.add_argument('--warmup', type=int, default=3, help="Untimed requests per endpoint first.")
+        parser.add_argument('--endpoint', action='append', help="Limit to these URL names.")
+        parser.add_argument('--output', help="Write the results as a JSON baseline to this path.")
+        parser.add_argument('--compare', help="Baseline JSON to diff the results against.")
+        parser.add_argument('--threshold', type=float, default=10.0,
+                            help="p95 growth (percent) that counts as a regression.")
+        parser.add_argument('--fail-on-regression', action='store_true')
+
+    def handle(self, *args, **options):
+        meta = {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'backend': 'memory' if options['in_memory'] else 'mongodb',
+            'requests': options['requests'],
+        }
+        patches = []
+        if options['in_memory']:
+            database = MemoryDatabase()
+            data = HospitalData(options['patients'], options['doctors'], options['appointments'],
+                                seed=options['seed'])
+            load(database, data)
+            meta['data'] = {'patients': data.patients, 'doctors': data.doctors,
+                            'appointments': data.appointments, 'seed': data.seed}
+            patches.append(mock.patch.object(mongo, 'get_db', lambda: database))
+            # The change feed source probed against the stand-in is forgotten afterwards
+            patches.append(mock.patch.object(changefeed, '_detected_source', None))
+        for patch in patches:
+            patch.start()
+        try:
+            endpoints = self.endpoints(options['endpoint'], options['in_memory'])
+            results = self.run(endpoints, options)
+        finally:
+            for patch in patches:
+                patch.stop()
+
+        baseline = {'meta': meta, 'endpoints': results}
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(baseline, output, indent=2, sort_keys=True)
+            self.stdout.write(f"Baseline written to {options['output']}")
+        if options['compare']:
+            with open(options['compare']) as source:
+                regressions = self.compare(json.load(source), baseline, options['threshold'])
+            if regressions and options['fail_on_regression']:
+                raise CommandError(f"{regressions} endpoints regressed.")
+
+    def endpoints(self, only, in_memory=False):
+        """``(label, path)`` for every GET-able URL pattern, with sample arguments."""
+        samples = {
+            'patient_id': str((mongo.patients_collection.find_one({}, {'_id': 1}) or {}).get('_id', '')),
+            'doctor_id': str((mongo.doctors_collection.find_one({}, {'_id': 1}) or {}).get('_id', '')),
+            'appointment_id': str((mongo.appointments_collection.find_one({}, {'_id': 1}) or {}).get('_id', '')),
+        }
+        endpoints = []
+        for pattern in urls.urlpatterns:
+            if not isinstance(pattern, URLPattern) or pattern.name in SKIPPED:
+                continue
+            if only and pattern.name not in only:
+                continue
+            if in_memory and pattern.name in AGGREGATING:
+                self.stdout.write(self.style.WARNING(
+                    f"Skipping {pattern.name}: it runs an aggregation pipeline, which --in-memory doesn't support"))
+                continue
+            arguments = list(pattern.pattern.converters)
+            if arguments == ['name']:
+                variants = [(f'{pattern.name}[{name}]', {'name': name}, 'format=csv') for name in EXPORTS]
+            elif arguments == ['resource']:
+                variants = [(f'{pattern.name}[{name}]', {'resource': name}, '') for name in api.RESOURCES]
+            elif arguments == ['resource', 'record_id'] and samples['patient_id']:
+                variants = [(pattern.name, {'resource': 'patients', 'record_id': samples['patient_id']}, '')]
+            elif arguments == ['record_id'] and samples['patient_id']:
+                # Patient-scoped API routes (the patient's history)
+                variants = [(pattern.name, {'record_id': samples['patient_id']}, '')]
+            elif any(not samples.get(argument) for argument in arguments):
+                self.stdout.write(self.style.WARNING(f"Skipping {pattern.name}: no sample {arguments}"))
+                continue
+            else:
+                query = QUERIES.get(pattern.name, '')
+                if pattern.name == 'doctor-slots':
+                    query = f"date={today().date().isoformat()}"
+                variants = [(pattern.name, {argument: samples[argument] for argument in arguments}, query)]
+            for label, kwargs, query in variants:
+                path = reverse(pattern.name, kwargs=kwargs)
+                endpoints.append((label, f'{path}?{query}' if query else path))
+        return endpoints
+
+    def run(self, endpoints, options):
+        results = {}
+        self.stdout.write(f"{'endpoint':<34}{'status':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+                          f"{'queries':>9}{'alloc KiB':>11}{'rss KiB':>10}")
+        # Failures are reported per endpoint instead of as logged tracebacks
+        request_logger = logging.getLogger('django.request')
+        request_logger.disabled = True
+        # The benchmark user and its sessions are rolled back afterwards
+        try:
+            with transaction.atomic(), override_settings(ALLOWED_HOSTS=['testserver'], HOSPITAL_MONGO_PANEL=False):
+                client = Client()
+                client.force_login(User.objects.create_user('benchmark-user'))
+                for label, path in endpoints:
+                    results[label] = result = self.measure(client, path, options['requests'], options['warmup'])
+                    self.stdout.write(
+                        f"{label:<34}{result['status']:>7}{result['p50_ms']:>9.1f}{result['p95_ms']:>9.1f}"
+                        f"{result['p99_ms']:>9.1f}{result['queries_mean']:>9.1f}{result['alloc_peak_kb']:>11}"
+                        f"{result['peak_rss_kb']:>10}"
+                    )
+                    if result['error']:
+                        self.stdout.write(self.style.WARNING(f"  {result['error']}"))
+                transaction.set_rollback(True)
+        finally:
+            request_logger.disabled = False
+        # Cached doctor lists would otherwise outlive the in-memory data
+        doctor_cache.invalidate()
+        return results
+
+    def measure(self, client, path, requests, warmup):
+        def get():
+            # Profiled here rather than read from X-Mongo-Queries, which a
+            # streaming response sends before its queries run
+            with profiling.profiled() as profile:
+                response = client.get(path)
+                if response.streaming:
+                    for _ in response.streaming_content:
+                        pass
+            return response, profile.count
+
+        error = None
+        latencies, queries, statuses = [], [], set()
+        try:
+            for _ in range(warmup):
+                get()
+            for _ in range(requests):
+                started = time.perf_counter()
+                response, count = get()
+                latencies.append(time.perf_counter() - started)
+                queries.append(count)
+                statuses.add(response.status_code)
+            # One extra, untimed request for the Python allocation peak
+            tracemalloc.start()
+            try:
+                get()
+                alloc_peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+        except Exception as exception:
+            error = f"{type(exception).__name__}: {exception}"
+            alloc_peak = 0
+
+        result = summarize(latencies, sum(latencies))
+        result.update({
+            'path': path,
+            'status': ','.join(map(str, sorted(statuses))) or 'error',
+            'error': error,
+            'queries_mean': sum(queries) / len(queries) if queries else 0.0,
+            'queries_max': max(queries, default=0),
+            'alloc_peak_kb': alloc_peak // 1024,
+            'peak_rss_kb': peak_rss_kb(),
+        })
+        return result
+
+    def compare(self, old, new, threshold):
+        self.stdout.write(f"\nAgainst {old['meta'].get('commit') or 'baseline'} ({old['meta'].get('created_at')}):")
+        self.stdout.write(f"{'endpoint':<34}{'p95 before':>11}{'p95 after':>11}{'change':>9}{'queries':>10}")
+        regressions = 0
+        for endpoint, before, after, change, regressed in compare_baselines(old, new, threshold):
+            regressions += regressed
+            line = (f"{endpoint:<34}{before['p95_ms']:>11.1f}{after['p95_ms']:>11.1f}{change:>+8.1f}%"
+                    f"{before['queries_max']:>5} -> {after['queries_max']}")
+            self.stdout.write(self.style.ERROR(line) if regressed else line)
+        return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              timeout=5).stdout.strip() or None
+    except OSError:
+        return None
@@ -0,0 +1,56 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from hospital_app import doctor_cache
+from hospital_app.bulk import OUTCOMES, apply_changes, apply_edit
+from hospital_app.mongo import appointments_collection, doctors_collection, patients_collection
+from hospital_app.scheduling import STATUSES
+
+
+class Command(BaseCommand):
+    help = ("Cancel, re-status or reschedule many appointments at once: select them by doctor, date range "
+            "and status, or give a JSON file of per-appointment changes, and print an outcome per appointment.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctor', help="doctor_id (or ObjectId) of the doctor whose appointments to change.")
+        parser.add_argument('--from', dest='date_from', help="First day, YYYY-MM-DD.")
+        parser.add_argument('--to', dest='date_to', help="Last day, YYYY-MM-DD.")
+        parser.add_argument('--status', action='append', choices=STATUSES,
+                            help="Only appointments in this status (repeatable).")
+        parser.add_argument('--set-status', choices=STATUSES, help="New status for every selected appointment.")
+        parser.add_argument('--shift-days', type=int, help="Move every selected appointment by this many days.")
+        parser.add_argument('--set-doctor', help="Move every selected appointment to this doctor.")
+        parser.add_argument('--changes', help='JSON file with a list of {"appointment_id": ..., ...} changes.')
+        parser.add_argument('--dry-run', action='store_true', help="Report the outcomes without writing.")
+
+    def handle(self, *args, **options):
+        doctors = doctor_cache.doctor_options(doctors_collection)
+        try:
+            if options['changes']:
+                with open(options['changes']) as changes_file:
+                    changes = json.load(changes_file)
+                result = apply_changes(changes, appointments_collection, doctors, dry_run=options['dry_run'],
+                                       patients=patients_collection)
+            else:
+                selection = {'doctor_id': options['doctor'], 'from': options['date_from'],
+                             'to': options['date_to'], 'status': options['status']}
+                edit = {'status': options['set_status'], 'shift_days': options['shift_days'],
+                        'doctor_id': options['set_doctor']}
+                result = apply_edit({key: value for key, value in selection.items() if value},
+                                    {key: value for key, value in edit.items() if value is not None},
+                                    appointments_collection, doctors, dry_run=options['dry_run'],
+                                    patients=patients_collection)
+        except (OSError, ValueError) as exc:
+            # BulkError is a ValueError, as are JSON syntax errors
+            raise CommandError(str(exc))
+
+        for item in result['results']:
+            if item['status'] != 'unchanged':
+                line = f"{item['appointment_id']}: {item['status']}"
+                if item.get('error'):
+                    line += f" ({item['error']})"
+                self.stdout.write(line)
+        summary = ', '.join(f"{result['summary'][outcome]} {outcome}" for outcome in OUTCOMES)
+        prefix = "Dry run: " if result['dry_run'] else ""
+        self.stdout.write(self.style.SUCCESS(f"{prefix}{summary}."))
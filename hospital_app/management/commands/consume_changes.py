@@ -0,0 +1,60 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from pymongo.errors import PyMongoError
+
+from hospital_app import changefeed, encoding
+from hospital_app.api import feed_event, feed_projections
+
+
+class Command(BaseCommand):
+    help = ("Write the change feed as JSON lines (one event per line, with its checkpoint) from where the "
+            "named consumer left off, saving its checkpoint after every batch. Stops at the end of the "
+            "feed unless --follow is given.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--consumer', required=True, help="Name the checkpoint is saved under.")
+        parser.add_argument('--output', help="Append to this file instead of writing to stdout.")
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--follow', action='store_true', help="Keep waiting for new changes.")
+        parser.add_argument('--wait', type=float, default=25, help="Seconds to wait for changes per poll.")
+        parser.add_argument('--reset', action='store_true',
+                            help="Forget the saved checkpoint and start from the beginning of the feed.")
+
+    def handle(self, *args, **options):
+        consumer = options['consumer']
+        checkpoint = None if options['reset'] else changefeed.load_checkpoint(consumer)
+        try:
+            changefeed.check_checkpoint(checkpoint)
+        except changefeed.CheckpointError as exc:
+            raise CommandError(f"{exc} (pass --reset)")
+
+        output = open(options['output'], 'ab') if options['output'] else sys.stdout.buffer
+        projections = feed_projections()
+        total = 0
+        try:
+            while True:
+                try:
+                    events, end = changefeed.read_changes(checkpoint, options['batch_size'],
+                                                          options['wait'] if options['follow'] else 0, projections)
+                except KeyboardInterrupt:
+                    break
+                except PyMongoError as exc:
+                    if not options['follow']:
+                        raise CommandError(f"Cannot read the change feed: {exc}")
+                    self.stderr.write(f"Change feed interrupted ({exc}); resuming")
+                    continue
+                for event_checkpoint, event in events:
+                    output.write(encoding.dumps(feed_event(event_checkpoint, event)) + b'\n')
+                output.flush()
+                # Only after the batch is written, so a crash repeats it rather than losing it
+                if end and end != checkpoint:
+                    changefeed.save_checkpoint(consumer, end)
+                    checkpoint = end
+                total += len(events)
+                if not events and not options['follow']:
+                    break
+        finally:
+            if options['output']:
+                output.close()
+        self.stderr.write(f"{total} changes for {consumer}.")
@@ -0,0 +1,84 @@
+from django.core.management.base import BaseCommand, CommandError
+from pymongo.errors import OperationFailure
+
+from hospital_app import archive
+from hospital_app.indexes import INDEXES, diff_indexes, explain_view_queries
+from hospital_app.mongo import db
+
+
+class Command(BaseCommand):
+    help = "Create the MongoDB indexes declared in hospital_app.indexes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Show what would be created without touching the database.")
+        parser.add_argument('--diff', action='store_true',
+                            help="Only report differences between the spec and the live indexes.")
+        parser.add_argument('--drop-extra', action='store_true',
+                            help="Drop live indexes that are not part of the spec.")
+        parser.add_argument('--explain', action='store_true',
+                            help="Explain the view queries and fail if any of them scans a collection.")
+
+    def handle(self, *args, **options):
+        report_only = options['dry_run'] or options['diff']
+        failures = []
+
+        if not report_only:
+            # The list and search indexes are partial on archive.ACTIVE, so
+            # records written before soft delete existed need the flag first
+            for name in archive.REFERENCES:
+                marked = archive.mark_active(db[name])
+                if marked:
+                    self.stdout.write(f"{name}: marked {marked} records active")
+
+        for collection_name, spec in INDEXES.items():
+            collection = db[collection_name]
+            missing, changed, extra = diff_indexes(spec, collection.index_information())
+            self._report(collection_name, missing, changed, extra)
+            if options['dry_run']:
+                for name in missing + changed:
+                    self.stdout.write(f"  would create {collection_name}.{name}")
+                if options['drop_extra']:
+                    for name in extra:
+                        self.stdout.write(f"  would drop {collection_name}.{name}")
+            if report_only:
+                continue
+
+            # A changed index has to be dropped before it can be recreated
+            for name in changed:
+                collection.drop_index(name)
+            wanted = [model for model in spec if model.document['name'] in missing + changed]
+            if wanted:
+                try:
+                    collection.create_indexes(wanted)
+                except OperationFailure as exc:
+                    failures.append(f"{collection_name}: {exc}")
+            if options['drop_extra']:
+                for name in extra:
+                    collection.drop_index(name)
+
+        if failures:
+            raise CommandError("Could not create indexes:\n" + "\n".join(failures))
+        if not report_only:
+            self.stdout.write(self.style.SUCCESS("Indexes are up to date."))
+
+        if options['explain']:
+            self._explain()
+
+    def _report(self, collection_name, missing, changed, extra):
+        if not (missing or changed or extra):
+            self.stdout.write(f"{collection_name}: in sync")
+            return
+        for label, names in (('missing', missing), ('changed', changed), ('extra', extra)):
+            if names:
+                self.stdout.write(f"{collection_name}: {label} {', '.join(names)}")
+
+    def _explain(self):
+        scans = []
+        for label, verdict, stages in explain_view_queries(db):
+            style = self.style.ERROR if verdict == 'COLLSCAN' else self.style.SUCCESS
+            self.stdout.write(f"{style(f'{verdict:<9}')} {label} ({' <- '.join(stages)})")
+            if verdict == 'COLLSCAN':
+                scans.append(label)
+        if scans:
+            raise CommandError(f"{len(scans)} view queries are not served by an index: {', '.join(scans)}")
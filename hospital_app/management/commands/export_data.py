@@ -0,0 +1,47 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from hospital_app import export
+from hospital_app.mongo import appointments_collection, doctors_collection, patients_collection
+
+COLLECTIONS = {'patients': patients_collection, 'appointments': appointments_collection}
+
+
+class Command(BaseCommand):
+    help = "Stream patients or appointments to a CSV, JSONL or Parquet file (or stdout) in constant memory."
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=sorted(export.EXPORTS))
+        parser.add_argument('--format', choices=export.FORMATS, default='csv')
+        parser.add_argument('--fields', help="Comma-separated columns (default: all).")
+        parser.add_argument('--from', dest='date_from', help="First day to include (YYYY-MM-DD).")
+        parser.add_argument('--to', dest='date_to', help="Last day to include (YYYY-MM-DD).")
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--batch-size', type=int, default=export.EXPORT_BATCH_SIZE)
+        parser.add_argument('--output', '-o', help="Output file (default: stdout).")
+
+    def handle(self, *args, **options):
+        name = options['name']
+        try:
+            fields = export.export_fields(name, options['fields'])
+            criteria = export.date_criteria(name, options['date_from'], options['date_to'])
+            chunks = export.export_chunks(
+                name, options['format'], COLLECTIONS[name], fields, criteria, compress=options['gzip'],
+                patients_collection=patients_collection, doctors_collection=doctors_collection,
+                batch_size=options['batch_size'],
+            )
+        except export.ExportError as error:
+            raise CommandError(error)
+
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        written = 0
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+                written += len(chunk)
+        finally:
+            if options['output']:
+                output.close()
+        if options['output']:
+            self.stderr.write(f"Wrote {written} bytes to {options['output']}.")
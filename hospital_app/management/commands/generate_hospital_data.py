@@ -0,0 +1,67 @@
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from hospital_app import versions
+from hospital_app.dates import parse_day
+from hospital_app.mongo import get_db
+from hospital_app.synthetic import HospitalData, load
+
+COLLECTIONS = ['patients', 'doctors', 'appointments', 'doctor_schedules', 'counters']
+
+
+class Command(BaseCommand):
+    help = ("Fill the configured database with reproducible synthetic patients, doctors and "
+            "appointments (conflict-free, with matching doctor_schedules), using bulk inserts. "
+            "The same --seed always produces the same documents.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patients', type=int, default=10000)
+        parser.add_argument('--doctors', type=int, default=100)
+        parser.add_argument('--appointments', type=int, default=50000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--start', help="First day of the appointment window (YYYY-MM-DD); "
+                                            "default centres the window on today.")
+        parser.add_argument('--days', type=int, default=365, help="Length of the appointment window.")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--drop', action='store_true', help="Drop the app collections first.")
+        parser.add_argument('--skip-indexes', action='store_true',
+                            help="Don't run ensure_mongo_indexes after loading.")
+
+    def handle(self, *args, **options):
+        db = get_db()
+        if options['drop']:
+            for name in COLLECTIONS:
+                db[name].drop()
+        elif db['patients'].estimated_document_count() or db['appointments'].estimated_document_count():
+            raise CommandError("The database already has patients or appointments; use --drop to replace them.")
+
+        try:
+            start = parse_day(options['start']) if options['start'] else None
+        except ValueError:
+            raise CommandError(f"Invalid --start date {options['start']!r}.")
+        data = HospitalData(options['patients'], options['doctors'], options['appointments'],
+                            seed=options['seed'], start=start, days=options['days'])
+        started = time.perf_counter()
+        progress = {}
+
+        def on_batch(name, inserted):
+            # Report roughly every tenth of each collection
+            total = getattr(data, name, None)
+            step = max(options['batch_size'], (total or 0) // 10)
+            if inserted - progress.get(name, 0) >= step or inserted == total:
+                progress[name] = inserted
+                self.stdout.write(f"  {name}: {inserted} ({time.perf_counter() - started:.1f}s)")
+
+        inserted = load(db, data, options['batch_size'], on_batch)
+        versions.bump('patients', 'doctors', 'appointments')
+        elapsed = time.perf_counter() - started
+        documents = sum(inserted.values())
+        self.stdout.write(self.style.SUCCESS(
+            f"Inserted {documents} documents in {elapsed:.1f}s ({documents / elapsed:.0f}/s): "
+            + ', '.join(f"{count} {name}" for name, count in inserted.items())))
+
+        # Building indexes after the load is faster than maintaining them during it
+        if not options['skip_indexes']:
+            call_command('ensure_mongo_indexes', stdout=self.stdout)
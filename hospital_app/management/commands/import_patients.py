@@ -0,0 +1,83 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from hospital_app.importer import FORMATS, IMPORT_BATCH_SIZE, detect_format, import_patients, read_rows, text_stream
+from hospital_app import versions
+from hospital_app.mongo import patients_collection
+from hospital_app.views import patient_ids
+
+
+class Command(BaseCommand):
+    help = ("Import patients from a CSV or JSONL file in unordered batches, upserting on email. "
+            "With --checkpoint, progress is saved after every batch and --resume continues from it.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=FORMATS, help="Defaults to the file extension.")
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+        parser.add_argument('--checkpoint', help="JSON file recording the last line written.")
+        parser.add_argument('--resume', action='store_true', help="Skip lines already written per --checkpoint.")
+        parser.add_argument('--report', help="Write the full JSON report to this file.")
+
+    def handle(self, *args, **options):
+        path = os.path.abspath(options['path'])
+        file_format = options['format'] or detect_format(path)
+        if file_format is None:
+            raise CommandError("Can't tell the format from the file name; pass --format.")
+        checkpoint = options['checkpoint']
+        if options['resume'] and not checkpoint:
+            raise CommandError("--resume needs --checkpoint.")
+
+        start_after = self.load_checkpoint(checkpoint, path) if options['resume'] else 0
+        if start_after:
+            self.stdout.write(f"Resuming after line {start_after}.")
+
+        def on_batch(report):
+            if checkpoint:
+                self.save_checkpoint(checkpoint, path, report)
+            if options['verbosity'] > 1:
+                self.stdout.write(f"  line {report.last_line}: {report.rows} rows, "
+                                  f"{report.rows_per_second:.0f} rows/s")
+
+        with open(path, 'rb') as binary:
+            report = import_patients(
+                read_rows(text_stream(binary), file_format), patients_collection, patient_ids,
+                batch_size=options['batch_size'], start_after=start_after, on_batch=on_batch,
+            )
+        if report.inserted or report.updated:
+            versions.bump('patients')
+
+        for batch in report.batches:
+            first, last = batch['lines']
+            self.stdout.write(self.style.WARNING(
+                f"Batch {batch['batch']} (lines {first}-{last}): {batch['error_count']} errors"))
+            for error in batch['errors']:
+                self.stdout.write(f"  line {error['line']}: {error['error']}")
+        if options['report']:
+            with open(options['report'], 'w') as output:
+                json.dump(report.as_dict(), output, indent=2)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {report.rows} rows in {report.elapsed:.1f}s ({report.rows_per_second:.0f} rows/s): "
+            f"{report.inserted} inserted, {report.updated} updated, "
+            f"{report.invalid} invalid, {report.failed} failed."
+        ))
+
+    def load_checkpoint(self, checkpoint, path):
+        try:
+            with open(checkpoint) as source:
+                state = json.load(source)
+        except FileNotFoundError:
+            return 0
+        if state.get('path') != path:
+            raise CommandError(f"Checkpoint {checkpoint} belongs to {state.get('path')}, not {path}.")
+        return state['last_line']
+
+    def save_checkpoint(self, checkpoint, path, report):
+        # Write then rename so an interrupted save never leaves a torn file
+        temporary = checkpoint + '.tmp'
+        with open(temporary, 'w') as output:
+            json.dump({'path': path, 'last_line': report.last_line, 'rows': report.rows}, output)
+        os.replace(temporary, checkpoint)
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from pymongo import UpdateOne
+
+from hospital_app import versions
+from hospital_app.dates import parse_day
+from hospital_app.mongo import appointments_collection
+
+STRING_DATES = {'appointment_date': {'$type': 'string'}}
+
+
+class Command(BaseCommand):
+    help = ("Convert appointment_date values stored as YYYY-MM-DD strings to BSON dates, in place, "
+            "in batches. Safe to re-run: only string values are selected.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help="Count and validate without writing.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        batch = []
+        converted = invalid = 0
+
+        def flush():
+            nonlocal batch, converted
+            if batch and not options['dry_run']:
+                converted += appointments_collection.bulk_write(batch, ordered=False).modified_count
+            elif batch:
+                converted += len(batch)
+            batch = []
+
+        cursor = appointments_collection.find(STRING_DATES, {'appointment_date': 1}, batch_size=batch_size)
+        for appointment in cursor:
+            value = appointment['appointment_date']
+            try:
+                day = parse_day(value)
+            except ValueError:
+                invalid += 1
+                self.stdout.write(self.style.WARNING(f"{appointment['_id']}: can't parse {value!r}"))
+                continue
+            # Only replace the value we read, in case the appointment was edited meanwhile
+            batch.append(UpdateOne({'_id': appointment['_id'], 'appointment_date': value},
+                                   {'$set': {'appointment_date': day}}))
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+        if converted and not options['dry_run']:
+            versions.bump('appointments')
+
+        verb = "Would convert" if options['dry_run'] else "Converted"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {converted} appointment dates; {invalid} left unparsed."))
@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+from pymongo import ReplaceOne, UpdateOne
+
+from hospital_app.mongo import appointments_collection
+from hospital_app.scheduling import INACTIVE_STATUSES, day_key, schedules_collection
+
+
+class Command(BaseCommand):
+    help = ("Rebuild doctor_schedules (the booked-slot documents used for availability and conflict "
+            "checks) from the appointments collection and report existing double bookings. "
+            "Run it while bookings are paused.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help="Only report double bookings.")
+
+    def handle(self, *args, **options):
+        pipeline = [
+            {'$match': {'status': {'$nin': sorted(INACTIVE_STATUSES)}}},
+            {'$group': {
+                '_id': {'doctor_id': '$doctor_id', 'date': '$appointment_date'},
+                'slots': {'$push': {'slot': '$time_slot', 'appointment_id': '$appointment_id'}},
+            }},
+        ]
+        booked = {}
+        conflicts = 0
+        for group in appointments_collection.aggregate(pipeline, allowDiskUse=True):
+            try:
+                key = (group['_id']['doctor_id'], day_key(group['_id']['date']))
+            except (TypeError, ValueError):
+                self.stdout.write(self.style.WARNING(f"Skipping appointments with date {group['_id']['date']!r}"))
+                continue
+            slots = booked.setdefault(key, {})
+            for entry in group['slots']:
+                slots.setdefault(entry['slot'], []).append(entry['appointment_id'])
+
+        for (doctor_id, day), slots in booked.items():
+            for slot, appointment_ids in slots.items():
+                if len(appointment_ids) > 1:
+                    conflicts += 1
+                    self.stdout.write(self.style.WARNING(
+                        f"Double booking: doctor {doctor_id} {day} {slot}: {', '.join(map(str, appointment_ids))}"))
+        if options['dry_run']:
+            self.stdout.write(f"{conflicts} double-booked slots.")
+            return
+
+        requests = [
+            ReplaceOne({'doctor_id': doctor_id, 'date': day},
+                       {'doctor_id': doctor_id, 'date': day, 'booked': sorted(slots)}, upsert=True)
+            for (doctor_id, day), slots in booked.items()
+        ]
+        # Days that no longer have any active appointment
+        for schedule in schedules_collection.find({}, {'doctor_id': 1, 'date': 1}):
+            if (schedule['doctor_id'], schedule['date']) not in booked:
+                requests.append(UpdateOne({'_id': schedule['_id']}, {'$set': {'booked': []}}))
+
+        batch_size = options['batch_size']
+        for start in range(0, len(requests), batch_size):
+            schedules_collection.bulk_write(requests[start:start + batch_size], ordered=False)
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {len(booked)} doctor days ({len(requests) - len(booked)} cleared); "
+            f"{conflicts} double-booked slots."))
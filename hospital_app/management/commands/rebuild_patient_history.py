@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from hospital_app.history import SUMMARY_FIELDS, refresh
+from hospital_app.mongo import appointments_collection, patients_collection
+
+
+class Command(BaseCommand):
+    help = ("Recompute the appointment history summary (visit count, last visit, next appointment) of every "
+            "patient from the appointments collection, writing only the ones that drifted.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        projection = {field: 1 for field in SUMMARY_FIELDS}
+        checked = repaired = 0
+        batch = {}
+        for patient in patients_collection.find({}, projection, batch_size=batch_size):
+            batch[patient['_id']] = {field: patient.get(field) for field in SUMMARY_FIELDS}
+            if len(batch) >= batch_size:
+                repaired += self.rebuild(batch)
+                checked += len(batch)
+                batch = {}
+        if batch:
+            repaired += self.rebuild(batch)
+            checked += len(batch)
+        self.stdout.write(self.style.SUCCESS(f"Checked {checked} patients; repaired {repaired} summaries."))
+
+    def rebuild(self, stored):
+        # One indexed read of the batch's appointments, one bulk_write of the changes
+        summaries = refresh(stored, patients_collection, appointments_collection, current=stored)
+        return sum(1 for patient_id, summary in summaries.items() if stored[patient_id] != summary)
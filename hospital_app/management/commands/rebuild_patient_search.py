@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from pymongo import UpdateOne
+
+from hospital_app.mongo import patients_collection
+from hospital_app.search import search_fields
+
+SOURCE_FIELDS = {'first_name': 1, 'last_name': 1, 'email': 1, 'phone': 1}
+
+
+class Command(BaseCommand):
+    help = "Recompute the search subdocument of every patient."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        batch = []
+        updated = 0
+        for patient in patients_collection.find({}, SOURCE_FIELDS, batch_size=batch_size):
+            batch.append(UpdateOne({'_id': patient['_id']}, {'$set': {'search': search_fields(patient)}}))
+            if len(batch) >= batch_size:
+                updated += patients_collection.bulk_write(batch, ordered=False).modified_count
+                batch = []
+        if batch:
+            updated += patients_collection.bulk_write(batch, ordered=False).modified_count
+        self.stdout.write(self.style.SUCCESS(f"Updated search fields on {updated} patients."))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from hospital_app.ids import format_id, seed_counter
+from hospital_app.mongo import (
+    appointments_collection, counters_collection, doctors_collection, patients_collection,
+)
+
+SEQUENCES = [
+    ('patient_id', patients_collection, 'PAT'),
+    ('doctor_id', doctors_collection, 'DOC'),
+    ('appointment_id', appointments_collection, 'APT'),
+]
+
+
+class Command(BaseCommand):
+    help = "Seed the business ID counters from the highest IDs already stored."
+
+    def handle(self, *args, **options):
+        for name, collection, prefix in SEQUENCES:
+            highest = seed_counter(counters_collection, collection, name, name, prefix)
+            current = counters_collection.find_one({'_id': name})['seq']
+            self.stdout.write(
+                f"{name}: highest stored {format_id(prefix, highest)}, "
+                f"next allocation {format_id(prefix, current + 1)}"
+            )
+        self.stdout.write(self.style.SUCCESS("ID counters seeded."))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from pymongo.errors import PyMongoError
+
+from hospital_app import doctor_cache
+from hospital_app.mongo import doctors_collection
+
+
+class Command(BaseCommand):
+    help = ("Invalidate the doctor cache whenever the doctors collection changes, "
+            "including edits made outside the application. Requires a replica set.")
+
+    def handle(self, *args, **options):
+        resume_token = None
+        self.stdout.write("Watching the doctors collection for changes...")
+        while True:
+            try:
+                with doctors_collection.watch(resume_after=resume_token) as stream:
+                    for change in stream:
+                        resume_token = stream.resume_token
+                        doctor_cache.invalidate()
+                        self.stdout.write(f"{change['operationType']}: doctor cache invalidated")
+            except KeyboardInterrupt:
+                return
+            except PyMongoError as exc:
+                if resume_token is None:
+                    raise CommandError(f"Cannot open a change stream on doctors: {exc}")
+                # Transient failure after we were running: resume where we left off
+                self.stderr.write(f"Change stream interrupted ({exc}); resuming")
@@ -0,0 +1,366 @@
+"""Prometheus metrics without a client library.
+
+Recording is in-process and cheap: a histogram observation is a
+``bisect`` into fixed buckets plus two additions under an uncontended
+per-metric lock. Each worker process keeps its own series.
+
+For a multi-process server, set ``HOSPITAL_METRICS_DIR`` to a directory
+shared by the workers. Every process writes its series there as
+``<pid>.json`` at most once per ``HOSPITAL_METRICS_FLUSH_SECONDS`` (from
+the request path, after the response is built) and when it is scraped.
+``/metrics`` then sums the files of all processes. Counters and histograms
+of workers that have exited are kept, as they are monotonic totals;
+gauges are only taken from processes that are still alive. Without a
+directory, ``/metrics`` reports the serving process alone.
+
+Exposed series:
+
+* ``hospital_http_request_duration_seconds`` by URL name, method, status;
+* ``hospital_mongo_command_duration_seconds`` by collection and operation;
+* ``hospital_mongo_pool_*`` connection pool checkouts, waits and sizes;
+* ``hospital_cache_requests_total`` and ``hospital_cache_hit_ratio``;
+* ``hospital_template_render_seconds`` by template.
+"""
+import bisect
+import json
+import os
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.template import TemplateDoesNotExist
+from django.template.backends import django as django_backend
+from pymongo import monitoring
+
+from . import doctor_cache, mongo
+
+METRICS_DIR = getattr(settings, 'HOSPITAL_METRICS_DIR', None)
+FLUSH_SECONDS = getattr(settings, 'HOSPITAL_METRICS_FLUSH_SECONDS', 5)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self.series[labels] = self.series.get(labels, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return {labels: value for labels, value in self.series.items()}
+
+
+class Histogram(Counter):
+    """Fixed-bucket histogram. Each series is per-bucket counts followed by the sum."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {labels: list(series) for labels, series in self.series.items()}
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        # Callables returning [(name, kind, documentation, labels dict, value)]
+        # for values kept elsewhere (pool stats, cache stats)
+        self.collectors = []
+        self.last_flush = 0.0
+
+    def register(self, metric):
+        return self.metrics.setdefault(metric.name, metric)
+
+    def snapshot(self):
+        """This process's series in the JSON-serializable form written to disk."""
+        families = {}
+        for metric in self.metrics.values():
+            families[metric.name] = {
+                'kind': metric.kind,
+                'help': metric.documentation,
+                'labelnames': list(metric.labelnames),
+                'buckets': list(getattr(metric, 'buckets', ())),
+                'series': [[list(labels), value] for labels, value in metric.snapshot().items()],
+            }
+        for collect in self.collectors:
+            for name, kind, documentation, labels, value in collect():
+                family = families.setdefault(name, {
+                    'kind': kind, 'help': documentation, 'labelnames': list(labels), 'buckets': [], 'series': [],
+                })
+                family['series'].append([list(labels.values()), value])
+        return {'pid': os.getpid(), 'families': families}
+
+    def flush(self, directory=None):
+        directory = directory or METRICS_DIR
+        self.last_flush = time.monotonic()
+        if not directory:
+            return
+        path = os.path.join(directory, f'{os.getpid()}.json')
+        temporary = f'{path}.tmp'
+        with open(temporary, 'w') as output:
+            json.dump(self.snapshot(), output)
+        os.replace(temporary, path)
+
+    def maybe_flush(self):
+        if METRICS_DIR and time.monotonic() - self.last_flush >= FLUSH_SECONDS:
+            self.flush()
+
+
+registry = Registry()
+
+request_duration = registry.register(Histogram(
+    'hospital_http_request_duration_seconds', 'Request latency by URL name.', ('view', 'method', 'status')))
+mongo_duration = registry.register(Histogram(
+    'hospital_mongo_command_duration_seconds', 'MongoDB command latency.', ('collection', 'operation'),
+    buckets=FAST_BUCKETS))
+mongo_failures = registry.register(Counter(
+    'hospital_mongo_command_failures_total', 'MongoDB commands that failed.', ('collection', 'operation')))
+template_duration = registry.register(Histogram(
+    'hospital_template_render_seconds', 'Top-level template render time.', ('template',), buckets=FAST_BUCKETS))
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _merge(into, family, alive):
+    merged = into.setdefault(family['name'], {key: family[key] for key in ('kind', 'help', 'labelnames', 'buckets')})
+    merged.setdefault('series', {})
+    if family['kind'] == 'gauge' and not alive:
+        return
+    for labels, value in family['series']:
+        labels = tuple(labels)
+        current = merged['series'].get(labels)
+        if current is None:
+            merged['series'][labels] = value
+        elif isinstance(value, list):
+            merged['series'][labels] = [a + b for a, b in zip(current, value)]
+        else:
+            merged['series'][labels] = current + value
+
+
+def collect(directory=None):
+    """Merge the series of every process (or just this one) into ``{name: family}``."""
+    directory = directory or METRICS_DIR
+    snapshots = []
+    if directory:
+        registry.flush(directory)
+        for filename in os.listdir(directory):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(directory, filename)) as source:
+                    snapshots.append(json.load(source))
+            except (OSError, ValueError):
+                continue  # a worker replacing its file right now
+    else:
+        snapshots.append(registry.snapshot())
+
+    families = {}
+    for snapshot in snapshots:
+        alive = _pid_alive(snapshot['pid'])
+        for name, family in snapshot['families'].items():
+            _merge(families, dict(family, name=name), alive)
+    _add_hit_ratios(families)
+    return families
+
+
+def _add_hit_ratios(families):
+    requests = families.get('hospital_cache_requests_total', {}).get('series', {})
+    totals = {}
+    for (cache, result), value in requests.items():
+        hits, total = totals.get(cache, (0, 0))
+        totals[cache] = (hits + (value if result == 'hit' else 0), total + value)
+    if totals:
+        families['hospital_cache_hit_ratio'] = {
+            'kind': 'gauge', 'help': 'Cache hits over lookups, across all processes.', 'labelnames': ['cache'],
+            'buckets': [], 'series': {(cache,): hits / total if total else 0.0 for cache, (hits, total) in totals.items()},
+        }
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(families):
+    """Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for name in sorted(families):
+        family = families[name]
+        lines.append(f'# HELP {name} {family["help"]}')
+        lines.append(f'# TYPE {name} {family["kind"]}')
+        names = family['labelnames']
+        for labels, value in sorted(family['series'].items()):
+            if family['kind'] != 'histogram':
+                lines.append(f'{name}{_labels(names, labels)} {_number(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip(list(family['buckets']) + ['+Inf'], value[:-1]):
+                cumulative += count
+                le = bound if bound == '+Inf' else _number(float(bound))
+                lines.append(f'{name}_bucket{_labels(names, labels, [("le", le)])} {cumulative}')
+            lines.append(f'{name}_sum{_labels(names, labels)} {_number(float(value[-1]))}')
+            lines.append(f'{name}_count{_labels(names, labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+# ===== COLLECTORS =====
+def pool_metrics():
+    snapshot = mongo.pool_stats.snapshot()
+    checkouts = snapshot['checkouts']
+    return [
+        ('hospital_mongo_pool_checkouts_total', 'counter', 'Connection checkouts.', {}, checkouts),
+        ('hospital_mongo_pool_checkout_failures_total', 'counter', 'Failed connection checkouts.', {},
+         snapshot['checkout_failures']),
+        ('hospital_mongo_pool_checkout_wait_seconds_total', 'counter', 'Time spent waiting for a connection.', {},
+         snapshot['checkout_wait_avg_ms'] * checkouts / 1000),
+        ('hospital_mongo_pool_connections_open', 'gauge', 'Open pool connections.', {}, snapshot['connections_open']),
+        ('hospital_mongo_pool_checked_out', 'gauge', 'Connections currently in use.', {}, snapshot['checked_out']),
+        ('hospital_mongo_pool_cleared_total', 'counter', 'Times the pool was cleared.', {}, snapshot['pools_cleared']),
+    ]
+
+
+def cache_metrics():
+    snapshot = doctor_cache.stats.snapshot()
+    documentation = 'Cache lookups by result.'
+    return [
+        ('hospital_cache_requests_total', 'counter', documentation, {'cache': 'doctors', 'result': 'hit'},
+         snapshot['hits']),
+        ('hospital_cache_requests_total', 'counter', documentation, {'cache': 'doctors', 'result': 'miss'},
+         snapshot['misses']),
+    ]
+
+
+registry.collectors.extend([pool_metrics, cache_metrics])
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Observes every command's latency by collection and operation."""
+
+    def __init__(self):
+        self._collections = {}
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        # Single dict assignment/pop are atomic under the GIL
+        self._collections[event.connection_id, event.request_id] = (
+            target if isinstance(target, str) else event.command.get('collection', ''))
+
+    def succeeded(self, event):
+        collection = self._collections.pop((event.connection_id, event.request_id), '')
+        mongo_duration.observe(event.duration_micros / 1e6, (collection, event.command_name))
+
+    def failed(self, event):
+        collection = self._collections.pop((event.connection_id, event.request_id), '')
+        mongo_failures.inc((collection, event.command_name))
+
+
+command_metrics = MongoCommandMetrics()
+_installed = False
+
+
+def install():
+    """Attach the Mongo listener (idempotent)."""
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    mongo.register_listener(command_metrics)
+
+
+class TimedTemplate(django_backend.Template):
+    def render(self, context=None, request=None):
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            template_duration.observe(time.perf_counter() - started, (self.origin.template_name or '',))
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """The Django template backend, timing each top-level render.
+
+    Configured as the ``BACKEND`` in ``settings.TEMPLATES`` rather than
+    patched into Django, so only this project's engine is measured.
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            django_backend.reraise(exc, self)
+
+
+class MetricsMiddleware:
+    """Observes request latency labelled with the resolved URL name."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        install()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self.observe(request, response, started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.observe(request, response, started)
+        return response
+
+    def observe(self, request, response, started):
+        match = request.resolver_match
+        view = (match.url_name or match.view_name) if match else 'unresolved'
+        request_duration.observe(time.perf_counter() - started, (view, request.method, str(response.status_code)))
+        registry.maybe_flush()
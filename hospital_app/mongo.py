@@ -0,0 +1,256 @@
+"""Shared MongoDB client for the whole project.
+
+The client is created lazily on first use rather than at import time, and
+recreated automatically in a child process after a fork (gunicorn/uWSGI
+pre-fork workers), since pymongo clients must not be shared across forks.
+Connection settings come from ``MONGODB_*`` entries in Django settings.
+
+Modules keep module-level collection handles through :func:`collection`,
+which returns a lightweight proxy that resolves the real collection on
+each attribute access. :func:`async_collection` does the same for the
+asyncio driver used by the async views; its client is bound to the event
+loop it was created on and is rebuilt when a new loop asks for it.
+"""
+import asyncio
+import os
+import threading
+import time
+
+import pymongo
+from django.conf import settings
+from pymongo import monitoring
+
+_lock = threading.Lock()
+_client = None
+_client_pid = None
+_async_client = None
+_async_client_owner = None
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Connection pool counters fed by pymongo's CMAP monitoring events."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checkout_started = {}
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.connections_created = 0
+            self.connections_closed = 0
+            self.checked_out = 0
+            self.checkouts = 0
+            self.checkout_failures = 0
+            self.checkout_wait_total = 0.0
+            self.checkout_wait_max = 0.0
+            self.pools_cleared = 0
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'connections_created': self.connections_created,
+                'connections_closed': self.connections_closed,
+                'connections_open': self.connections_created - self.connections_closed,
+                'checked_out': self.checked_out,
+                'checkouts': self.checkouts,
+                'checkout_failures': self.checkout_failures,
+                'checkout_wait_avg_ms': (self.checkout_wait_total / self.checkouts * 1000) if self.checkouts else 0.0,
+                'checkout_wait_max_ms': self.checkout_wait_max * 1000,
+                'pools_cleared': self.pools_cleared,
+            }
+
+    def _record_wait(self, failed):
+        started = self._checkout_started.pop(threading.get_ident(), None)
+        waited = time.perf_counter() - started if started is not None else 0.0
+        with self._lock:
+            if failed:
+                self.checkout_failures += 1
+            else:
+                self.checkouts += 1
+                self.checked_out += 1
+                self.checkout_wait_total += waited
+                self.checkout_wait_max = max(self.checkout_wait_max, waited)
+        return waited
+
+    def connection_check_out_started(self, event):
+        # Check-out happens on the requesting thread, so the thread id pairs
+        # the started/succeeded events.
+        self._checkout_started[threading.get_ident()] = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        self._record_wait(failed=False)
+
+    def connection_check_out_failed(self, event):
+        self._record_wait(failed=True)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self.connections_created += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.connections_closed += 1
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pools_cleared += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+
+pool_stats = PoolStats()
+
+# Extra pymongo event listeners registered on every client this module
+# creates (command profilers, metrics, ...).
+_listeners = [pool_stats]
+
+
+def register_listener(listener):
+    """Attach ``listener`` to the shared client, including future re-creations."""
+    global _client
+    with _lock:
+        if listener not in _listeners:
+            _listeners.append(listener)
+            # The listener list is fixed per client, so force a rebuild
+            if _client is not None:
+                _client.close()
+                _client = None
+
+
+def client_options():
+    """Build ``MongoClient`` keyword arguments from Django settings."""
+    options = {
+        'maxPoolSize': getattr(settings, 'MONGODB_MAX_POOL_SIZE', 100),
+        'minPoolSize': getattr(settings, 'MONGODB_MIN_POOL_SIZE', 0),
+        'serverSelectionTimeoutMS': getattr(settings, 'MONGODB_SERVER_SELECTION_TIMEOUT_MS', 5000),
+        'connectTimeoutMS': getattr(settings, 'MONGODB_CONNECT_TIMEOUT_MS', 5000),
+        'socketTimeoutMS': getattr(settings, 'MONGODB_SOCKET_TIMEOUT_MS', None),
+        'waitQueueTimeoutMS': getattr(settings, 'MONGODB_WAIT_QUEUE_TIMEOUT_MS', None),
+        'appname': getattr(settings, 'MONGODB_APP_NAME', 'hospital_management'),
+        'readPreference': getattr(settings, 'MONGODB_READ_PREFERENCE', None),
+        'event_listeners': list(_listeners),
+    }
+    # e.g. {'w': 'majority', 'wTimeoutMS': 2000, 'journal': True}
+    options.update(getattr(settings, 'MONGODB_WRITE_CONCERN', None) or {})
+    return {key: value for key, value in options.items() if value is not None}
+
+
+def get_client():
+    """Return the process-wide ``MongoClient``, creating it on first use."""
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+    with _lock:
+        if _client is None or _client_pid != pid:
+            # A client inherited from the parent process is unusable after a
+            # fork; drop the reference without closing the parent's sockets.
+            if _client is not None:
+                pool_stats.reset()
+            _client = pymongo.MongoClient(
+                getattr(settings, 'MONGODB_URI', 'mongodb://localhost:27017/'),
+                **client_options(),
+            )
+            _client_pid = pid
+        return _client
+
+
+def get_db():
+    """Return the application database."""
+    return get_client()[getattr(settings, 'MONGODB_NAME', 'hospital_management')]
+
+
+def get_async_client():
+    """Return the ``AsyncMongoClient`` for the running event loop."""
+    global _async_client, _async_client_owner
+    owner = (os.getpid(), id(asyncio.get_running_loop()))
+    if _async_client is None or _async_client_owner != owner:
+        # No lock needed: everything on one event loop runs on one thread.
+        _async_client = pymongo.AsyncMongoClient(
+            getattr(settings, 'MONGODB_URI', 'mongodb://localhost:27017/'),
+            **client_options(),
+        )
+        _async_client_owner = owner
+    return _async_client
+
+
+def get_async_db():
+    return get_async_client()[getattr(settings, 'MONGODB_NAME', 'hospital_management')]
+
+
+def close_client():
+    global _client, _client_pid
+    with _lock:
+        if _client is not None:
+            _client.close()
+        _client = None
+        _client_pid = None
+
+
+class LazyCollection:
+    """Stand-in for a collection that resolves it against the shared client on use."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def resolve(self):
+        return get_db()[self.name]
+
+    def __getattr__(self, attribute):
+        return getattr(self.resolve(), attribute)
+
+    def __getitem__(self, key):
+        return self.resolve()[key]
+
+    def __repr__(self):
+        return f"<LazyCollection {self.name}>"
+
+
+class LazyDatabase:
+    """Stand-in for the application database, resolved on use."""
+
+    def __getattr__(self, attribute):
+        return getattr(get_db(), attribute)
+
+    def __getitem__(self, name):
+        return get_db()[name]
+
+
+class LazyAsyncCollection(LazyCollection):
+    """Stand-in for an async collection, resolved against the running loop's client."""
+
+    def resolve(self):
+        return get_async_db()[self.name]
+
+    def __repr__(self):
+        return f"<LazyAsyncCollection {self.name}>"
+
+
+def collection(name):
+    return LazyCollection(name)
+
+
+def async_collection(name):
+    return LazyAsyncCollection(name)
+
+
+db = LazyDatabase()
+patients_collection = collection('patients')
+doctors_collection = collection('doctors')
+appointments_collection = collection('appointments')
+counters_collection = collection('counters')
@@ -0,0 +1,191 @@
+"""Keyset (cursor) pagination for MongoDB list and search views.
+
+Pages are addressed by an opaque token that encodes the sort value and
+``_id`` of the row at the page boundary, so fetching any page reads at most
+``page_size + 1`` documents through the sort index instead of skipping over
+everything before it. Orderings use Django's ``'-field'`` notation and are
+always tie-broken on ``_id`` (or are ``_id`` alone, which is unique and
+always indexed).
+"""
+import base64
+import hashlib
+
+from bson import json_util
+from django.conf import settings
+from django.core.cache import cache
+
+DEFAULT_PAGE_SIZE = getattr(settings, 'HOSPITAL_PAGE_SIZE', 25)
+MAX_PAGE_SIZE = getattr(settings, 'HOSPITAL_MAX_PAGE_SIZE', 200)
+COUNT_CACHE_SECONDS = getattr(settings, 'HOSPITAL_COUNT_CACHE_SECONDS', 30)
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+class Page:
+    """One page of results plus the tokens needed to move around it."""
+
+    def __init__(self, items, page_size, next_token=None, prev_token=None):
+        self.items = items
+        self.page_size = page_size
+        self.next_token = next_token
+        self.prev_token = prev_token
+
+    @property
+    def has_next(self):
+        return self.next_token is not None
+
+    @property
+    def has_previous(self):
+        return self.prev_token is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def parse_ordering(ordering):
+    """Split ``'-field'`` into ``('field', -1)`` and ``'field'`` into ``('field', 1)``."""
+    if ordering.startswith('-'):
+        return ordering[1:], -1
+    return ordering, 1
+
+
+def encode_token(direction, document, field):
+    payload = json_util.dumps({'d': direction, 'v': document.get(field), 'id': document['_id']})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_token(token):
+    """Decode a cursor token, returning ``None`` for anything malformed."""
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json_util.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(payload, dict) or payload.get('d') not in (NEXT, PREVIOUS) or 'id' not in payload:
+        return None
+    return payload
+
+
+def _seek(field, value, object_id, operator):
+    # Documents strictly past (value, object_id) in the direction of operator.
+    # Missing/null sort values order before everything else in MongoDB, but
+    # range operators never match them, so they are added back explicitly.
+    if value is None:
+        if operator == '$gt':
+            return {'$or': [{field: {'$ne': None}}, {field: None, '_id': {'$gt': object_id}}]}
+        return {field: None, '_id': {'$lt': object_id}}
+    clauses = [{field: {operator: value}}, {field: value, '_id': {operator: object_id}}]
+    if operator == '$lt':
+        clauses.append({field: None})
+    return {'$or': clauses}
+
+
+def page_query(criteria, ordering, cursor, page_size):
+    """Build the filter, sort spec and limit that fetch one page.
+
+    Returns ``(filter, sort, limit, backwards)``. When ``backwards`` is true
+    the documents come back in reverse order and must be flipped by
+    :func:`build_page`.
+    """
+    field, order = parse_ordering(ordering)
+    backwards = bool(cursor) and cursor['d'] == PREVIOUS
+    if backwards:
+        order = -order
+    operator = '$gt' if order > 0 else '$lt'
+    if field == '_id':
+        sort = [('_id', order)]
+    else:
+        sort = [(field, order), ('_id', order)]
+
+    query = dict(criteria or {})
+    if cursor:
+        if field == '_id':
+            seek = {'_id': {operator: cursor['id']}}
+        else:
+            seek = _seek(field, cursor.get('v'), cursor['id'], operator)
+        query = {'$and': [query, seek]} if query else seek
+    return query, sort, page_size + 1, backwards
+
+
+def build_page(documents, ordering, cursor, page_size, backwards):
+    """Trim the look-ahead row and work out which neighbouring pages exist."""
+    field, _ = parse_ordering(ordering)
+    documents = list(documents)
+    has_more = len(documents) > page_size
+    documents = documents[:page_size]
+    if backwards:
+        documents.reverse()
+
+    has_next = (not backwards and has_more) or (backwards and bool(documents))
+    has_previous = (backwards and has_more) or (not backwards and cursor is not None)
+
+    next_token = encode_token(NEXT, documents[-1], field) if has_next and documents else None
+    prev_token = encode_token(PREVIOUS, documents[0], field) if has_previous and documents else None
+    return Page(documents, page_size, next_token=next_token, prev_token=prev_token)
+
+
+def page_params(request, default_size=DEFAULT_PAGE_SIZE, max_size=MAX_PAGE_SIZE):
+    """Read ``cursor`` and ``page_size`` from the query string."""
+    cursor = decode_token(request.GET.get('cursor'))
+    try:
+        page_size = int(request.GET.get('page_size', default_size))
+    except ValueError:
+        page_size = default_size
+    return cursor, max(1, min(page_size, max_size))
+
+
+def paginate(collection, criteria, ordering, request, projection=None,
+             default_size=DEFAULT_PAGE_SIZE, max_size=MAX_PAGE_SIZE):
+    """Fetch the page of ``collection`` selected by the request's cursor."""
+    cursor, page_size = page_params(request, default_size, max_size)
+    query, sort, limit, backwards = page_query(criteria, ordering, cursor, page_size)
+    documents = collection.find(query, projection).sort(sort).limit(limit)
+    return build_page(documents, ordering, cursor, page_size, backwards)
+
+
+def count_key(collection_name, criteria):
+    digest = hashlib.md5(json_util.dumps(criteria, sort_keys=True).encode()).hexdigest()
+    return f'count:{collection_name}:{digest}'
+
+
+def count_results(collection, criteria):
+    """Cheap total for a result set.
+
+    Unfiltered totals come from collection metadata via
+    ``estimated_document_count``; filtered totals are counted once and kept
+    in the cache for a short while.
+    """
+    if not criteria:
+        return collection.estimated_document_count()
+    key = count_key(collection.name, criteria)
+    total = cache.get(key)
+    if total is None:
+        total = collection.count_documents(criteria)
+        cache.set(key, total, COUNT_CACHE_SECONDS)
+    return total
+
+
+async def apaginate(collection, criteria, ordering, request, projection=None):
+    """Async counterpart of :func:`paginate` for the asyncio driver."""
+    cursor, page_size = page_params(request)
+    query, sort, limit, backwards = page_query(criteria, ordering, cursor, page_size)
+    documents = await collection.find(query, projection).sort(sort).limit(limit).to_list()
+    return build_page(documents, ordering, cursor, page_size, backwards)
+
+
+async def acount_results(collection, criteria):
+    """Async counterpart of :func:`count_results`."""
+    if not criteria:
+        return await collection.estimated_document_count()
+    key = count_key(collection.name, criteria)
+    total = await cache.aget(key)
+    if total is None:
+        total = await collection.count_documents(criteria)
+        await cache.aset(key, total, COUNT_CACHE_SECONDS)
+    return total
@@ -0,0 +1,280 @@
+"""Per-request MongoDB command profiling.
+
+:class:`CommandProfiler` is a pymongo ``CommandListener`` registered on the
+shared clients. While a :class:`Profile` is active (see :func:`profiled`)
+every command the request issues is recorded with its collection,
+operation, duration and number of documents returned. The active profile
+lives in a context variable, so it follows a request across
+``sync_to_async``/``async_to_sync`` hops and the async driver's tasks.
+
+:class:`MongoProfilerMiddleware` wraps each request in a profile and
+
+* sets ``X-Mongo-Queries`` and ``X-Mongo-Time`` (milliseconds) headers;
+* logs requests slower than ``HOSPITAL_SLOW_REQUEST_MS`` together with
+  their most expensive commands;
+* with ``DEBUG`` and ``HOSPITAL_MONGO_PANEL`` on, explains the request's
+  reads (to show whether each one used an index) and appends a panel
+  listing them to HTML pages.
+
+:class:`MongoQueryAssertions` adds ``assertMaxMongoQueries(n)`` to test
+cases so a page that starts issuing more commands fails the build.
+"""
+import contextlib
+import contextvars
+import logging
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.template.loader import render_to_string
+from pymongo import monitoring
+
+from . import mongo
+from .indexes import classify_plan
+
+logger = logging.getLogger(__name__)
+
+SLOW_REQUEST_MS = getattr(settings, 'HOSPITAL_SLOW_REQUEST_MS', 500)
+# Handshake, auth and session housekeeping, not application queries
+IGNORED_COMMANDS = {'hello', 'ismaster', 'isMaster', 'ping', 'endSessions', 'saslStart', 'saslContinue',
+                    'buildInfo', 'getnonce', 'authenticate', 'explain'}
+EXPLAINABLE = {'find', 'aggregate', 'count', 'distinct'}
+# Driver-added fields that can't be sent back in an explain
+DRIVER_FIELDS = {'$db', 'lsid', '$clusterTime', '$readPreference', 'txnNumber', 'cursor'}
+
+_current = contextvars.ContextVar('mongo_profile', default=None)
+
+
+class QueryRecord:
+    __slots__ = ('collection', 'operation', 'duration_ms', 'documents', 'failed', 'command', 'plan')
+
+    def __init__(self, collection, operation, duration_ms, documents=None, failed=False, command=None):
+        self.collection = collection
+        self.operation = operation
+        self.duration_ms = duration_ms
+        self.documents = documents
+        self.failed = failed
+        self.command = command
+        self.plan = None
+
+
+class Profile:
+    """Commands recorded while this profile (or a nested one) was active.
+
+    Only a profile with ``explain`` set (or nested in one) keeps the
+    commands of explainable reads, for :func:`explain_records`; otherwise
+    just the collection, operation and timings are recorded.
+    """
+
+    def __init__(self, parent=None, explain=False):
+        self.parent = parent
+        self.explain = explain or (parent is not None and parent.explain)
+        self.records = []
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        profile = self
+        while profile is not None:
+            with profile._lock:
+                profile.records.append(record)
+            profile = profile.parent
+
+    @property
+    def count(self):
+        return len(self.records)
+
+    @property
+    def total_ms(self):
+        return sum(record.duration_ms for record in self.records)
+
+    def slowest(self, limit=5):
+        return sorted(self.records, key=lambda record: -record.duration_ms)[:limit]
+
+
+def current_profile():
+    return _current.get()
+
+
+@contextlib.contextmanager
+def profiled(explain=False):
+    """Record the commands issued inside the block into a new :class:`Profile`."""
+    profile = Profile(parent=_current.get(), explain=explain)
+    token = _current.set(profile)
+    try:
+        yield profile
+    finally:
+        _current.reset(token)
+
+
+def record(collection, operation, duration_ms, documents=None, failed=False, command=None):
+    """Add a command to the active profile, if any."""
+    profile = _current.get()
+    if profile is not None:
+        profile.add(QueryRecord(collection, operation, duration_ms, documents, failed, command))
+
+
+def _documents(reply):
+    cursor = reply.get('cursor')
+    if isinstance(cursor, dict):
+        return len(cursor.get('firstBatch', cursor.get('nextBatch', [])))
+    if 'values' in reply:
+        return len(reply['values'])
+    return reply.get('n')
+
+
+class CommandProfiler(monitoring.CommandListener):
+    """Feeds pymongo command events into the active :class:`Profile`."""
+
+    def __init__(self):
+        self._started = {}
+        self._lock = threading.Lock()
+
+    def _key(self, event):
+        return event.connection_id, event.request_id
+
+    def started(self, event):
+        profile = _current.get()
+        if event.command_name in IGNORED_COMMANDS or profile is None:
+            return
+        command = event.command
+        target = command.get(event.command_name)
+        collection = target if isinstance(target, str) else command.get('collection', '')
+        # Copying every command is only worth it when it's going to be explained
+        kept = dict(command) if profile.explain and event.command_name in EXPLAINABLE else None
+        with self._lock:
+            self._started[self._key(event)] = (collection, kept)
+
+    def _finish(self, event, reply=None, failed=False):
+        with self._lock:
+            started = self._started.pop(self._key(event), None)
+        if started is None:
+            return
+        collection, command = started
+        record(collection, event.command_name, event.duration_micros / 1000,
+               _documents(reply or {}), failed, command)
+
+    def succeeded(self, event):
+        self._finish(event, event.reply)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+
+profiler = CommandProfiler()
+
+
+def install():
+    """Register the profiler on the shared clients (idempotent)."""
+    mongo.register_listener(profiler)
+
+
+def _winning_plan(explain):
+    # aggregate explains nest the query planner under the first $cursor stage
+    if 'queryPlanner' not in explain:
+        for stage in explain.get('stages', []):
+            if '$cursor' in stage:
+                return stage['$cursor']
+    return explain
+
+
+def explain_records(profile, db=None):
+    """Explain each recorded read and store ``COVERED``/``INDEXED``/``COLLSCAN`` on it."""
+    db = db if db is not None else mongo.get_db()
+    for query in profile.records:
+        if query.operation not in EXPLAINABLE or query.failed or not query.command:
+            continue
+        command = {key: value for key, value in query.command.items() if key not in DRIVER_FIELDS}
+        if query.operation == 'aggregate':
+            command['cursor'] = {}
+        try:
+            explain = db.command('explain', command, verbosity='queryPlanner')
+        except Exception as error:  # explain is best-effort diagnostics
+            query.plan = f'explain failed: {error}'
+            continue
+        query.plan = classify_plan(_winning_plan(explain))[0]
+
+
+class MongoProfilerMiddleware:
+    """Profiles the Mongo commands of every request; see the module docstring."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        install()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        with profiled(explain=self.explain_enabled()) as profile:
+            response = self.get_response(request)
+        self.summarize(request, response, profile, started)
+        if self.panel_enabled(response):
+            self.add_panel(request, response, profile)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        with profiled(explain=self.explain_enabled()) as profile:
+            response = await self.get_response(request)
+        self.summarize(request, response, profile, started)
+        if self.panel_enabled(response):
+            # Explaining uses the blocking client
+            await sync_to_async(self.add_panel, thread_sensitive=False)(request, response, profile)
+        return response
+
+    def summarize(self, request, response, profile, started):
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        response['X-Mongo-Queries'] = str(profile.count)
+        response['X-Mongo-Time'] = f'{profile.total_ms:.1f}'
+        if elapsed_ms > SLOW_REQUEST_MS:
+            log_slow_request(request, profile, elapsed_ms)
+
+    def panel_on(self):
+        return settings.DEBUG and getattr(settings, 'HOSPITAL_MONGO_PANEL', False)
+
+    def explain_enabled(self):
+        return self.panel_on() and getattr(settings, 'HOSPITAL_MONGO_PANEL_EXPLAIN', True)
+
+    def panel_enabled(self, response):
+        return (
+            self.panel_on()
+            and not response.streaming
+            and response.get('Content-Type', '').startswith('text/html')
+        )
+
+    def add_panel(self, request, response, profile):
+        if profile.explain:
+            explain_records(profile)
+        panel = render_to_string('hospital_app/mongo_panel.html', {'profile': profile}, request=request)
+        content = response.content.decode(response.charset)
+        if '</body>' in content:
+            content = content.replace('</body>', panel + '</body>', 1)
+            response.content = content.encode(response.charset)
+            if response.has_header('Content-Length'):
+                response['Content-Length'] = str(len(response.content))
+
+
+def log_slow_request(request, profile, elapsed_ms):
+    slowest = ', '.join(f'{q.operation} {q.collection} {q.duration_ms:.1f}ms' for q in profile.slowest(3))
+    logger.warning(
+        'Slow request %s %s: %.0fms, %d Mongo commands in %.1fms (slowest: %s)',
+        request.method, request.get_full_path(), elapsed_ms, profile.count, profile.total_ms, slowest or 'none',
+    )
+
+
+class MongoQueryAssertions:
+    """Test case mixin with Mongo command-count assertions."""
+
+    @contextlib.contextmanager
+    def assertMaxMongoQueries(self, limit):
+        with profiled() as profile:
+            yield profile
+        if profile.count > limit:
+            issued = '\n'.join(f'  {q.operation} {q.collection}' for q in profile.records)
+            self.fail(f'{profile.count} Mongo commands issued, expected at most {limit}:\n{issued}')
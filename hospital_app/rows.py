@@ -0,0 +1,120 @@
+"""Compact row objects for list and search pages.
+
+List pages used to fetch whole documents (addresses, notes, search keys)
+and then add an ``id`` key to every dict. The row classes here declare the
+handful of fields a page shows; :func:`rows` returns the collection set up
+so that
+
+* the query is projected down to those fields, which cuts wire bytes, and
+* pymongo's C decoder builds each result straight into a ``__slots__``
+  row instead of a dict, roughly halving what a page of results keeps in
+  memory.
+
+Rows are read-only mappings as far as templates and helpers are concerned
+(``row['status']``, ``row.get('status')`` and ``{{ row.status }}`` all
+work) and expose ``id``, the string form of ``_id``, as a property. Keys
+outside the declared fields are rejected, so a projection that drifts from
+its row class fails loudly instead of losing data.
+"""
+from collections.abc import MutableMapping
+
+from bson.codec_options import CodecOptions
+
+
+class Row(MutableMapping):
+    """Base class; subclasses list the stored ``fields`` and any computed ``extra`` ones."""
+
+    __slots__ = ('_id',)
+    fields = ()
+    extra = ()
+    projection = {}
+    _names = ('_id',)
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.projection = {field: 1 for field in cls.fields}
+        cls._names = ('_id',) + tuple(cls.fields) + tuple(cls.extra)
+
+    def __init__(self, document=()):
+        # pymongo calls the document class without arguments and then sets keys
+        for key, value in dict(document).items():
+            self[key] = value
+
+    def __getitem__(self, key):
+        if key in self._names:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                pass
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        # Only the slots are writable (there is no __dict__); this runs once
+        # per field while decoding, so it skips the _names check
+        try:
+            setattr(self, key, value)
+        except AttributeError:
+            raise KeyError(f"{type(self).__name__} has no field {key!r}") from None
+
+    def __delitem__(self, key):
+        if key not in self._names:
+            raise KeyError(key)
+        try:
+            delattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __iter__(self):
+        return (key for key in self._names if hasattr(self, key))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __dir__(self):
+        # Fields are keys, not attributes: Django templates re-raise an
+        # AttributeError for names listed here, whereas a missing field should
+        # render like a missing dict key
+        return [name for name in super().__dir__() if name not in self._names]
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self)!r})"
+
+    def __getstate__(self):
+        return dict(self)
+
+    def __setstate__(self, state):
+        for key, value in state.items():
+            self[key] = value
+
+    @property
+    def id(self):
+        return str(self._id)
+
+
+class PatientRow(Row):
+    fields = ('patient_id', 'first_name', 'last_name', 'email', 'phone', 'gender', 'blood_group',
+              'emergency_contact', 'registration_date')
+    __slots__ = fields
+
+
+class DoctorRow(Row):
+    fields = ('doctor_id', 'first_name', 'last_name', 'email', 'phone', 'specialization', 'department',
+              'qualification', 'experience', 'consultation_fee', 'availability')
+    __slots__ = fields
+
+
+class AppointmentRow(Row):
+    fields = ('appointment_id', 'patient_id', 'doctor_id', 'appointment_date', 'time_slot', 'purpose',
+              'status')
+    # Filled in by lookups.attach_names
+    extra = ('patient_name', 'doctor_name')
+    __slots__ = fields + extra
+
+
+def rows(collection, row_class):
+    """``collection`` decoding its results into ``row_class`` instances.
+
+    Pass ``row_class.projection`` with the query; ``_id`` always comes back.
+    """
+    codec_options = getattr(collection, 'codec_options', None) or CodecOptions()
+    return collection.with_options(codec_options=codec_options.with_options(document_class=row_class))
@@ -0,0 +1,141 @@
+"""Doctor slot availability and conflict-free booking.
+
+Each doctor's day is one small document in ``doctor_schedules``::
+
+    {'doctor_id': ObjectId, 'date': '2025-01-31', 'booked': ['09:00 AM - 10:00 AM', ...]}
+
+with a unique index on ``(doctor_id, date)``. Free slots for a doctor on a
+day are the doctor's working slots minus ``booked`` - one indexed
+``find_one`` instead of a scan over appointments. A day without a document
+is entirely free.
+
+Reserving a slot is a single conditional upsert::
+
+    update_one({'doctor_id': d, 'date': day, 'booked': {'$ne': slot}},
+               {'$addToSet': {'booked': slot}}, upsert=True)
+
+If the slot is free the day document is updated (or created). If it is
+already taken the filter matches nothing, the upsert tries to insert a
+second document for the same doctor and day, and the unique index rejects
+it, so two concurrent requests can never both get the same slot. The
+unique index also rejects the first two reservations of different slots
+on a day nobody has booked yet when they race; the loser then retries as
+a plain conditional update, which only fails if its slot is taken.
+Cancelling, deleting or moving an appointment releases its slot with
+``$pull``.
+"""
+from datetime import date, timedelta
+
+from django.conf import settings
+from pymongo.errors import DuplicateKeyError
+
+from .mongo import collection
+
+SLOTS = [
+    '09:00 AM - 10:00 AM',
+    '10:00 AM - 11:00 AM',
+    '11:00 AM - 12:00 PM',
+    '02:00 PM - 03:00 PM',
+    '03:00 PM - 04:00 PM',
+    '04:00 PM - 05:00 PM',
+]
+STATUSES = ('Scheduled', 'Confirmed', 'Completed', 'Cancelled')
+# Appointments in these statuses don't hold their slot
+INACTIVE_STATUSES = {'Cancelled'}
+SEARCH_DAYS = getattr(settings, 'HOSPITAL_SLOT_SEARCH_DAYS', 30)
+
+schedules_collection = collection('doctor_schedules')
+
+
+class SlotUnavailable(Exception):
+    pass
+
+
+def working_slots(doctor):
+    """The doctor's bookable slots in day order (``working_slots`` or the clinic default)."""
+    slots = (doctor or {}).get('working_slots')
+    return [slot for slot in SLOTS if slot in slots] if slots else list(SLOTS)
+
+
+def holds_slot(appointment):
+    return bool(appointment) and appointment.get('status') not in INACTIVE_STATUSES
+
+
+def day_key(value):
+    """Normalize an appointment date (``date``/``datetime`` or ISO string) to ``YYYY-MM-DD``."""
+    if isinstance(value, date):
+        return value.strftime('%Y-%m-%d')
+    return date.fromisoformat(str(value)[:10]).isoformat()
+
+
+def free_slots(doctor, day, schedules=None):
+    """Working slots of ``doctor`` still free on ``day``."""
+    schedules = schedules_collection if schedules is None else schedules
+    schedule = schedules.find_one({'doctor_id': doctor['_id'], 'date': day_key(day)}, {'booked': 1})
+    booked = set(schedule['booked']) if schedule else set()
+    return [slot for slot in working_slots(doctor) if slot not in booked]
+
+
+def earliest_free_slot(doctors, start, days=SEARCH_DAYS, schedules=None):
+    """Earliest ``(day, slot, doctor)`` free among ``doctors`` from ``start`` on, or ``None``.
+
+    Loads the booked slots of every doctor over the whole window with one
+    range query; ties on the same slot go to the first doctor in ``doctors``.
+    """
+    schedules = schedules_collection if schedules is None else schedules
+    if not doctors:
+        return None
+    first, last = day_key(start), day_key(date.fromisoformat(day_key(start)) + timedelta(days=days - 1))
+    booked = {}
+    for schedule in schedules.find({'doctor_id': {'$in': [d['_id'] for d in doctors]},
+                                    'date': {'$gte': first, '$lte': last}},
+                                   {'doctor_id': 1, 'date': 1, 'booked': 1}):
+        booked[schedule['doctor_id'], schedule['date']] = set(schedule['booked'])
+
+    day = date.fromisoformat(first)
+    for _ in range(days):
+        key = day.isoformat()
+        for slot in SLOTS:
+            for doctor in doctors:
+                if slot in working_slots(doctor) and slot not in booked.get((doctor['_id'], key), ()):
+                    return key, slot, doctor
+        day += timedelta(days=1)
+    return None
+
+
+def reserve(doctor_id, day, slot, schedules=None):
+    """Atomically claim ``slot``; raise :class:`SlotUnavailable` if it's taken."""
+    schedules = schedules_collection if schedules is None else schedules
+    criteria = {'doctor_id': doctor_id, 'date': day_key(day), 'booked': {'$ne': slot}}
+    try:
+        schedules.update_one(criteria, {'$addToSet': {'booked': slot}}, upsert=True)
+    except DuplicateKeyError:
+        # Also raised when another slot's reservation created the day's
+        # document first; that document exists now, so try it once more
+        if not schedules.update_one(criteria, {'$addToSet': {'booked': slot}}).matched_count:
+            raise SlotUnavailable(f"{slot} on {day_key(day)} is already booked.")
+
+
+def release(doctor_id, day, slot, schedules=None):
+    schedules = schedules_collection if schedules is None else schedules
+    schedules.update_one({'doctor_id': doctor_id, 'date': day_key(day)}, {'$pull': {'booked': slot}})
+
+
+def slot_of(appointment):
+    return appointment['doctor_id'], day_key(appointment['appointment_date']), appointment['time_slot']
+
+
+def move(old, new, schedules=None):
+    """Update reservations when an appointment changes from ``old`` to ``new``.
+
+    The new slot is claimed before the old one is released, so a failed
+    move leaves the original booking intact.
+    """
+    before = slot_of(old) if holds_slot(old) else None
+    after = slot_of(new) if holds_slot(new) else None
+    if before == after:
+        return
+    if after:
+        reserve(*after, schedules=schedules)
+    if before:
+        release(*before, schedules=schedules)
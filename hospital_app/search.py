@@ -0,0 +1,194 @@
+"""Indexed patient search.
+
+Every patient document carries a small ``search`` subdocument derived from
+its name and contact fields:
+
+* ``search.prefixes`` - lowercase edge n-grams of each name token, so a
+  query token is an exact multikey index match instead of an unanchored
+  regex ("jo" -> "john", "jones").
+* ``search.names`` - the normalized name tokens, covered by a text index
+  that ranks whole-word matches when prefixes alone don't fill a page.
+* ``search.email`` / ``search.phone`` - lowercase email and digits-only
+  phone, for exact or anchored-prefix lookups.
+
+Queries that look like a patient ID, an email or a phone number take a
+direct indexed path; everything else goes through the name prefixes.
+Archived patients are never returned; the search indexes are partial on
+:data:`.archive.ACTIVE`.
+"""
+import re
+import unicodedata
+
+from django.conf import settings
+
+from .archive import active
+
+SEARCH_LIMIT = getattr(settings, 'HOSPITAL_SEARCH_LIMIT', 50)
+MAX_PREFIX_LENGTH = 20
+# How many prefix matches to pull before ranking and cutting to the limit
+CANDIDATE_FACTOR = 4
+
+PATIENT_ID_RE = re.compile(r'^pat\d+$', re.IGNORECASE)
+PHONE_RE = re.compile(r'^\+?[\d\s().-]{4,}$')
+TOKEN_RE = re.compile(r'[^\W_]+')
+
+
+def normalize(text):
+    """Lowercase ``text`` and strip accents so "José" matches "jose"."""
+    decomposed = unicodedata.normalize('NFKD', str(text or ''))
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).lower().strip()
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(normalize(text))
+
+
+def digits(text):
+    return re.sub(r'\D', '', str(text or ''))
+
+
+def edge_ngrams(token):
+    return [token[:length] for length in range(1, min(len(token), MAX_PREFIX_LENGTH) + 1)]
+
+
+def search_fields(patient):
+    """Return the ``search`` subdocument for a patient's current field values."""
+    tokens = tokenize(patient.get('first_name')) + tokenize(patient.get('last_name'))
+    prefixes = []
+    for token in tokens:
+        prefixes.extend(edge_ngrams(token))
+    return {
+        'prefixes': sorted(set(prefixes)),
+        'names': ' '.join(tokens),
+        'email': normalize(patient.get('email')),
+        'phone': digits(patient.get('phone')),
+    }
+
+
+def _rank(patient, tokens):
+    names = (patient.get('search') or {}).get('names', '').split()
+    score = 0
+    for token in tokens:
+        if token in names:
+            score += 2
+        elif any(name.startswith(token) for name in names):
+            score += 1
+    # Prefer the query's token order matching the name order ("john smith")
+    if names[:len(tokens)] == tokens:
+        score += 1
+    return score
+
+
+def _anchored(value):
+    return {'$regex': '^' + re.escape(value)}
+
+
+def _direct_lookups(query):
+    """Filters to try in order for queries that look like an ID, email or phone.
+
+    Returns ``None`` for anything that should go through name search.
+    """
+    if PATIENT_ID_RE.match(query):
+        # Business IDs are stored upper case; an anchored, case-sensitive
+        # regex is a bounded range scan on the patient_id index.
+        return [{'patient_id': _anchored(query.upper())}]
+    if '@' in query:
+        email = normalize(query)
+        return [{'search.email': email}, {'search.email': _anchored(email)}]
+    if PHONE_RE.match(query) and len(digits(query)) >= 4:
+        return [{'search.phone': _anchored(digits(query))}]
+    return None
+
+
+def _name_tokens(query):
+    return [token[:MAX_PREFIX_LENGTH] for token in tokenize(query)]
+
+
+def _best(candidates, tokens, limit):
+    return sorted(candidates, key=lambda patient: -_rank(patient, tokens))[:limit]
+
+
+def _text_query(tokens, results, limit, projection=None):
+    """Whole-word fallback for the rest of the page, or ``None`` if not needed.
+
+    Fills the remainder with matches on any token ranked by text score,
+    e.g. "john smyth" still finds "John Smith".
+    """
+    if len(results) >= limit or not all(len(token) >= 3 for token in tokens):
+        return None
+    criteria = active({'$text': {'$search': ' '.join(tokens)}, '_id': {'$nin': [p['_id'] for p in results]}})
+    return criteria, dict(projection or {}, score={'$meta': 'textScore'})
+
+
+def _ranked(projection):
+    # Ranking reads the normalized names
+    return dict(projection, **{'search.names': 1}) if projection else None
+
+
+TEXT_SORT = [('score', {'$meta': 'textScore'})]
+
+
+def search_patients(collection, query, limit=SEARCH_LIMIT, projection=None):
+    """Return up to ``limit`` patients matching ``query``, best matches first.
+
+    ``projection`` limits the fields returned (whole documents by default).
+    """
+    query = (query or '').strip()
+    lookups = _direct_lookups(query) if query else []
+    if lookups is not None:
+        for criteria in lookups:
+            results = list(collection.find(active(criteria), projection).sort('patient_id', 1).limit(limit))
+            if results:
+                return results
+        return []
+
+    tokens = _name_tokens(query)
+    if not tokens:
+        return []
+    candidates = collection.find(active({'search.prefixes': {'$all': tokens}}), _ranked(projection))
+    results = _best(candidates.limit(limit * CANDIDATE_FACTOR), tokens, limit)
+
+    text_query = _text_query(tokens, results, limit, projection)
+    if text_query:
+        results.extend(collection.find(*text_query).sort(TEXT_SORT).limit(limit - len(results)))
+    return results
+
+
+async def asearch_patients(collection, query, limit=SEARCH_LIMIT, projection=None):
+    """Async counterpart of :func:`search_patients`."""
+    query = (query or '').strip()
+    lookups = _direct_lookups(query) if query else []
+    if lookups is not None:
+        for criteria in lookups:
+            results = await collection.find(active(criteria), projection).sort('patient_id', 1).limit(limit).to_list()
+            if results:
+                return results
+        return []
+
+    tokens = _name_tokens(query)
+    if not tokens:
+        return []
+    candidates = collection.find(active({'search.prefixes': {'$all': tokens}}), _ranked(projection))
+    results = _best(await candidates.limit(limit * CANDIDATE_FACTOR).to_list(), tokens, limit)
+
+    text_query = _text_query(tokens, results, limit, projection)
+    if text_query:
+        results.extend(await collection.find(*text_query).sort(TEXT_SORT).limit(limit - len(results)).to_list())
+    return results
+
+
+def match_doctors(doctors, query, limit=SEARCH_LIMIT):
+    """The first ``limit`` of ``doctors`` whose name, specialization, department or
+    doctor ID has a word starting with every token of ``query``."""
+    tokens = _name_tokens(query)
+    if not tokens:
+        return []
+    matches = []
+    for doctor in doctors:
+        words = tokenize(' '.join(str(doctor.get(field) or '') for field in
+                                  ('first_name', 'last_name', 'specialization', 'department', 'doctor_id')))
+        if all(any(word.startswith(token) for word in words) for token in tokens):
+            matches.append(doctor)
+            if len(matches) >= limit:
+                break
+    return matches
@@ -0,0 +1,162 @@
+"""Dashboard statistics computed in one aggregation and served from a snapshot.
+
+:func:`compute_stats` gathers every counter and breakdown the staff and
+admin dashboards show with a single pipeline: a ``$facet`` over patients,
+chained with ``$unionWith`` into a ``$facet`` over doctors and one over
+appointments, so a refresh is one round trip.
+
+:func:`dashboard_stats` serves the result from the Django cache. A
+snapshot younger than ``HOSPITAL_STATS_TTL`` seconds is returned as is.
+An older one, still within ``HOSPITAL_STATS_STALE_SECONDS``, is also
+returned immediately while a background thread recomputes it
+(stale-while-revalidate), so only a cold cache makes a request wait for
+the aggregation.
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from .archive import ACTIVE
+from .dates import day_range
+from .mongo import patients_collection
+
+STATS_TTL = getattr(settings, 'HOSPITAL_STATS_TTL', 60)
+STALE_SECONDS = getattr(settings, 'HOSPITAL_STATS_STALE_SECONDS', 300)
+SNAPSHOT_KEY = 'dashboard:stats'
+REFRESH_LOCK_KEY = 'dashboard:stats:refreshing'
+
+STATUSES = ['Scheduled', 'Confirmed', 'Completed', 'Cancelled']
+
+
+def _count_by(field):
+    return [{'$group': {'_id': f'${field}', 'count': {'$sum': 1}}}, {'$sort': {'count': -1}}]
+
+
+def week_bounds(today):
+    """Monday of ``today``'s week and the Sunday that ends it."""
+    start = today - timedelta(days=today.weekday())
+    return start, start + timedelta(days=6)
+
+
+def stats_pipeline(today):
+    this_week = {'appointment_date': day_range(*week_bounds(today))}
+    return [
+        # Archived patients and doctors aren't counted
+        {'$match': ACTIVE},
+        {'$facet': {
+            'total': [{'$count': 'n'}],
+            'by_gender': _count_by('gender'),
+        }},
+        {'$set': {'source': 'patients'}},
+        {'$unionWith': {'coll': 'doctors', 'pipeline': [
+            {'$match': ACTIVE},
+            {'$facet': {
+                'total': [{'$count': 'n'}],
+                'by_specialization': _count_by('specialization'),
+            }},
+            {'$set': {'source': 'doctors'}},
+        ]}},
+        {'$unionWith': {'coll': 'appointments', 'pipeline': [
+            {'$facet': {
+                'total': [{'$count': 'n'}],
+                'today_by_status': [{'$match': {'appointment_date': day_range(today, today)}}] + _count_by('status'),
+                'week_by_status': [{'$match': this_week}] + _count_by('status'),
+                'week_by_day': [{'$match': this_week},
+                                {'$group': {'_id': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$appointment_date'}},
+                                            'count': {'$sum': 1}}},
+                                {'$sort': {'_id': 1}}],
+            }},
+            {'$set': {'source': 'appointments'}},
+        ]}},
+    ]
+
+
+def _total(facet):
+    return facet['total'][0]['n'] if facet.get('total') else 0
+
+
+def _as_dict(buckets):
+    return {bucket['_id']: bucket['count'] for bucket in buckets}
+
+
+def _by_status(buckets):
+    # Every known status in a fixed order, zero-filled, then anything unexpected
+    counts = _as_dict(buckets)
+    ordered = {status: counts.pop(status, 0) for status in STATUSES}
+    ordered.update(counts)
+    return ordered
+
+
+def build_stats(results, today):
+    """Shape the three facet documents into the dashboard context."""
+    by_source = {result['source']: result for result in results}
+    patients = by_source.get('patients', {})
+    doctors = by_source.get('doctors', {})
+    appointments = by_source.get('appointments', {})
+
+    today_by_status = _by_status(appointments.get('today_by_status', []))
+    return {
+        'total_patients': _total(patients),
+        'total_doctors': _total(doctors),
+        'total_appointments': _total(appointments),
+        'today_appointments': sum(today_by_status.values()),
+        'today_by_status': today_by_status,
+        'week_by_status': _by_status(appointments.get('week_by_status', [])),
+        'week_by_day': _as_dict(appointments.get('week_by_day', [])),
+        'patients_by_gender': patients.get('by_gender', []),
+        'doctors_by_specialization': doctors.get('by_specialization', []),
+        'date': today,
+        'computed_at': datetime.now(),
+    }
+
+
+def compute_stats(collection=None):
+    if collection is None:
+        collection = patients_collection
+    today = datetime.now().date()
+    return build_stats(list(collection.aggregate(stats_pipeline(today))), today)
+
+
+def refresh_stats():
+    stats = compute_stats()
+    cache.set(SNAPSHOT_KEY, (time.time(), stats), STATS_TTL + STALE_SECONDS)
+    return stats
+
+
+def _refresh_in_background():
+    # cache.add is atomic, so only one worker per cache refreshes at a time
+    if not cache.add(REFRESH_LOCK_KEY, True, 30):
+        return
+
+    def run():
+        try:
+            refresh_stats()
+        finally:
+            cache.delete(REFRESH_LOCK_KEY)
+    threading.Thread(target=run, name='dashboard-stats-refresh', daemon=True).start()
+
+
+def dashboard_stats():
+    """Return the dashboard statistics snapshot, refreshing it as needed."""
+    snapshot = cache.get(SNAPSHOT_KEY)
+    if snapshot is None:
+        return refresh_stats()
+    computed, stats = snapshot
+    if time.time() - computed > STATS_TTL:
+        _refresh_in_background()
+    return stats
+
+
+async def adashboard_stats():
+    """Async counterpart of :func:`dashboard_stats`."""
+    snapshot = await cache.aget(SNAPSHOT_KEY)
+    if snapshot is None:
+        return await sync_to_async(refresh_stats, thread_sensitive=False)()
+    computed, stats = snapshot
+    if time.time() - computed > STATS_TTL:
+        _refresh_in_background()
+    return stats
@@ -0,0 +1,239 @@
+"""Reproducible synthetic hospital data for load tests and benchmarks.
+
+:class:`HospitalData` describes a data set (how many patients, doctors and
+appointments, a seed and a date window) and generates it in batches, so
+10 million appointments never have to be in memory at once. The same
+seed always produces the same documents, ``_id`` values included:
+
+* ``_id`` values are derived from the document's kind and number
+  (:func:`object_id`), so an appointment can reference patient ``n``
+  without the generator keeping a list of patient ids.
+* Appointments are generated doctor by doctor. A doctor's ``k``-th
+  appointment lands on a distinct (day, slot) position (``k * stride``
+  modulo the number of positions in the window, with ``stride`` coprime to
+  it), so there are no double bookings and the matching
+  ``doctor_schedules`` documents are emitted alongside.
+* Past appointments are mostly ``Completed``, future ones ``Scheduled`` or
+  ``Confirmed``; a share of both is ``Cancelled`` (and holds no slot).
+
+:func:`load` bulk-inserts a data set and raises the business ID counters
+past the generated IDs. ``manage.py generate_hospital_data`` is the
+command-line front end.
+"""
+import math
+import random
+from datetime import datetime, timedelta
+
+from bson.objectid import ObjectId
+
+from .dates import today
+from .ids import format_id
+from .scheduling import INACTIVE_STATUSES, SLOTS, day_key
+from .search import search_fields
+
+# Fixed timestamp part of generated ObjectIds (2024-01-01T00:00:00Z)
+OBJECT_ID_EPOCH = 1704067200
+KINDS = {'patients': 1, 'doctors': 2, 'appointments': 3}
+
+FIRST_NAMES = [
+    'James', 'Mary', 'John', 'Patricia', 'Robert', 'Jennifer', 'Michael', 'Linda', 'William', 'Elizabeth',
+    'David', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah', 'Charles', 'Karen',
+    'Aarav', 'Priya', 'Wei', 'Mei', 'Mohammed', 'Fatima', 'José', 'María', 'Yuki', 'Hiroshi',
+    'Olga', 'Ivan', 'Chloé', 'Lucas', 'Amara', 'Kwame', 'Noah', 'Emma', 'Liam', 'Olivia',
+]
+LAST_NAMES = [
+    'Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez', 'Martinez',
+    'Hernandez', 'Lopez', 'Gonzalez', 'Wilson', 'Anderson', 'Thomas', 'Taylor', 'Moore', 'Jackson', 'Martin',
+    'Patel', 'Sharma', 'Chen', 'Wang', 'Kim', 'Nguyen', 'Müller', 'Schmidt', 'Rossi', 'Kowalski',
+    'Okafor', 'Mensah', 'Tanaka', 'Sato', 'Ivanova', 'Dubois', 'Silva', 'Santos', "O'Brien", 'Murphy',
+]
+STREETS = ['Main St', 'Oak Ave', 'Park Rd', 'Cedar Ln', 'Maple Dr', 'Lake View', 'Hill St', 'River Rd']
+GENDERS = ['Male', 'Female', 'Other']
+GENDER_WEIGHTS = [48, 48, 4]
+BLOOD_GROUPS = ['O+', 'A+', 'B+', 'AB+', 'O-', 'A-', 'B-', 'AB-']
+BLOOD_GROUP_WEIGHTS = [38, 34, 9, 3, 7, 6, 2, 1]
+SPECIALIZATIONS = {
+    'Cardiology': 'OPD', 'Dermatology': 'OPD', 'Neurology': 'OPD', 'Pediatrics': 'OPD',
+    'Orthopedics': 'Surgery', 'Gynecology': 'OPD', 'Oncology': 'Radiology', 'Psychiatry': 'OPD',
+    'Dentistry': 'OPD', 'General Physician': 'Emergency',
+}
+QUALIFICATIONS = ['MBBS', 'MBBS, MD', 'MBBS, MS', 'MBBS, DNB', 'BDS, MDS']
+PURPOSES = ['General Checkup', 'Follow-up', 'Consultation', 'Lab Results', 'Vaccination', 'Prescription Refill']
+PAST_STATUSES = ['Completed', 'Cancelled', 'Confirmed']
+PAST_STATUS_WEIGHTS = [80, 15, 5]
+FUTURE_STATUSES = ['Scheduled', 'Confirmed', 'Cancelled']
+FUTURE_STATUS_WEIGHTS = [60, 30, 10]
+
+
+def object_id(kind, number, seed=0):
+    """Deterministic ObjectId for document ``number`` (1-based) of ``kind``."""
+    raw = OBJECT_ID_EPOCH.to_bytes(4, 'big') + bytes([KINDS[kind], seed & 0xFF]) + number.to_bytes(6, 'big')
+    return ObjectId(raw)
+
+
+def coprime_stride(positions):
+    """A stride near the golden section of ``positions`` that visits every position once."""
+    stride = max(1, int(positions * 0.618))
+    while math.gcd(stride, positions) != 1:
+        stride += 1
+    return stride
+
+
+class HospitalData:
+    """A reproducible synthetic data set; see the module docstring."""
+
+    def __init__(self, patients=10000, doctors=100, appointments=50000, seed=42, start=None, days=365):
+        self.patients = patients
+        self.doctors = max(1, doctors)
+        self.appointments = appointments
+        self.seed = seed
+        # The window runs from ``start`` for ``days`` days (widened if a
+        # doctor would need more slots than it has); by default it is
+        # centred on today so lists and dashboards see past and future.
+        per_doctor = math.ceil(appointments / self.doctors)
+        self.days = max(days, math.ceil(per_doctor / len(SLOTS)))
+        self.start = start or today() - timedelta(days=self.days // 2)
+
+    def _rng(self, part):
+        return random.Random(f'{self.seed}:{part}')
+
+    def patient_batches(self, batch_size):
+        rng = self._rng('patients')
+        for first in range(1, self.patients + 1, batch_size):
+            count = min(batch_size, self.patients + 1 - first)
+            # One choices() call per field and batch instead of per document
+            first_names = rng.choices(FIRST_NAMES, k=count)
+            last_names = rng.choices(LAST_NAMES, k=count)
+            genders = rng.choices(GENDERS, GENDER_WEIGHTS, k=count)
+            blood_groups = rng.choices(BLOOD_GROUPS, BLOOD_GROUP_WEIGHTS, k=count)
+            ages = [rng.randrange(0, 95 * 365) for _ in range(count)]
+            registered = [rng.randrange(0, 5 * 365 * 86400) for _ in range(count)]
+            batch = []
+            for offset in range(count):
+                number = first + offset
+                patient = {
+                    '_id': object_id('patients', number, self.seed),
+                    'patient_id': format_id('PAT', number),
+                    'first_name': first_names[offset],
+                    'last_name': last_names[offset],
+                    'email': f'{first_names[offset]}.{last_names[offset]}.{number}@example.com'.lower(),
+                    'phone': f'+1 555 {number % 10000000:07d}',
+                    'date_of_birth': (self.start - timedelta(days=ages[offset])).date().isoformat(),
+                    'gender': genders[offset],
+                    'address': f'{number % 9999 + 1} {STREETS[number % len(STREETS)]}',
+                    'blood_group': blood_groups[offset],
+                    'emergency_contact': f'+1 555 {(number * 7) % 10000000:07d}',
+                    'registration_date': self.start - timedelta(seconds=registered[offset]),
+                    'archived': False,
+                }
+                patient['search'] = search_fields(patient)
+                batch.append(patient)
+            yield batch
+
+    def doctor_batches(self, batch_size):
+        rng = self._rng('doctors')
+        specializations = list(SPECIALIZATIONS)
+        batch = []
+        for number in range(1, self.doctors + 1):
+            first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            specialization = specializations[(number - 1) % len(specializations)]
+            batch.append({
+                '_id': object_id('doctors', number, self.seed),
+                'doctor_id': format_id('DOC', number),
+                'first_name': first_name,
+                'last_name': last_name,
+                'email': f'dr.{first_name}.{last_name}.{number}@example.com'.lower(),
+                'phone': f'+1 555 {(number * 13) % 10000000:07d}',
+                'specialization': specialization,
+                'department': SPECIALIZATIONS[specialization],
+                'qualification': rng.choice(QUALIFICATIONS),
+                'experience': rng.randrange(1, 40),
+                'consultation_fee': float(rng.randrange(20, 300, 5)),
+                'availability': 'Available',
+                'status': 'Active',
+                'archived': False,
+            })
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def appointment_batches(self, batch_size):
+        """Yield ``(appointments, schedules)`` batches, doctor by doctor."""
+        rng = self._rng('appointments')
+        positions = self.days * len(SLOTS)
+        stride = coprime_stride(positions)
+        now = today()
+        number = 0
+        appointments, schedules = [], []
+        base, extra = divmod(self.appointments, self.doctors)
+        for doctor_number in range(1, self.doctors + 1):
+            doctor_id = object_id('doctors', doctor_number, self.seed)
+            booked = {}
+            for k in range(base + (doctor_number <= extra)):
+                number += 1
+                day_index, slot_index = divmod((k * stride + doctor_number * 7) % positions, len(SLOTS))
+                day = self.start + timedelta(days=day_index)
+                if day < now:
+                    status = rng.choices(PAST_STATUSES, PAST_STATUS_WEIGHTS)[0]
+                else:
+                    status = rng.choices(FUTURE_STATUSES, FUTURE_STATUS_WEIGHTS)[0]
+                appointment = {
+                    '_id': object_id('appointments', number, self.seed),
+                    'appointment_id': format_id('APT', number),
+                    'patient_id': object_id('patients', rng.randrange(self.patients) + 1, self.seed),
+                    'doctor_id': doctor_id,
+                    'appointment_date': day,
+                    'time_slot': SLOTS[slot_index],
+                    'purpose': rng.choice(PURPOSES),
+                    'notes': '',
+                    'status': status,
+                    'created_at': day - timedelta(days=rng.randrange(1, 60), seconds=rng.randrange(86400)),
+                }
+                appointments.append(appointment)
+                if status not in INACTIVE_STATUSES:
+                    booked.setdefault(day_key(day), []).append(SLOTS[slot_index])
+                if len(appointments) >= batch_size:
+                    yield appointments, []
+                    appointments = []
+            schedules.extend(
+                {'doctor_id': doctor_id, 'date': date, 'booked': sorted(slots, key=SLOTS.index)}
+                for date, slots in booked.items()
+            )
+            if len(schedules) >= batch_size:
+                yield appointments, schedules
+                appointments, schedules = [], []
+        if appointments or schedules:
+            yield appointments, schedules
+
+
+def load(db, data, batch_size=5000, on_batch=None):
+    """Bulk-insert ``data`` into ``db``; returns ``{collection: inserted}``.
+
+    Expects empty collections (generated ``_id`` values would collide with
+    an earlier load of the same seed). ``on_batch(name, inserted_so_far)``
+    is called after every insert.
+    """
+    inserted = {'patients': 0, 'doctors': 0, 'appointments': 0, 'doctor_schedules': 0}
+
+    def insert(name, documents):
+        if documents:
+            db[name].insert_many(documents, ordered=False)
+            inserted[name] += len(documents)
+            if on_batch:
+                on_batch(name, inserted[name])
+
+    for batch in data.doctor_batches(batch_size):
+        insert('doctors', batch)
+    for batch in data.patient_batches(batch_size):
+        insert('patients', batch)
+    for appointments, schedules in data.appointment_batches(batch_size):
+        insert('appointments', appointments)
+        insert('doctor_schedules', schedules)
+
+    # Business IDs were assigned here, so move the counters past them
+    for name, count in (('patient_id', data.patients), ('doctor_id', data.doctors),
+                        ('appointment_id', data.appointments)):
+        db['counters'].update_one({'_id': name}, {'$max': {'seq': count}}, upsert=True)
+    return inserted
@@ -0,0 +1,347 @@
+"""Test doubles: in-memory stand-ins for pymongo collections.
+
+Nothing in the app itself imports this module. It is used by the test
+suite and by ``manage.py benchmark_views --in-memory``. The fakes
+implement the subset of the pymongo API and query language the app uses,
+evaluate filters with linear scans and report every call to the request
+profiler the way pymongo's command monitoring would, so query counts per
+request match a real server. Aggregation pipelines are not supported, so
+the benchmark skips the views that run one (``benchmark_views.AGGREGATING``).
+"""
+import copy
+import re
+import threading
+from datetime import datetime
+from types import SimpleNamespace
+
+from bson.codec_options import CodecOptions
+from bson.objectid import ObjectId
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from . import profiling
+
+
+def get_path(document, key):
+    for part in key.split('.'):
+        if not isinstance(document, dict):
+            return None
+        document = document.get(part)
+    return document
+
+
+def set_path(document, key, value):
+    *parents, last = key.split('.')
+    for part in parents:
+        document = document.setdefault(part, {})
+    document[last] = value
+
+
+def _compare(value, operator, operand):
+    if operator == '$all':
+        return isinstance(value, list) and all(item in value for item in operand)
+    if operator == '$in':
+        return any(item in operand for item in value) if isinstance(value, list) else value in operand
+    if operator == '$nin':
+        return not _compare(value, '$in', operand)
+    if operator == '$ne':
+        return operand not in value if isinstance(value, list) else value != operand
+    if operator == '$type':
+        return isinstance(value, {'string': str, 'date': datetime}[operand])
+    if operator == '$exists':
+        return (value is not None) == operand
+    if operator == '$regex':
+        return value is not None and re.search(operand, str(value)) is not None
+    if value is None:
+        return False
+    if operator == '$lt':
+        return value < operand
+    if operator == '$lte':
+        return value <= operand
+    if operator == '$gt':
+        return value > operand
+    if operator == '$gte':
+        return value >= operand
+    raise NotImplementedError(operator)
+
+
+def matches(document, criteria):
+    for key, condition in (criteria or {}).items():
+        if key == '$or':
+            if not any(matches(document, c) for c in condition):
+                return False
+        elif key == '$and':
+            if not all(matches(document, c) for c in condition):
+                return False
+        elif isinstance(condition, dict) and any(k.startswith('$') for k in condition):
+            value = get_path(document, key)
+            for op, operand in condition.items():
+                if op == '$options':
+                    continue
+                if op == '$regex' and 'i' in condition.get('$options', ''):
+                    operand = '(?i)' + operand
+                if not _compare(value, op, operand):
+                    return False
+        else:
+            value = get_path(document, key)
+            if isinstance(value, list) and not isinstance(condition, list):
+                if condition not in value:
+                    return False
+            elif value != condition:
+                return False
+    return True
+
+
+class MemoryCursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def sort(self, key, direction=1):
+        keys = key if isinstance(key, list) else [(key, direction)]
+        for field, order in reversed(keys):
+            if isinstance(order, dict):
+                continue  # {'$meta': 'textScore'} has no in-memory equivalent
+            self.documents.sort(key=lambda d: (d.get(field) is not None, d.get(field)), reverse=order < 0)
+        return self
+
+    def limit(self, count):
+        if count:
+            self.documents = self.documents[:count]
+        return self
+
+    def __iter__(self):
+        return iter(list(self.documents))
+
+
+class MemoryCollection:
+    """In-memory stand-in for a pymongo collection that counts round trips."""
+
+    def __init__(self, documents=(), name='test', unique=()):
+        self.name = name
+        self.unique = list(unique)
+        self.documents = [dict(d) for d in documents]
+        self.calls = []
+        self._lock = threading.Lock()
+        self.codec_options = CodecOptions()
+
+    def _call(self, operation):
+        # Report to the request profiler the way pymongo's command monitoring would
+        self.calls.append(operation)
+        profiling.record(self.name, operation, 0.0)
+
+    def with_options(self, codec_options=None, **kwargs):
+        # A view onto the same documents, like pymongo's
+        view = copy.copy(self)
+        if codec_options is not None:
+            view.codec_options = codec_options
+        return view
+
+    def _project(self, document, projection):
+        document_class = self.codec_options.document_class
+        if not projection:
+            return document_class(document)
+        # Dotted paths keep their whole top-level field
+        wanted = {key.split('.')[0] for key, value in projection.items() if value}
+        return document_class({k: v for k, v in document.items() if k == '_id' or k in wanted})
+
+    def find(self, criteria=None, projection=None, sort=None, limit=0, batch_size=0):
+        self._call('find')
+        found = [self._project(d, projection) for d in self.documents if matches(d, criteria)]
+        cursor = MemoryCursor(found)
+        if sort:
+            cursor.sort(sort)
+        return cursor.limit(limit)
+
+    def find_one(self, criteria=None, projection=None, sort=None):
+        self._call('find_one')
+        found = [d for d in self.documents if matches(d, criteria)]
+        if sort:
+            found = MemoryCursor(found).sort(sort).documents
+        return self._project(found[0], projection) if found else None
+
+    def insert_one(self, document):
+        self._call('insert_one')
+        document.setdefault('_id', ObjectId())
+        self.documents.append(dict(document))
+        return SimpleNamespace(inserted_id=document['_id'])
+
+    def insert_many(self, documents, ordered=True):
+        self._call('insert_many')
+        inserted_ids = []
+        for document in documents:
+            document.setdefault('_id', ObjectId())
+            self.documents.append(dict(document))
+            inserted_ids.append(document['_id'])
+        return SimpleNamespace(inserted_ids=inserted_ids)
+
+    def _apply(self, document, update, inserted=False):
+        for operator, fields in update.items():
+            for field, value in fields.items():
+                if operator == '$setOnInsert':
+                    if inserted:
+                        set_path(document, field, value)
+                elif operator == '$set':
+                    set_path(document, field, value)
+                elif operator == '$inc':
+                    document[field] = document.get(field, 0) + value
+                elif operator == '$max':
+                    current = document.get(field)
+                    document[field] = value if current is None else max(current, value)
+                elif operator == '$addToSet':
+                    document.setdefault(field, [])
+                    for item in value['$each'] if isinstance(value, dict) else [value]:
+                        if item not in document[field]:
+                            document[field].append(item)
+                elif operator == '$pull':
+                    pulled = value['$in'] if isinstance(value, dict) else [value]
+                    document[field] = [item for item in document.get(field, []) if item not in pulled]
+                else:
+                    raise NotImplementedError(operator)
+
+    def _upsert(self, criteria, update, upsert):
+        with self._lock:
+            found = next((d for d in self.documents if matches(d, criteria)), None)
+            inserted = found is None and upsert
+            if inserted:
+                found = {k: v for k, v in criteria.items()
+                         if not k.startswith('$') and not (isinstance(v, dict) and any(o.startswith('$') for o in v))}
+                for fields in self.unique:
+                    if any(all(d.get(f) == found.get(f) for f in fields) for d in self.documents):
+                        raise DuplicateKeyError(f"duplicate key on {fields}")
+                found.setdefault('_id', ObjectId())
+                self.documents.append(found)
+            if found is not None:
+                self._apply(found, update, inserted)
+            return found
+
+    def update_one(self, criteria, update, upsert=False):
+        self._call('update_one')
+        found = self._upsert(criteria, update, upsert)
+        return SimpleNamespace(matched_count=int(found is not None))
+
+    def find_one_and_update(self, criteria, update, upsert=False, return_document=None, projection=None):
+        self._call('find_one_and_update')
+        found = self._upsert(criteria, update, upsert)
+        return dict(found) if found is not None else None
+
+    def bulk_write(self, requests, ordered=True):
+        self._call('bulk_write')
+        upserted_ids = {}
+        matched = 0
+        errors = []
+        for index, request in enumerate(requests):
+            before = len(self.documents)
+            try:
+                found = self._upsert(request._filter, request._doc, request._upsert)
+            except DuplicateKeyError as error:
+                errors.append({'index': index, 'code': 11000, 'errmsg': str(error)})
+                if ordered:
+                    break
+                continue
+            if len(self.documents) > before:
+                upserted_ids[index] = found['_id']
+            elif found is not None:
+                matched += 1
+        if errors:
+            raise BulkWriteError({'writeErrors': errors, 'nMatched': matched, 'nUpserted': len(upserted_ids),
+                                  'upserted': [{'index': i, '_id': _id} for i, _id in upserted_ids.items()]})
+        return SimpleNamespace(upserted_count=len(upserted_ids), upserted_ids=upserted_ids,
+                               matched_count=matched, modified_count=matched)
+
+    def _delete(self, criteria):
+        with self._lock:
+            found = next((d for d in self.documents if matches(d, criteria)), None)
+            if found is not None:
+                self.documents.remove(found)
+            return found
+
+    def find_one_and_delete(self, criteria, projection=None):
+        self._call('find_one_and_delete')
+        found = self._delete(criteria)
+        return self._project(found, projection) if found is not None else None
+
+    def delete_one(self, criteria):
+        self._call('delete_one')
+        return SimpleNamespace(deleted_count=int(self._delete(criteria) is not None))
+
+    def delete_many(self, criteria):
+        self._call('delete_many')
+        with self._lock:
+            kept = [d for d in self.documents if not matches(d, criteria)]
+            deleted, self.documents[:] = len(self.documents) - len(kept), kept
+        return SimpleNamespace(deleted_count=deleted)
+
+    def update_many(self, criteria, update):
+        self._call('update_many')
+        with self._lock:
+            found = [d for d in self.documents if matches(d, criteria)]
+            for document in found:
+                self._apply(document, update)
+        return SimpleNamespace(matched_count=len(found), modified_count=len(found))
+
+    def count_documents(self, criteria):
+        self._call('count_documents')
+        return sum(1 for d in self.documents if matches(d, criteria))
+
+    def estimated_document_count(self):
+        self._call('estimated_document_count')
+        return len(self.documents)
+
+    def distinct(self, field, criteria=None):
+        self._call('distinct')
+        return sorted({d[field] for d in self.documents if d.get(field) is not None and matches(d, criteria)})
+
+    def aggregate(self, pipeline, **kwargs):
+        raise NotImplementedError("aggregation pipelines need a real MongoDB server")
+
+    def create_indexes(self, indexes):
+        return []
+
+    def drop(self):
+        self.documents = []
+
+
+class AsyncMemoryCursor(MemoryCursor):
+    async def to_list(self, length=None):
+        return list(self.documents)
+
+
+class AsyncMemoryCollection:
+    """Asyncio-driver flavour of :class:`MemoryCollection` sharing its documents."""
+
+    def __init__(self, fake):
+        self.fake = fake
+        self.name = fake.name
+        self.codec_options = fake.codec_options
+
+    def with_options(self, **kwargs):
+        return AsyncMemoryCollection(self.fake.with_options(**kwargs))
+
+    def find(self, *args, **kwargs):
+        return AsyncMemoryCursor(self.fake.find(*args, **kwargs).documents)
+
+    def __getattr__(self, attribute):
+        method = getattr(self.fake, attribute)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+        return call
+
+
+class MemoryDatabase:
+    """Collections by name, created on first access."""
+
+    # Unique indexes the app relies on for correctness (see indexes.INDEXES)
+    UNIQUE = {'doctor_schedules': [('doctor_id', 'date')]}
+
+    def __init__(self):
+        self.collections = {}
+
+    def __getitem__(self, name):
+        if name not in self.collections:
+            self.collections[name] = MemoryCollection(name=name, unique=self.UNIQUE.get(name, ()))
+        return self.collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
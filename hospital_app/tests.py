@@ -1,3 +1,1834 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import os
+import pickle
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import bson
+from asgiref.sync import async_to_sync
+from bson.codec_options import CodecOptions
+from bson.objectid import ObjectId
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.template import Context, Template
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from pymongo.errors import BulkWriteError, DuplicateKeyError, ServerSelectionTimeoutError
+
+from . import (
+    analytics, archive, async_views, benchmarking, bulk, changefeed, doctor_cache, encoding, export, metrics, mongo, profiling, scheduling,
+    stats, synthetic, versions, views,
+)
+from .dates import parse_day, today
+from .ids import IdAllocator, seed_counter
+from .importer import RowError, import_patients, normalize_patient, read_rows
+from .indexes import INDEXES, classify_plan, diff_indexes
+from .testing import AsyncMemoryCollection, MemoryCollection, MemoryCursor, MemoryDatabase
+from .pagination import paginate
+from .rows import AppointmentRow, DoctorRow, PatientRow
+from .search import search_fields, search_patients
+
+
+# ===== TEST DOUBLES =====
+def make_people(count, prefix):
+    return [{'_id': ObjectId(), 'first_name': f'{prefix}{i}', 'last_name': 'Test', 'archived': False}
+            for i in range(count)]
+
+
+def make_appointments(patients, doctors, count):
+    return [{
+        '_id': ObjectId(),
+        'appointment_id': f'APT{i + 1:06d}',
+        'patient_id': patients[i % len(patients)]['_id'],
+        'doctor_id': doctors[i % len(doctors)]['_id'],
+        'appointment_date': datetime(2025, 1, 1),
+        'time_slot': '09:00 AM - 10:00 AM',
+        'purpose': 'General Checkup',
+        'status': 'Scheduled',
+    } for i in range(count)]
+
+
+class MongoViewTestCase(profiling.MongoQueryAssertions, TestCase):
+    """Logs in a staff user and swaps the Mongo collections for fakes."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('staff', password='s3cret-pass')
+        self.client.force_login(self.user)
+
+    def use_collections(self, patients=(), doctors=(), appointments=()):
+        self.patients = MemoryCollection(patients, 'patients')
+        self.doctors = MemoryCollection(doctors, 'doctors')
+        self.appointments = MemoryCollection(appointments, 'appointments')
+        for name, fake in (('patients_collection', self.patients),
+                           ('doctors_collection', self.doctors),
+                           ('appointments_collection', self.appointments)):
+            patcher = mock.patch.object(views, name, fake)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.schedules = MemoryCollection(name='doctor_schedules', unique=[('doctor_id', 'date')])
+        patcher = mock.patch.object(scheduling, 'schedules_collection', self.schedules)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.versions = MemoryCollection(name='change_versions')
+        for name, fake in (('versions_collection', self.versions),
+                           ('async_versions_collection', AsyncMemoryCollection(self.versions))):
+            patcher = mock.patch.object(versions, name, fake)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # Rendered list fragments are keyed on the versions, which restart here
+        caches[versions.FRAGMENT_CACHE].clear()
+        # Writes stamp the change feed; reads go through the same fakes
+        self.tombstones = MemoryCollection(name='deleted_records')
+        self.checkpoints = MemoryCollection(name='change_checkpoints')
+        for patcher in (mock.patch.dict(changefeed.feed_collections, {'patients': self.patients,
+                                                                      'doctors': self.doctors,
+                                                                      'appointments': self.appointments}),
+                        mock.patch.object(changefeed, 'tombstones_collection', self.tombstones),
+                        mock.patch.object(changefeed, 'checkpoints_collection', self.checkpoints),
+                        mock.patch.object(changefeed, 'SOURCE', 'watermark')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.archives = {name: MemoryCollection(name=f'{name}_archive') for name in archive.archive_collections}
+        for patcher in (mock.patch.dict(archive.archive_collections, self.archives),
+                        mock.patch.object(async_views, 'archives',
+                                          {name: AsyncMemoryCollection(fake) for name, fake in self.archives.items()})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.rollups = MemoryCollection(name='appointment_rollups', unique=[('date', 'doctor_id')])
+        patcher = mock.patch.object(analytics, 'rollups_collection', self.rollups)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.counters = MemoryCollection(name='counters')
+        for name, prefix in (('patient_ids', 'PAT'), ('doctor_ids', 'DOC'), ('appointment_ids', 'APT')):
+            allocator = IdAllocator(self.counters, name.replace('_ids', '_id'), prefix)
+            patcher = mock.patch.object(views, name, allocator)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def query_count(self):
+        return (len(self.patients.calls) + len(self.doctors.calls) + len(self.appointments.calls)
+                + len(self.versions.calls))
+
+
+# ===== APPOINTMENT NAME RESOLUTION =====
+class AppointmentNameResolutionTests(MongoViewTestCase):
+
+    def _queries_for(self, url_name, appointment_count):
+        patients = make_people(appointment_count, 'Patient')
+        doctors = make_people(max(appointment_count // 3, 1), 'Doctor')
+        self.use_collections(patients, doctors, make_appointments(patients, doctors, appointment_count))
+        response = self.client.get(reverse(url_name))
+        self.assertEqual(response.status_code, 200)
+        return self.query_count()
+
+    def test_appointment_list_query_count_is_constant(self):
+        self.assertEqual(self._queries_for('appointment-list', 5),
+                         self._queries_for('appointment-list', 300))
+
+    def test_search_appointments_query_count_is_constant(self):
+        self.assertEqual(self._queries_for('search-appointments', 5),
+                         self._queries_for('search-appointments', 300))
+
+    def test_names_are_resolved_with_unknown_fallback(self):
+        patients = make_people(1, 'Jane')
+        doctors = make_people(1, 'House')
+        appointments = make_appointments(patients, doctors, 2)
+        appointments[1]['patient_id'] = ObjectId()
+        self.use_collections(patients, doctors, appointments)
+
+        response = self.client.get(reverse('appointment-list'))
+
+        names = {a['appointment_id']: (a['patient_name'], a['doctor_name'])
+                 for a in response.context['appointments']}
+        self.assertEqual(names['APT000001'], ('Jane0 Test', 'Dr. House0 Test'))
+        self.assertEqual(names['APT000002'], ('Unknown', 'Dr. House0 Test'))
+
+
+# ===== CURSOR PAGINATION =====
+class CursorPaginationTests(TestCase):
+
+    def setUp(self):
+        # Repeated sort values and a missing one exercise the _id tie-breaker
+        self.collection = MemoryCollection([
+            {'_id': ObjectId(), 'appointment_date': f'2025-01-{(i % 7) + 1:02d}' if i else None}
+            for i in range(23)
+        ])
+        self.factory = RequestFactory()
+
+    def _page(self, **params):
+        return paginate(self.collection, {}, '-appointment_date', self.factory.get('/', params))
+
+    def _walk_forward(self, page_size):
+        seen = []
+        page = self._page(page_size=page_size)
+        while True:
+            seen.extend(page.items)
+            if not page.has_next:
+                return seen, page
+            page = self._page(page_size=page_size, cursor=page.next_token)
+
+    def test_walking_forward_visits_every_document_once_in_order(self):
+        seen, _ = self._walk_forward(5)
+        expected = MemoryCursor(list(self.collection.documents)).sort(
+            [('appointment_date', -1), ('_id', -1)]).documents
+        self.assertEqual([d['_id'] for d in seen], [d['_id'] for d in expected])
+
+    def test_previous_token_returns_to_the_prior_page(self):
+        first = self._page(page_size=5)
+        second = self._page(page_size=5, cursor=first.next_token)
+        back = self._page(page_size=5, cursor=second.prev_token)
+        self.assertEqual([d['_id'] for d in back], [d['_id'] for d in first])
+        self.assertFalse(back.has_previous)
+        self.assertFalse(first.has_previous)
+
+    def test_last_page_has_no_next_token(self):
+        _, last = self._walk_forward(5)
+        self.assertEqual(len(last), 3)
+        self.assertTrue(last.has_previous)
+
+    def test_malformed_cursor_falls_back_to_first_page(self):
+        page = self._page(page_size=5, cursor='not-a-token')
+        self.assertEqual([d['_id'] for d in page], [d['_id'] for d in self._page(page_size=5)])
+
+    def test_page_size_is_capped(self):
+        page = self._page(page_size=10_000)
+        self.assertEqual(page.page_size, 200)
+
+
+# ===== BUSINESS ID ALLOCATION =====
+class IdAllocatorTests(MongoViewTestCase):
+
+    def _allocate_concurrently(self, allocator, threads=16, per_thread=50):
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            batches = pool.map(lambda _: [allocator.next_id() for _ in range(per_thread)], range(threads))
+            return [business_id for batch in batches for business_id in batch]
+
+    def test_parallel_allocation_never_duplicates(self):
+        counters = MemoryCollection(name='counters')
+        ids = self._allocate_concurrently(IdAllocator(counters, 'patient_id', 'PAT'))
+        self.assertEqual(len(ids), 800)
+        self.assertEqual(len(set(ids)), 800)
+        self.assertEqual(max(ids), 'PAT000800')
+
+    def test_block_reservation_shares_one_counter_across_allocators(self):
+        counters = MemoryCollection(name='counters')
+        workers = [IdAllocator(counters, 'appointment_id', 'APT', block_size=7) for _ in range(3)]
+        ids = [business_id for worker in workers for business_id in self._allocate_concurrently(worker, 8, 25)]
+        self.assertEqual(len(set(ids)), 600)
+        # One round trip per block rather than per ID
+        self.assertLessEqual(len(counters.calls), 3 * (200 // 7 + 1))
+
+    def test_seed_counter_continues_after_existing_ids(self):
+        counters = MemoryCollection(name='counters')
+        appointments = MemoryCollection([
+            {'appointment_id': 'APT000009'}, {'appointment_id': 'APT100000'}, {'appointment_id': 'bogus'},
+        ])
+        self.assertEqual(seed_counter(counters, appointments, 'appointment_id', 'appointment_id', 'APT'), 100000)
+        self.assertEqual(IdAllocator(counters, 'appointment_id', 'APT').next_id(), 'APT100001')
+
+        # Seeding again from older data never moves the counter backwards
+        seed_counter(counters, MemoryCollection(), 'appointment_id', 'appointment_id', 'APT')
+        self.assertEqual(IdAllocator(counters, 'appointment_id', 'APT').next_id(), 'APT100002')
+
+    def test_add_patient_uses_allocator(self):
+        self.use_collections()
+        for email in ('a@example.com', 'b@example.com'):
+            self.client.post(reverse('add-patient'), {'first_name': 'A', 'last_name': 'B', 'email': email})
+        self.assertEqual([p['patient_id'] for p in self.patients.documents], ['PAT000001', 'PAT000002'])
+        self.assertNotIn('find_one', self.patients.calls)
+
+    def test_an_already_registered_email_is_a_form_error(self):
+        self.use_collections(make_people(1, 'P'), make_people(1, 'D'))
+        patient, doctor = self.patients.documents[0], self.doctors.documents[0]
+        taken = mock.Mock(side_effect=DuplicateKeyError('E11000 duplicate key error'))
+        posts = [
+            (self.patients, 'insert_one', reverse('add-patient'),
+             {'first_name': 'A', 'last_name': 'B', 'email': 'a@example.com'}),
+            (self.patients, 'update_one', reverse('update-patient', args=[patient['_id']]),
+             {'first_name': 'A', 'last_name': 'B', 'email': 'a@example.com'}),
+            (self.doctors, 'insert_one', reverse('add-doctor'),
+             {'first_name': 'A', 'last_name': 'B', 'email': 'a@example.com', 'specialization': 'Neurology'}),
+            (self.doctors, 'update_one', reverse('update-doctor', args=[doctor['_id']]),
+             {'first_name': 'A', 'last_name': 'B', 'email': 'a@example.com', 'specialization': 'Neurology'}),
+        ]
+        for collection, method, url, data in posts:
+            with self.subTest(url=url), mock.patch.object(collection, method, taken):
+                response = self.client.post(url, data)
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, 'already registered')
+                self.assertContains(response, 'value="A"')
+
+
+# ===== INDEX SPECIFICATION =====
+class IndexSpecTests(TestCase):
+
+    def _live(self, spec):
+        live = {'_id_': {'key': [('_id', 1)]}}
+        for model in spec:
+            document = dict(model.document)
+            name = document.pop('name')
+            live[name] = dict(document, key=list(document['key'].items()))
+        return live
+
+    def test_spec_matches_itself(self):
+        for spec in INDEXES.values():
+            self.assertEqual(diff_indexes(spec, self._live(spec)), ([], [], []))
+
+    def test_diff_reports_missing_changed_and_extra(self):
+        live = self._live(INDEXES['appointments'])
+        del live['status_date']
+        live['appointment_id_unique'].pop('unique')
+        live['legacy'] = {'key': [('purpose', 1)]}
+        self.assertEqual(diff_indexes(INDEXES['appointments'], live),
+                         (['status_date'], ['appointment_id_unique'], ['legacy']))
+
+    def test_classify_plan(self):
+        fetch = {'queryPlanner': {'winningPlan': {'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN'}}}}
+        covered = {'queryPlanner': {'winningPlan': {'stage': 'PROJECTION_COVERED', 'inputStage': {'stage': 'IXSCAN'}}}}
+        scan = {'queryPlanner': {'winningPlan': {'queryPlan': {'stage': 'SORT', 'inputStage': {'stage': 'COLLSCAN'}}}}}
+        self.assertEqual(classify_plan(fetch)[0], 'INDEXED')
+        self.assertEqual(classify_plan(covered)[0], 'COVERED')
+        self.assertEqual(classify_plan(scan)[0], 'COLLSCAN')
+
+
+# ===== SHARED MONGO CLIENT =====
+class SharedClientTests(TestCase):
+
+    def setUp(self):
+        mongo.close_client()
+        self.addCleanup(mongo.close_client)
+
+    def test_client_is_created_lazily_and_reused(self):
+        with mock.patch('pymongo.MongoClient') as client_class:
+            self.assertIsNone(mongo._client)
+            mongo.patients_collection.name
+            mongo.doctors_collection.find
+            mongo.get_db()
+        self.assertEqual(client_class.call_count, 1)
+        options = client_class.call_args.kwargs
+        self.assertEqual(options['maxPoolSize'], 100)
+        self.assertIn(mongo.pool_stats, options['event_listeners'])
+
+    def test_client_is_recreated_after_fork(self):
+        with mock.patch('pymongo.MongoClient', side_effect=lambda *a, **kw: mock.Mock()) as client_class:
+            parent = mongo.get_client()
+            with mock.patch('os.getpid', return_value=-1):
+                child = mongo.get_client()
+        self.assertEqual(client_class.call_count, 2)
+        self.assertIsNot(parent, child)
+        parent.close.assert_not_called()
+
+    def test_pool_stats_track_checkout_waits(self):
+        stats = mongo.PoolStats()
+        stats.connection_check_out_started(None)
+        stats.connection_checked_out(None)
+        stats.connection_check_out_started(None)
+        stats.connection_check_out_failed(None)
+        snapshot = stats.snapshot()
+        self.assertEqual((snapshot['checkouts'], snapshot['checkout_failures'], snapshot['checked_out']), (1, 1, 1))
+        self.assertGreaterEqual(snapshot['checkout_wait_max_ms'], 0)
+
+
+# ===== PATIENT SEARCH =====
+class PatientSearchTests(TestCase):
+
+    def setUp(self):
+        people = [
+            ('PAT000001', 'John', 'Smith', 'john@example.com', '555-0101'),
+            ('PAT000002', 'Johanna', 'Smithers', 'jo@example.com', '555-0102'),
+            ('PAT000003', 'José', 'Jones', 'JOSE@Example.com', '(555) 0199'),
+            ('PAT000011', 'Mary', 'Smith', 'mary@example.com', '555-7777'),
+        ]
+        documents = []
+        for patient_id, first, last, email, phone in people:
+            patient = {'_id': ObjectId(), 'patient_id': patient_id, 'first_name': first,
+                       'last_name': last, 'email': email, 'phone': phone, 'archived': False}
+            patient['search'] = search_fields(patient)
+            documents.append(patient)
+        self.collection = MemoryCollection(documents, 'patients')
+
+    def _ids(self, query):
+        return [p['patient_id'] for p in search_patients(self.collection, query)]
+
+    def test_search_fields_are_normalized(self):
+        fields = search_fields({'first_name': 'José', 'last_name': 'de la Cruz',
+                                'email': ' JOSE@Example.com', 'phone': '+1 (555) 010-1234'})
+        self.assertEqual(fields['names'], 'jose de la cruz')
+        self.assertEqual(fields['email'], 'jose@example.com')
+        self.assertEqual(fields['phone'], '15550101234')
+        self.assertIn('jos', fields['prefixes'])
+        self.assertIn('cruz', fields['prefixes'])
+
+    def test_name_prefixes_rank_whole_words_first(self):
+        self.assertEqual(self._ids('smith'), ['PAT000001', 'PAT000011', 'PAT000002'])
+        self.assertEqual(self._ids('jo sm'), ['PAT000001', 'PAT000002'])
+        self.assertEqual(self._ids('jose'), ['PAT000003'])
+
+    def test_fast_paths_for_ids_emails_and_phones(self):
+        self.assertEqual(self._ids('pat000001'), ['PAT000001'])
+        self.assertEqual(self._ids('pat00001'), ['PAT000011'])
+        self.assertEqual(self._ids('Jose@example.com'), ['PAT000003'])
+        self.assertEqual(self._ids('555 01'), ['PAT000001', 'PAT000002', 'PAT000003'])
+
+    def test_pat_without_digits_is_a_name(self):
+        patient = {'_id': ObjectId(), 'patient_id': 'PAT000012', 'first_name': 'Patricia', 'last_name': 'Lee',
+                   'email': 'pat@example.com', 'phone': '555-8888', 'archived': False}
+        patient['search'] = search_fields(patient)
+        self.collection.insert_one(patient)
+        self.assertEqual(self._ids('Pat'), ['PAT000012'])
+
+    def test_results_are_capped(self):
+        self.assertEqual(len(search_patients(self.collection, 'smith', limit=1)), 1)
+
+
+# ===== DOCTOR CACHE =====
+class DoctorCacheTests(MongoViewTestCase):
+
+    def setUp(self):
+        super().setUp()
+        doctor_cache.get_cache().clear()
+        doctors = [dict(d, specialization='Cardiology', department='Heart') for d in make_people(3, 'Doc')]
+        self.use_collections(make_people(2, 'Patient'), doctors)
+
+    def test_repeat_reads_are_served_from_cache(self):
+        for _ in range(3):
+            self.client.get(reverse('search-doctors'))
+            self.client.get(reverse('doctor-list'))
+        self.assertEqual(self.doctors.calls.count('distinct'), 2)
+        self.assertEqual(self.doctors.calls.count('find'), 1)
+
+    def test_writes_invalidate_cached_doctors(self):
+        before = doctor_cache.stats.snapshot()
+        self.client.get(reverse('search-doctors'))
+        self.client.post(reverse('add-doctor'), {
+            'first_name': 'New', 'last_name': 'Doc', 'specialization': 'Neurology',
+            'experience': '3', 'consultation_fee': '50',
+        })
+        response = self.client.get(reverse('search-doctors'))
+        self.assertIn('Neurology', response.context['specializations'])
+        self.assertEqual(response.context['total_results'], 4)
+        after = doctor_cache.stats.snapshot()
+        self.assertEqual(after['invalidations'] - before['invalidations'], 1)
+
+
+# ===== ASYNC VIEWS =====
+class AsyncViewTests(MongoViewTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patients = make_people(4, 'Patient')
+        doctors = make_people(2, 'Doctor')
+        self.use_collections(patients, doctors, make_appointments(patients, doctors, 6))
+        for name, fake in (('patients_collection', self.patients),
+                           ('doctors_collection', self.doctors),
+                           ('appointments_collection', self.appointments)):
+            patcher = mock.patch.object(async_views, name, AsyncMemoryCollection(fake))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _async_get(self, view, path):
+        request = RequestFactory().get(path)
+        user = self.user
+
+        async def auser():
+            return user
+        request.auser = auser
+        return async_to_sync(view)(request)
+
+    def test_async_views_render_the_same_rows(self):
+        sync_response = self.client.get(reverse('appointment-list'))
+        async_response = self._async_get(async_views.appointment_list, reverse('appointment-list'))
+        self.assertEqual(async_response.status_code, 200)
+        for appointment in sync_response.context['appointments']:
+            self.assertContains(async_response, appointment['appointment_id'])
+            self.assertContains(async_response, appointment['patient_name'])
+
+    def test_async_dashboard_counts(self):
+        stats.cache.delete(stats.SNAPSHOT_KEY)
+        aggregates = mock.Mock()
+        aggregates.aggregate.return_value = iter(FACET_RESULTS)
+        with mock.patch.object(stats, 'patients_collection', aggregates):
+            response = self._async_get(async_views.staff_dashboard, reverse('staff_dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(aggregates.aggregate.call_count, 1)
+        self.assertEqual(self.query_count(), 0)
+
+
+# ===== DASHBOARD STATISTICS =====
+FACET_RESULTS = [
+    {'source': 'patients', 'total': [{'n': 12}],
+     'by_gender': [{'_id': 'Female', 'count': 7}, {'_id': 'Male', 'count': 5}]},
+    {'source': 'doctors', 'total': [{'n': 3}],
+     'by_specialization': [{'_id': 'Cardiology', 'count': 3}]},
+    {'source': 'appointments', 'total': [{'n': 9}],
+     'today_by_status': [{'_id': 'Confirmed', 'count': 2}, {'_id': 'Scheduled', 'count': 1}],
+     'week_by_status': [{'_id': 'Scheduled', 'count': 5}, {'_id': 'Cancelled', 'count': 1}],
+     'week_by_day': [{'_id': '2025-01-01', 'count': 6}]},
+]
+
+
+class DashboardStatsTests(MongoViewTestCase):
+
+    def setUp(self):
+        super().setUp()
+        stats.cache.delete(stats.SNAPSHOT_KEY)
+        stats.cache.delete(stats.REFRESH_LOCK_KEY)
+        self.use_collections()
+        self.aggregates = mock.Mock()
+        self.aggregates.aggregate.side_effect = lambda pipeline: iter(FACET_RESULTS)
+        patcher = mock.patch.object(stats, 'patients_collection', self.aggregates)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_build_stats_shapes_facets(self):
+        result = stats.build_stats(FACET_RESULTS, None)
+        self.assertEqual((result['total_patients'], result['total_doctors']), (12, 3))
+        self.assertEqual(result['today_appointments'], 3)
+        self.assertEqual(list(result['today_by_status']), stats.STATUSES)
+        self.assertEqual(result['week_by_status']['Completed'], 0)
+        self.assertEqual(stats.build_stats([], None)['total_patients'], 0)
+
+    def test_dashboard_is_one_aggregation_then_cached(self):
+        for _ in range(3):
+            response = self.client.get(reverse('staff_dashboard'))
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total_patients'], 12)
+        self.assertEqual(response.context['today_by_status']['Confirmed'], 2)
+        self.assertEqual(self.aggregates.aggregate.call_count, 1)
+        self.assertEqual(self.query_count(), 0)
+
+    def test_stale_snapshot_is_served_while_refreshing(self):
+        stale = dict(stats.build_stats([], None), total_patients=-1)
+        stats.cache.set(stats.SNAPSHOT_KEY, (0, stale))
+        with mock.patch.object(stats, '_refresh_in_background') as refresh:
+            self.assertEqual(stats.dashboard_stats()['total_patients'], -1)
+        refresh.assert_called_once_with()
+        self.aggregates.aggregate.assert_not_called()
+
+        stats.refresh_stats()
+        self.assertEqual(stats.dashboard_stats()['total_patients'], 12)
+
+
+# ===== PATIENT IMPORT =====
+class PatientImportTests(MongoViewTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.use_collections([{'_id': ObjectId(), 'patient_id': 'PAT000001', 'first_name': 'Old',
+                               'last_name': 'Name', 'email': 'ann@example.com', 'archived': False}])
+        self.counters.documents.append({'_id': 'patient_id', 'seq': 1})
+
+    def test_rows_are_validated_and_normalized(self):
+        patient = normalize_patient({'first_name': ' Ann ', 'last_name': 'Lee', 'email': 'Ann@Example.COM',
+                                     'gender': 'f', 'blood_group': 'ab+', 'date_of_birth': '31/12/1990'})
+        self.assertEqual((patient['email'], patient['gender'], patient['blood_group']),
+                         ('ann@example.com', 'Female', 'AB+'))
+        self.assertEqual(patient['date_of_birth'], '1990-12-31')
+        self.assertIn('an', patient['search']['prefixes'])
+        for row in ({'first_name': 'A', 'last_name': 'B'},
+                    {'first_name': 'A', 'last_name': 'B', 'email': 'nope'},
+                    {'first_name': 'A', 'last_name': 'B', 'email': 'a@b.co', 'gender': 'x'}):
+            with self.assertRaises(RowError):
+                normalize_patient(row)
+
+    def test_upload_upserts_on_email_in_one_batch(self):
+        upload = SimpleUploadedFile('patients.csv', (
+            'first_name,last_name,email,gender\n'
+            'Ann,Lee,ANN@example.com,F\n'
+            'Bob,Ray,bob@example.com,M\n'
+            'Bad,Row,,M\n'
+        ).encode())
+        response = self.client.post(reverse('import-patients'), {'file': upload})
+        report = response.context['report']
+        self.assertEqual((report.rows, report.inserted, report.updated, report.invalid), (3, 1, 1, 1))
+        self.assertEqual(report.batches[0]['errors'][0]['line'], 4)
+        self.assertEqual(self.patients.calls, ['bulk_write'])
+        self.assertEqual(self.counters.calls, ['find_one_and_update'])
+
+        ann, bob = self.patients.documents
+        self.assertEqual((ann['patient_id'], ann['first_name']), ('PAT000001', 'Ann'))
+        self.assertTrue(bob['patient_id'].startswith('PAT'))
+        self.assertNotEqual(bob['patient_id'], 'PAT000001')
+
+    def test_reimport_keeps_fields_the_row_leaves_blank(self):
+        ann = self.patients.documents[0]
+        ann.update(phone='555-0100', blood_group='O+', search=search_fields(dict(ann, phone='555-0100')))
+        report = import_patients(read_rows(io.StringIO(
+            'first_name,last_name,email,phone,blood_group\n'
+            'Ann,Lee,ann@example.com,,\n'
+            'Bob,Ray,bob@example.com,,\n'
+        ), 'csv'), self.patients, views.patient_ids)
+        self.assertEqual((report.inserted, report.updated), (1, 1))
+        ann, bob = self.patients.documents
+        self.assertEqual((ann['first_name'], ann['phone'], ann['blood_group']), ('Ann', '555-0100', 'O+'))
+        self.assertEqual((ann['search']['names'], ann['search']['phone']), ('ann lee', '5550100'))
+        self.assertEqual((bob['phone'], bob['blood_group'], bob['search']['phone']), ('', '', ''))
+
+    def test_import_resumes_after_checkpoint(self):
+        lines = [json.dumps({'first_name': f'P{i}', 'last_name': 'X', 'email': f'p{i}@example.com'})
+                 for i in range(5)]
+        checkpoints = []
+        report = import_patients(read_rows(io.StringIO('\n'.join(lines)), 'jsonl'), self.patients,
+                                 views.patient_ids, batch_size=2, start_after=2,
+                                 on_batch=lambda r: checkpoints.append(r.last_line))
+        self.assertEqual(checkpoints, [4, 5])
+        self.assertEqual((report.rows, report.inserted), (3, 3))
+        self.assertEqual(sorted(p['first_name'] for p in self.patients.documents)[1:], ['P2', 'P3', 'P4'])
+
+
+# ===== EXPORT =====
+class ExportTests(MongoViewTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patients = make_people(3, 'Patient')
+        doctors = make_people(2, 'Doctor')
+        appointments = make_appointments(patients, doctors, 5)
+        for i, appointment in enumerate(appointments):
+            appointment['appointment_date'] = datetime(2025, 1, i + 1)
+        self.use_collections(patients, doctors, appointments)
+
+    def _content(self, response):
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_csv_export_filters_projects_and_names(self):
+        response = self.client.get(reverse('export-data', args=['appointments']), {
+            'from': '2025-01-02', 'to': '2025-01-04', 'fields': 'appointment_id,patient_name,doctor_name',
+        })
+        lines = self._content(response).decode().splitlines()
+        self.assertEqual(lines[0], 'appointment_id,patient_name,doctor_name')
+        self.assertEqual(lines[1], 'APT000002,Patient1 Test,Dr. Doctor1 Test')
+        self.assertEqual(len(lines), 4)
+
+    def test_names_are_looked_up_once_per_batch(self):
+        fields = export.export_fields('appointments')
+        chunks = list(export.export_chunks('appointments', 'jsonl', self.appointments, fields,
+                                           patients_collection=self.patients, doctors_collection=self.doctors,
+                                           batch_size=2))
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(len(self.patients.calls) + len(self.doctors.calls), 6)
+        self.assertEqual(self.appointments.calls, ['find'])
+
+    def test_gzip_jsonl_and_bad_requests(self):
+        response = self.client.get(reverse('export-data', args=['patients']), {'format': 'jsonl', 'gzip': '1'})
+        self.assertTrue(response['Content-Disposition'].endswith('.jsonl.gz"'))
+        rows = [json.loads(line) for line in gzip.decompress(self._content(response)).splitlines()]
+        self.assertEqual([row['first_name'] for row in rows], ['Patient0', 'Patient1', 'Patient2'])
+
+        url = reverse('export-data', args=['patients'])
+        self.assertEqual(self.client.get(url, {'fields': 'password'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'from': 'yesterday'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('export-data', args=['users'])).status_code, 404)
+
+    @skipUnless(export.pyarrow, 'pyarrow is not installed')
+    def test_parquet_row_group_per_batch(self):
+        fields = ['appointment_id', 'appointment_date', 'created_at']
+        data = b''.join(export.export_chunks('appointments', 'parquet', self.appointments, fields, batch_size=2))
+        parquet = export.pyarrow.parquet.ParquetFile(io.BytesIO(data))
+        self.assertEqual(parquet.metadata.num_row_groups, 3)
+        self.assertEqual(parquet.read().column('appointment_id').to_pylist()[0], 'APT000001')
+
+
+# ===== SLOT AVAILABILITY =====
+class SlotBookingTests(MongoViewTestCase):
+
+    def setUp(self):
+        super().setUp()
+        doctor_cache.get_cache().clear()
+        self.patient = make_people(1, 'Patient')[0]
+        self.cardiologists = [dict(d, specialization='Cardiology', department='Heart', doctor_id=f'DOC00000{i}')
+                        for i, d in enumerate(make_people(2, 'Doc'))]
+        # The second cardiologist only works afternoons
+        self.cardiologists[1]['working_slots'] = scheduling.SLOTS[3:]
+        self.use_collections([self.patient], self.cardiologists)
+
+    def _book(self, doctor, slot, day='2030-01-07'):
+        return self.client.post(reverse('book-appointment'), {
+            'patient_id': str(self.patient['_id']), 'doctor_id': str(doctor['_id']),
+            'appointment_date': day, 'time_slot': slot, 'purpose': 'Consultation',
+        })
+
+    def test_free_and_earliest_slots(self):
+        first, second = self.cardiologists
+        for slot in scheduling.SLOTS[:4]:
+            self.assertEqual(self._book(first, slot).status_code, 302)
+
+        response = self.client.get(reverse('doctor-slots', args=[first['_id']]), {'date': '2030-01-07'})
+        self.assertEqual(response.json()['free_slots'], scheduling.SLOTS[4:])
+        response = self.client.get(reverse('earliest-slot'), {'specialization': 'Cardiology', 'from': '2030-01-07'})
+        self.assertEqual(response.json()['slot']['time_slot'], scheduling.SLOTS[3])
+        self.assertEqual(response.json()['slot']['doctor_id'], str(second['_id']))
+        self.assertEqual(self.schedules.calls.count('find'), 1)
+
+    def test_double_booking_is_rejected(self):
+        doctor = self.cardiologists[0]
+        self.assertEqual(self._book(doctor, scheduling.SLOTS[0]).status_code, 302)
+        response = self._book(doctor, scheduling.SLOTS[0])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'already booked')
+        response = self._book(self.cardiologists[1], scheduling.SLOTS[0])
+        self.assertContains(response, 'does not work')
+        self.assertEqual(len(self.appointments.documents), 1)
+        self.assertEqual(self.appointments.documents[0]['appointment_date'], datetime(2030, 1, 7))
+
+    def test_rejected_bookings_use_no_ids_and_archived_patients_cannot_book(self):
+        doctor = self.cardiologists[0]
+        self._book(doctor, scheduling.SLOTS[0])
+        self._book(doctor, scheduling.SLOTS[0])
+        self._book(self.cardiologists[1], scheduling.SLOTS[0])
+
+        self.patients.documents[0]['archived'] = True
+        response = self._book(doctor, scheduling.SLOTS[1])
+        self.assertContains(response, 'Patient not found.')
+        self.assertEqual(scheduling.free_slots(doctor, '2030-01-07'), scheduling.SLOTS[1:])
+
+        self.patients.documents[0]['archived'] = False
+        self.assertEqual(self._book(doctor, scheduling.SLOTS[1]).status_code, 302)
+        self.assertEqual([a['appointment_id'] for a in self.appointments.documents], ['APT000001', 'APT000002'])
+
+    def test_cancel_and_delete_release_the_slot(self):
+        doctor = self.cardiologists[0]
+        self._book(doctor, scheduling.SLOTS[0])
+        appointment = self.appointments.documents[0]
+        self.client.post(reverse('update-appointment', args=[appointment['_id']]), {
+            'patient_id': str(self.patient['_id']), 'doctor_id': str(doctor['_id']),
+            'appointment_date': '2030-01-07', 'time_slot': scheduling.SLOTS[0], 'status': 'Cancelled',
+        })
+        self.assertEqual(scheduling.free_slots(doctor, '2030-01-07'), scheduling.SLOTS)
+
+        self._book(doctor, scheduling.SLOTS[0])
+        self.client.post(reverse('delete-appointment', args=[self.appointments.documents[-1]['_id']]))
+        self.assertEqual(scheduling.free_slots(doctor, '2030-01-07'), scheduling.SLOTS)
+
+    def test_failed_update_gives_the_original_slot_back(self):
+        doctor = self.cardiologists[0]
+        self._book(doctor, scheduling.SLOTS[0])
+        appointment = self.appointments.documents[0]
+        with mock.patch.object(self.appointments, 'update_one', side_effect=RuntimeError('write failed')):
+            with self.assertRaises(RuntimeError):
+                self.client.post(reverse('update-appointment', args=[appointment['_id']]), {
+                    'patient_id': str(self.patient['_id']), 'doctor_id': str(doctor['_id']),
+                    'appointment_date': '2030-01-07', 'time_slot': scheduling.SLOTS[1], 'status': 'Scheduled',
+                })
+        self.assertEqual(scheduling.free_slots(doctor, '2030-01-07'), scheduling.SLOTS[1:])
+
+    def test_concurrent_reservations_never_double_book(self):
+        doctor_id = self.cardiologists[0]['_id']
+        attempts = [scheduling.SLOTS[i % 3] for i in range(60)]
+
+        def attempt(slot):
+            try:
+                scheduling.reserve(doctor_id, '2030-01-07', slot)
+                return slot
+            except scheduling.SlotUnavailable:
+                return None
+
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            won = [slot for slot in pool.map(attempt, attempts) if slot]
+        self.assertEqual(sorted(won), sorted(scheduling.SLOTS[:3]))
+        schedule, = self.schedules.documents
+        self.assertEqual(sorted(schedule['booked']), sorted(scheduling.SLOTS[:3]))
+
+    def test_first_reservations_of_a_day_racing_for_different_slots_both_win(self):
+        doctor_id = self.cardiologists[0]['_id']
+        update_one = self.schedules.update_one
+
+        def race(criteria, update, upsert=False):
+            if upsert:
+                # Another request creates the day's document between our filter and our insert
+                self.schedules.insert_one({'doctor_id': doctor_id, 'date': '2030-01-07',
+                                           'booked': [scheduling.SLOTS[1]]})
+                raise DuplicateKeyError('E11000 duplicate key error')
+            return update_one(criteria, update)
+
+        with mock.patch.object(self.schedules, 'update_one', side_effect=race):
+            scheduling.reserve(doctor_id, '2030-01-07', scheduling.SLOTS[0])
+        schedule, = self.schedules.documents
+        self.assertEqual(schedule['booked'], [scheduling.SLOTS[1], scheduling.SLOTS[0]])
+        with self.assertRaises(scheduling.SlotUnavailable):
+            scheduling.reserve(doctor_id, '2030-01-07', scheduling.SLOTS[1])
+
+
+# ===== APPOINTMENT FORM PICKERS =====
+class AppointmentPickerTests(MongoViewTestCase):
+
+    def setUp(self):
+        super().setUp()
+        doctor_cache.get_cache().clear()
+        patients = make_people(300, 'Patient')
+        for number, patient in enumerate(patients, 1):
+            patient['patient_id'] = f'PAT{number:06d}'
+            patient['search'] = search_fields(patient)
+        doctors = [dict(d, specialization='Cardiology' if i % 2 else 'Neurology', doctor_id=f'DOC{i:06d}')
+                   for i, d in enumerate(make_people(40, 'Doctor'))]
+        self.use_collections(patients, doctors, make_appointments(patients, doctors, 1))
+
+    def test_forms_cost_the_same_whatever_the_registry_size(self):
+        with self.assertMaxMongoQueries(0):
+            response = self.client.get(reverse('book-appointment'))
+        self.assertNotContains(response, 'Patient299')
+        self.assertContains(response, reverse('patient-lookup'))
+
+        appointment = self.appointments.documents[0]
+        # The appointment, its patient and the (then cached) doctor options
+        with self.assertMaxMongoQueries(3):
+            response = self.client.get(reverse('update-appointment', args=[appointment['_id']]))
+        self.assertEqual(response.context['patient_choice']['id'], str(appointment['patient_id']))
+        self.assertEqual(response.context['doctor_choice']['id'], str(appointment['doctor_id']))
+        self.assertContains(response, 'PAT000001 - Patient0 Test')
+        self.assertNotContains(response, 'Patient299')
+
+    def test_lookups_return_the_top_projected_matches(self):
+        response = self.client.get(reverse('patient-lookup'), {'q': 'patient29'})
+        results = response.json()['results']
+        self.assertEqual(len(results), views.LOOKUP_LIMIT)
+        self.assertTrue(all(' - Patient29' in result['label'] for result in results))
+        self.assertEqual(self.patients.calls.count('find'), 1)
+        self.assertEqual(self.client.get(reverse('patient-lookup'), {'q': 'PAT000007'}).json()['results'][0]['label'],
+                         'PAT000007 - Patient6 Test')
+        self.assertEqual(self.client.get(reverse('patient-lookup')).json()['results'], [])
+
+        self.client.get(reverse('doctor-lookup'), {'q': 'neuro'})
+        with self.assertMaxMongoQueries(0):
+            results = self.client.get(reverse('doctor-lookup'), {'q': 'doctor1 cardio'}).json()['results']
+        self.assertEqual([result['label'] for result in results][:2],
+                         ['Dr. Doctor1 Test - Cardiology', 'Dr. Doctor11 Test - Cardiology'])
+        self.assertEqual(results[0]['slots_url'], reverse('doctor-slots', args=[results[0]['id']]))
+
+
+# ===== TYPED APPOINTMENT DATES =====
+class AppointmentDateTests(MongoViewTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patients = make_people(2, 'Patient')
+        doctors = make_people(1, 'Doctor')
+        appointments = make_appointments(patients, doctors, 10)
+        for i, appointment in enumerate(appointments):
+            appointment['appointment_date'] = datetime(2025, 3, i + 1)
+            appointment['status'] = 'Cancelled' if i % 2 else 'Scheduled'
+        self.use_collections(patients, doctors, appointments)
+
+    def test_range_filters(self):
+        url = reverse('search-appointments')
+        self.assertEqual(self.client.get(url, {'from': '2025-03-03', 'to': '2025-03-06'}).context['total_results'], 4)
+        self.assertEqual(self.client.get(url, {'from': '2025-03-08'}).context['total_results'], 3)
+        response = self.client.get(url, {'to': '2025-03-06', 'status': 'Scheduled'})
+        self.assertEqual(response.context['total_results'], 3)
+        self.assertEqual(self.client.get(url, {'date': '2025-03-10'}).context['total_results'], 1)
+        self.assertEqual(self.client.get(url, {'from': 'garbage'}).context['total_results'], 10)
+
+    def test_migration_converts_strings_in_place(self):
+        self.appointments.documents[0]['appointment_date'] = '2025-04-01'
+        self.appointments.documents[1]['appointment_date'] = 'someday'
+        with mock.patch('hospital_app.management.commands.migrate_appointment_dates.appointments_collection',
+                        self.appointments):
+            call_command('migrate_appointment_dates', batch_size=1, stdout=io.StringIO())
+        self.assertEqual(self.appointments.documents[0]['appointment_date'], datetime(2025, 4, 1))
+        self.assertEqual(self.appointments.documents[1]['appointment_date'], 'someday')
+        self.assertEqual(self.appointments.calls.count('bulk_write'), 1)
+
+
+# ===== MONGO PROFILER =====
+class MongoProfilerTests(MongoViewTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patients = make_people(5, 'Patient')
+        doctors = make_people(2, 'Doctor')
+        self.use_collections(patients, doctors, make_appointments(patients, doctors, 12))
+
+    def test_headers_report_request_queries(self):
+        response = self.client.get(reverse('appointment-list'))
+        self.assertEqual(response['X-Mongo-Queries'], str(self.query_count()))
+        self.assertIn('X-Mongo-Time', response)
+
+    def test_assert_max_mongo_queries(self):
+        with self.assertMaxMongoQueries(4) as profile:
+            self.client.get(reverse('appointment-list'))
+        self.assertEqual({q.collection for q in profile.records},
+                         {'change_versions', 'appointments', 'patients', 'doctors'})
+        caches[versions.FRAGMENT_CACHE].clear()
+        with self.assertRaises(AssertionError):
+            with self.assertMaxMongoQueries(3):
+                self.client.get(reverse('appointment-list'))
+
+    def test_listener_records_commands_and_slow_requests(self):
+        command = {'find': 'patients', 'filter': {}, 'lsid': {}}
+        started = mock.Mock(command_name='find', command=command, connection_id=('h', 1), request_id=7)
+        succeeded = mock.Mock(command_name='find', connection_id=('h', 1), request_id=7, duration_micros=2500,
+                              reply={'cursor': {'firstBatch': [{}, {}]}})
+        with profiling.profiled() as profile:
+            profiling.profiler.started(started)
+            profiling.profiler.succeeded(succeeded)
+        query, = profile.records
+        self.assertEqual((query.collection, query.operation, query.duration_ms, query.documents),
+                         ('patients', 'find', 2.5, 2))
+        # Commands are only kept when they are going to be explained
+        self.assertIsNone(query.command)
+        with profiling.profiled(explain=True) as profile:
+            profiling.profiler.started(started)
+            profiling.profiler.succeeded(succeeded)
+        query, = profile.records
+        db = mock.Mock()
+        db.command.return_value = {'queryPlanner': {'winningPlan': {'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN'}}}}
+        profiling.explain_records(profile, db)
+        self.assertEqual(query.plan, 'INDEXED')
+        self.assertNotIn('lsid', db.command.call_args.args[1])
+
+        with self.settings(DEBUG=False), mock.patch.object(profiling, 'SLOW_REQUEST_MS', -1):
+            with self.assertLogs('hospital_app.profiling', 'WARNING') as logs:
+                self.client.get(reverse('patient-list'))
+        self.assertIn('Slow request GET /patients/', logs.output[0])
+
+    @mock.patch.object(profiling, 'explain_records')
+    def test_debug_panel(self, explain_records):
+        with self.settings(DEBUG=True, HOSPITAL_MONGO_PANEL=True):
+            response = self.client.get(reverse('patient-list'))
+        self.assertContains(response, 'id="mongo-profiler"')
+        explain_records.assert_called_once()
+
+
+# ===== METRICS =====
+class MetricsTests(MongoViewTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patients = make_people(3, 'Patient')
+        doctors = make_people(2, 'Doctor')
+        self.use_collections(patients, doctors, make_appointments(patients, doctors, 4))
+
+    def test_histogram_renders_cumulative_buckets(self):
+        histogram = metrics.Histogram('test_seconds', 'Test.', ('view',), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 3.0):
+            histogram.observe(value, ('a"b',))
+        families = {'test_seconds': {'kind': 'histogram', 'help': 'Test.', 'labelnames': ['view'],
+                                     'buckets': [0.1, 1.0], 'series': histogram.snapshot()}}
+        text = metrics.render(families)
+        self.assertIn('test_seconds_bucket{view="a\\"b",le="0.1"} 1', text)
+        self.assertIn('test_seconds_bucket{view="a\\"b",le="1.0"} 3', text)
+        self.assertIn('test_seconds_bucket{view="a\\"b",le="+Inf"} 4', text)
+        self.assertIn('test_seconds_sum{view="a\\"b"} 4.05', text)
+        self.assertIn('test_seconds_count{view="a\\"b"} 4', text)
+
+    def test_endpoint_reports_requests_by_url_name(self):
+        self.client.get(reverse('patient-list'))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode()
+        self.assertIn('hospital_http_request_duration_seconds_count{view="patient-list",method="GET",status="200"}',
+                      text)
+        self.assertIn('template="hospital_app/patient_list.html"', text)
+        self.assertIn('hospital_cache_hit_ratio{cache="doctors"}', text)
+        self.assertIn('# TYPE hospital_mongo_pool_checked_out gauge', text)
+
+        with self.settings(HOSPITAL_METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+            response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+            self.assertEqual(response.status_code, 200)
+
+    def test_multiprocess_files_are_summed(self):
+        def worker(pid, value, checked_out):
+            return {'pid': pid, 'families': {
+                'hospital_http_request_duration_seconds': {
+                    'kind': 'histogram', 'help': 'Request latency by URL name.',
+                    'labelnames': ['view', 'method', 'status'], 'buckets': list(metrics.LATENCY_BUCKETS),
+                    'series': [[['home', 'GET', '200'], [1] + [0] * len(metrics.LATENCY_BUCKETS) + [value]]]},
+                'hospital_mongo_pool_checked_out': {
+                    'kind': 'gauge', 'help': 'Connections currently in use.', 'labelnames': [], 'buckets': [],
+                    'series': [[[], checked_out]]},
+            }}
+
+        with tempfile.TemporaryDirectory() as directory:
+            for pid, value, checked_out in ((101, 0.001, 2), (102, 0.002, 5)):
+                with open(f'{directory}/{pid}.json', 'w') as output:
+                    json.dump(worker(pid, value, checked_out), output)
+            with mock.patch.object(metrics, '_pid_alive', lambda pid: pid != 102):
+                families = metrics.collect(directory)
+            self.assertTrue(os.path.exists(f'{directory}/{os.getpid()}.json'))
+
+        home = families['hospital_http_request_duration_seconds']['series'][('home', 'GET', '200')]
+        self.assertEqual(home[0], 2)
+        self.assertAlmostEqual(home[-1], 0.003)
+        # The exited worker's gauge is dropped; this process contributes its own
+        self.assertEqual(families['hospital_mongo_pool_checked_out']['series'][()],
+                         2 + mongo.pool_stats.snapshot()['checked_out'])
+
+    def test_observe_overhead(self):
+        histogram = metrics.Histogram('overhead_seconds', 'Test.', ('view', 'method', 'status'))
+        labels = ('home', 'GET', '200')
+        started = time.perf_counter()
+        for _ in range(10000):
+            histogram.observe(0.003, labels)
+        per_call = (time.perf_counter() - started) / 10000
+        # A few microseconds normally; generous to stay stable on slow CI
+        self.assertLess(per_call, 50e-6)
+
+    def test_template_renders_are_timed_once_without_patching_django(self):
+        from django.template import engines
+        from django.template.backends import django as django_backend
+        render = django_backend.Template.render
+        metrics.install()
+        metrics.install()
+        self.assertIs(django_backend.Template.render, render)
+
+        template = engines['django'].from_string('{{ value }}')
+        template.origin.template_name = 'timed.html'
+        self.assertEqual(template.render({'value': 1}), '1')
+        series = metrics.template_duration.snapshot()[('timed.html',)]
+        self.assertEqual(sum(series[:-1]), 1)
+
+
+# ===== SYNTHETIC DATA AND BENCHMARKS =====
+class SyntheticDataTests(TestCase):
+
+    def setUp(self):
+        self.data = synthetic.HospitalData(patients=40, doctors=3, appointments=200, seed=7,
+                                           start=datetime(2025, 1, 1), days=10)
+
+    def test_generation_is_reproducible_and_conflict_free(self):
+        database = MemoryDatabase()
+        inserted = synthetic.load(database, self.data, batch_size=16)
+        self.assertEqual((inserted['patients'], inserted['doctors'], inserted['appointments']), (40, 3, 200))
+
+        again = synthetic.HospitalData(patients=40, doctors=3, appointments=200, seed=7,
+                                       start=datetime(2025, 1, 1), days=10)
+        appointments = database['appointments'].documents
+        self.assertEqual(appointments, [dict(a) for batch, _ in again.appointment_batches(16) for a in batch])
+
+        patient_ids = {p['_id'] for p in database['patients'].documents}
+        self.assertTrue(all(a['patient_id'] in patient_ids for a in appointments))
+        active = [a for a in appointments if a['status'] not in scheduling.INACTIVE_STATUSES]
+        positions = {(a['doctor_id'], a['appointment_date'], a['time_slot']) for a in active}
+        self.assertEqual(len(positions), len(active))
+        # 67 appointments per doctor don't fit 10 days x 6 slots, so the window widens
+        self.assertEqual(self.data.days, 12)
+
+        booked = {(s['doctor_id'], s['date'], slot) for s in database['doctor_schedules'].documents
+                  for slot in s['booked']}
+        self.assertEqual(booked, {(d, scheduling.day_key(day), slot) for d, day, slot in positions})
+        self.assertEqual(database['counters'].find_one({'_id': 'appointment_id'})['seq'], 200)
+
+    def test_benchmark_async_views_runs_without_a_server(self):
+        out = io.StringIO()
+        call_command('benchmark_async_views', '--requests', '2', '--concurrency', '2', '--latency-ms', '0',
+                     stdout=out)
+        lines = out.getvalue().splitlines()[1:]
+        views_run = ('patient_list', 'appointment_list', 'search_appointments', 'search_doctors', 'staff_dashboard')
+        self.assertEqual([line.split()[:2] for line in lines],
+                         [[view, mode] for view in views_run for mode in ('sync', 'async')])
+
+    def test_benchmark_views_writes_baseline(self):
+        out = io.StringIO()
+        with tempfile.TemporaryDirectory() as directory:
+            path = f'{directory}/baseline.json'
+            call_command('benchmark_views', '--in-memory', '--patients', '20', '--doctors', '2',
+                         '--appointments', '20', '--requests', '2', '--warmup', '0',
+                         '--endpoint', 'patient-list', '--endpoint', 'export-data', '--endpoint', 'staff_dashboard',
+                         '--endpoint', 'api-changes', '--output', path, stdout=out)
+            with open(path) as source:
+                baseline = json.load(source)
+        self.assertEqual(set(baseline['endpoints']),
+                         {'patient-list', 'export-data[patients]', 'export-data[appointments]', 'api-changes'})
+        # The change feed reads the in-memory data too, instead of probing a server
+        self.assertEqual(baseline['endpoints']['api-changes']['status'], '200')
+        self.assertIn('Skipping staff_dashboard: it runs an aggregation pipeline', out.getvalue())
+        patient_list = baseline['endpoints']['patient-list']
+        # The first request reads versions and the page, the second only the versions
+        self.assertEqual((patient_list['status'], patient_list['requests'], patient_list['queries_max']),
+                         ('200', 2, 2))
+
+        slower = json.loads(json.dumps(baseline))
+        slower['endpoints']['patient-list']['p95_ms'] = patient_list['p95_ms'] * 2 + 1
+        rows = {row[0]: row[4] for row in benchmarking.compare_baselines(baseline, slower)}
+        self.assertTrue(rows['patient-list'])
+        self.assertFalse(rows['export-data[patients]'])
+
+
+# ===== CONDITIONAL LIST PAGES =====
+class ConditionalListTests(MongoViewTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patients = make_people(3, 'Patient')
+        doctors = make_people(2, 'Doctor')
+        self.use_collections(patients, doctors, make_appointments(patients, doctors, 4))
+
+    def test_unchanged_list_is_not_modified(self):
+        url = reverse('appointment-list')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        with self.assertMaxMongoQueries(1) as profile:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(profile.records[0].collection, 'change_versions')
+
+        # A patient rename shows up in the appointment list
+        self.client.post(reverse('update-patient', args=[self.patients.documents[0]['_id']]),
+                         {'first_name': 'Renamed', 'last_name': 'Patient'})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'Renamed Patient')
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_rows_are_cached_and_shared_with_their_own_csrf_token(self):
+        url = reverse('patient-list')
+        first = self.client.get(url)
+        self.assertContains(first, 'Patient0')
+
+        other = User.objects.create_user('other', password='s3cret-pass')
+        self.client.force_login(other)
+        with self.assertMaxMongoQueries(1):
+            second = self.client.get(url)
+        self.assertContains(second, 'Patient0')
+        self.assertNotContains(second, versions.CSRF_PLACEHOLDER)
+        self.assertNotEqual(first['ETag'], second['ETag'])
+
+        self.client.post(reverse('add-patient'), {'first_name': 'Newest', 'last_name': 'Patient'})
+        self.assertContains(self.client.get(url), 'Newest')
+
+    def test_async_list_is_not_modified(self):
+        patcher = mock.patch.object(async_views, 'doctors_collection', AsyncMemoryCollection(self.doctors))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        user = self.user
+
+        async def auser():
+            return user
+
+        def get(**headers):
+            request = RequestFactory().get(reverse('doctor-list'), **headers)
+            request.auser = auser
+            # What CsrfViewMiddleware reads from the browser's cookie
+            request.META['CSRF_COOKIE'] = 'x' * 32
+            return async_to_sync(async_views.doctor_list)(request)
+
+        response = get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(get(HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+
+# ===== COMPACT ROWS =====
+class RowTests(MongoViewTestCase):
+
+    def test_rows_decode_straight_from_bson(self):
+        document = {'_id': ObjectId(), 'appointment_id': 'APT000001', 'status': 'Scheduled'}
+        row = bson.decode(bson.encode(document), CodecOptions(document_class=AppointmentRow))
+        self.assertIsInstance(row, AppointmentRow)
+        self.assertEqual(dict(row), document)
+        self.assertEqual(row.id, str(document['_id']))
+        self.assertIsNone(row.get('purpose'))
+        row['patient_name'] = 'Jane Doe'
+        self.assertEqual(pickle.loads(pickle.dumps(row)), row)
+        with self.assertRaises(KeyError):
+            row['notes'] = 'not a list column'
+
+    def test_missing_fields_render_empty(self):
+        row = DoctorRow({'_id': ObjectId(), 'first_name': 'Gregory'})
+        rendered = Template('{{ d.first_name }}|{{ d.availability }}|{{ d.keys }}').render(Context({'d': row}))
+        self.assertEqual(rendered.split('|')[:2], ['Gregory', ''])
+
+    def test_list_pages_fetch_only_shown_fields(self):
+        patients = make_people(3, 'Patient')
+        for patient in patients:
+            patient.update(address='12 Private Road', search={'prefixes': ['pa']})
+        doctors = make_people(1, 'Doctor')
+        self.use_collections(patients, doctors, make_appointments(patients, doctors, 2))
+        response = self.client.get(reverse('search-patients'))
+        self.assertEqual(len(response.context['patients']), 3)
+        for patient in response.context['patients']:
+            self.assertIsInstance(patient, PatientRow)
+            self.assertNotIn('address', patient)
+        self.assertContains(response, 'Patient0')
+        self.assertContains(self.client.get(reverse('appointment-list')), 'Patient0 Test')
+
+
+# ===== JSON API =====
+class JsonApiTests(MongoViewTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patients = make_people(3, 'Patient')
+        for number, patient in enumerate(patients, 1):
+            patient.update(patient_id=f'PAT{number:06d}', email=f'patient{number}@example.com')
+        doctors = make_people(2, 'Doctor')
+        self.use_collections(patients, doctors, make_appointments(patients, doctors, 23))
+        self.counters.documents.append({'_id': 'patient_id', 'seq': 3})
+
+    def post(self, url, body, **headers):
+        return self.client.post(url, encoding.dumps(body), content_type='application/json', **headers)
+
+    def test_cursor_walks_every_record_once_with_sparse_fields(self):
+        url = reverse('api-list', args=['appointments']) + '?page_size=10&fields=status,appointment_date'
+        seen, requests = [], 0
+        while url:
+            response = self.client.get(url)
+            requests += 1
+            self.assertEqual(response.status_code, 200)
+            body = json.loads(response.content)
+            seen.extend(body['data'])
+            url = body['next']
+        self.assertEqual(requests, 3)
+        self.assertEqual(sorted(record['id'] for record in seen),
+                         sorted(str(a['_id']) for a in self.appointments.documents))
+        self.assertEqual(set(seen[0]), {'id', 'appointment_id', 'status', 'appointment_date'})
+        self.assertEqual(seen[0]['appointment_date'], '2025-01-01T00:00:00+00:00')
+
+        response = self.client.get(reverse('api-list', args=['appointments']) + '?fields=address')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Unknown fields', json.loads(response.content)['error'])
+
+    def test_partners_authenticate_with_a_bearer_token(self):
+        url = reverse('api-list', args=['doctors'])
+        self.assertEqual(self.client.get(reverse('api-list', args=['nurses'])).status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.client.get(url).status_code, 401)
+        with override_settings(HOSPITAL_API_TOKENS=['lab-token']):
+            self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer lab-token').status_code, 200)
+            self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+
+    def test_batch_get_uses_one_query_and_keeps_request_order(self):
+        first, second = self.patients.documents[:2]
+        ids = [second['patient_id'], str(first['_id']), 'PAT999999']
+        with self.assertMaxMongoQueries(1):
+            response = self.post(reverse('api-batch-get', args=['patients']), {'ids': ids, 'fields': ['email']})
+        body = json.loads(response.content)
+        self.assertEqual([record['email'] for record in body['data']], [second['email'], first['email']])
+        self.assertEqual(body['missing'], ['PAT999999'])
+        self.assertEqual(self.client.get(reverse('api-batch-get', args=['patients'])).status_code, 405)
+
+    def test_batch_write_is_one_bulk_write_with_a_report_per_record(self):
+        records = [
+            {'first_name': 'New', 'last_name': 'Patient', 'email': 'New@Example.com'},
+            {'patient_id': 'PAT000001', 'first_name': 'Renamed', 'last_name': 'Test', 'email': 'patient1@example.com'},
+            {'first_name': 'No', 'last_name': 'Email'},
+            {'patient_id': 'PAT999999', 'first_name': 'Ghost', 'last_name': 'Test', 'email': 'ghost@example.com'},
+        ]
+        response = self.post(reverse('api-batch', args=['patients']), {'records': records})
+        body = json.loads(response.content)
+        self.assertEqual([item['status'] for item in body['results']], ['created', 'updated', 'error', 'error'])
+        self.assertEqual(body['results'][0]['patient_id'], 'PAT000004')
+        self.assertEqual(body['summary'], {'created': 1, 'updated': 1, 'error': 2})
+        self.assertEqual(self.patients.calls.count('bulk_write'), 1)
+        self.assertEqual(self.patients.find_one({'patient_id': 'PAT000001'})['first_name'], 'Renamed')
+        self.assertEqual(self.versions.find_one({'_id': 'patients'})['version'], 1)
+
+        # Retrying the batch updates the patient it created instead of adding another
+        body = json.loads(self.post(reverse('api-batch', args=['patients']), {'records': records[:1]}).content)
+        self.assertEqual(body['results'][0]['status'], 'updated')
+        self.assertEqual(self.patients.count_documents({'email': 'new@example.com'}), 1)
+
+    def test_patient_batch_update_keeps_fields_the_record_leaves_out(self):
+        patient = self.patients.documents[0]
+        patient.update(phone='555-0100', address='1 Main St', blood_group='O+', gender='Female',
+                       date_of_birth='1990-01-31', emergency_contact='555-0199')
+        records = [{'patient_id': 'PAT000001', 'phone': '555-9999'}]
+        body = json.loads(self.post(reverse('api-batch', args=['patients']), {'records': records}).content)
+        self.assertEqual(body['results'][0]['status'], 'updated')
+        stored = self.patients.find_one({'patient_id': 'PAT000001'})
+        self.assertEqual((stored['phone'], stored['address'], stored['blood_group'], stored['gender']),
+                         ('555-9999', '1 Main St', 'O+', 'Female'))
+        self.assertEqual((stored['date_of_birth'], stored['emergency_contact'], stored['email']),
+                         ('1990-01-31', '555-0199', 'patient1@example.com'))
+        self.assertEqual((stored['search']['phone'], stored['search']['names']), ('5559999', 'patient0 test'))
+
+        records = [{'patient_id': 'PAT000001', 'first_name': ''}, {'patient_id': 'PAT000002', 'gender': 'x'}]
+        body = json.loads(self.post(reverse('api-batch', args=['patients']), {'records': records}).content)
+        self.assertEqual([item['error'] for item in body['results']],
+                         ['missing first_name', "invalid gender 'x'"])
+
+    def test_doctor_batch_update_keeps_fields_the_record_leaves_out(self):
+        doctor = self.doctors.documents[0]
+        doctor.update(doctor_id='DOC000001', email='doctor@example.com', specialization='Cardiology',
+                      department='Heart', experience=12, consultation_fee=150.0, status='Active')
+        records = [{'doctor_id': 'DOC000001', 'first_name': 'Renamed', 'last_name': 'Test', 'phone': '555-0100'}]
+        body = json.loads(self.post(reverse('api-batch', args=['doctors']), {'records': records}).content)
+        self.assertEqual(body['results'][0]['status'], 'updated')
+        stored = self.doctors.find_one({'doctor_id': 'DOC000001'})
+        self.assertEqual((stored['first_name'], stored['phone']), ('Renamed', '555-0100'))
+        self.assertEqual((stored['email'], stored['specialization'], stored['department']),
+                         ('doctor@example.com', 'Cardiology', 'Heart'))
+        self.assertEqual((stored['experience'], stored['consultation_fee'], stored['status']), (12, 150.0, 'Active'))
+
+        # A new doctor still needs an email
+        body = json.loads(self.post(reverse('api-batch', args=['doctors']),
+                                    {'records': [{'first_name': 'No', 'last_name': 'Email'}]}).content)
+        self.assertEqual(body['results'][0]['status'], 'error')
+
+    def test_appointment_batch_only_changes_slot_neutral_fields(self):
+        records = [
+            {'appointment_id': 'APT000001', 'status': 'Completed', 'notes': 'Results sent'},
+            {'appointment_id': 'APT000002', 'status': 'Cancelled'},
+            {'appointment_id': 'APT000003', 'time_slot': '02:00 PM - 03:00 PM'},
+            {'status': 'Confirmed'},
+        ]
+        body = json.loads(self.post(reverse('api-batch', args=['appointments']), {'records': records}).content)
+        self.assertEqual([item['status'] for item in body['results']], ['updated', 'error', 'error', 'error'])
+        self.assertEqual(self.appointments.find_one({'appointment_id': 'APT000001'})['notes'], 'Results sent')
+        self.assertEqual(self.appointments.find_one({'appointment_id': 'APT000002'})['status'], 'Scheduled')
+
+    def test_encoders_agree(self):
+        value = {'id': ObjectId(), 'at': datetime(2025, 1, 2, 3, 4, 5, 6000), 'fee': Decimal('12.50'),
+                 'name': 'Zoë'}
+        fast = encoding.dumps(value)
+        with mock.patch.object(encoding, 'orjson', None):
+            self.assertEqual(encoding.dumps(value), fast)
+        self.assertEqual(encoding.loads(fast)['fee'], '12.50')
+
+
+# ===== CHANGE FEED =====
+class FakeChangeStream:
+    def __init__(self, changes):
+        self.changes = list(changes)
+        self.resume_token = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def try_next(self):
+        if not self.changes:
+            return None
+        change = self.changes.pop(0)
+        self.resume_token = change['_id']
+        return change
+
+
+@mock.patch.object(changefeed, 'LAG_SECONDS', 0)
+class ChangeFeedTests(MongoViewTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patients = make_people(2, 'Patient')
+        for number, patient in enumerate(patients, 1):
+            patient.update(patient_id=f'PAT{number:06d}')
+        self.use_collections(patients, make_people(1, 'Doctor'))
+        self.counters.documents.append({'_id': 'patient_id', 'seq': 2})
+
+    def changes_url(self, **params):
+        query = '&'.join(f'{key}={value}' for key, value in params.items())
+        return reverse('api-changes') + '?wait=0' + (f'&{query}' if query else '')
+
+    def test_writes_reach_consumers_once_from_their_checkpoint(self):
+        # Documents written before the feed existed carry no updated_at
+        body = json.loads(self.client.get(self.changes_url()).content)
+        self.assertEqual(body['data'], [])
+        start = body['checkpoint']
+
+        patient = self.patients.documents[0]
+        self.client.post(reverse('update-patient', args=[patient['_id']]), {'first_name': 'Renamed', 'last_name': 'X'})
+        self.client.post(reverse('delete-patient', args=[self.patients.documents[1]['_id']]))
+        body = json.loads(self.client.get(self.changes_url(since=start)).content)
+        self.assertEqual([(e['collection'], e['operation'], e['key']) for e in body['data']],
+                         [('patients', 'upsert', 'PAT000001'), ('patients', 'upsert', 'PAT000002')])
+        self.assertEqual(body['data'][0]['document']['first_name'], 'Renamed')
+        # Deleting archives the patient
+        self.assertIs(body['data'][1]['document']['archived'], True)
+        self.assertNotIn('search', body['data'][0]['document'])
+        self.assertEqual(body['checkpoint'], body['data'][-1]['checkpoint'])
+
+        # From the first event's checkpoint only the archiving is left; from the end, nothing
+        body_after_first = json.loads(self.client.get(self.changes_url(since=body['data'][0]['checkpoint'])).content)
+        self.assertEqual([e['key'] for e in body_after_first['data']], ['PAT000002'])
+        self.assertEqual(json.loads(self.client.get(self.changes_url(since=body['checkpoint'])).content)['data'], [])
+
+        self.assertEqual(self.client.get(self.changes_url(since='garbage')).status_code, 400)
+
+    def test_server_keeps_consumer_checkpoints(self):
+        start = json.loads(self.client.get(self.changes_url(consumer='lab')).content)['checkpoint']
+        self.client.post(reverse('add-patient'), {'first_name': 'New', 'last_name': 'Patient'})
+        first = json.loads(self.client.get(self.changes_url(consumer='lab', since=start)).content)
+        self.assertEqual([e['key'] for e in first['data']], ['PAT000003'])
+        # Not acknowledged yet, so it comes again; acknowledged, it doesn't
+        again = json.loads(self.client.get(self.changes_url(consumer='lab')).content)
+        self.assertEqual([e['key'] for e in again['data']], ['PAT000003'])
+        self.client.get(self.changes_url(consumer='lab', since=again['checkpoint']))
+        self.assertEqual(json.loads(self.client.get(self.changes_url(consumer='lab')).content)['data'], [])
+
+    def test_server_sent_events_carry_checkpoints_as_ids(self):
+        self.client.post(reverse('add-patient'), {'first_name': 'New', 'last_name': 'Patient'})
+        response = self.client.get(self.changes_url(), HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = b''.join(response.streaming_content).decode()
+        event_id, event_type, data = stream.split('\n\n')[0].split('\n')
+        self.assertEqual(event_type, 'event: change')
+        self.assertEqual(json.loads(data[len('data: '):])['key'], 'PAT000003')
+        response = self.client.get(self.changes_url(), HTTP_ACCEPT='text/event-stream',
+                                   HTTP_LAST_EVENT_ID=event_id[len('id: '):])
+        self.assertNotIn('event: change', b''.join(response.streaming_content).decode())
+
+    def test_consume_changes_command_saves_its_checkpoint(self):
+        self.client.post(reverse('add-patient'), {'first_name': 'New', 'last_name': 'Patient'})
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'changes.jsonl')
+            call_command('consume_changes', consumer='billing', output=path, stderr=io.StringIO())
+            call_command('consume_changes', consumer='billing', output=path, stderr=io.StringIO())
+            with open(path) as lines:
+                events = [json.loads(line) for line in lines]
+        self.assertEqual([e['key'] for e in events], ['PAT000003'])
+        self.assertEqual(changefeed.read_changes(changefeed.load_checkpoint('billing'))[0], [])
+
+    def test_change_stream_source(self):
+        patient = self.patients.documents[0]
+        changes = [
+            {'_id': {'_data': '01'}, 'operationType': 'update', 'ns': {'db': 'hospital', 'coll': 'patients'},
+             'documentKey': {'_id': patient['_id']}, 'fullDocument': dict(patient, search={'names': []})},
+            {'_id': {'_data': '02'}, 'operationType': 'delete', 'ns': {'db': 'hospital', 'coll': 'doctors'},
+             'documentKey': {'_id': ObjectId()}},
+        ]
+        database = mock.Mock()
+        database.watch.return_value = FakeChangeStream(changes)
+        with mock.patch.object(changefeed, 'SOURCE', 'stream'), \
+                mock.patch.object(mongo, 'get_db', return_value=database):
+            events, end = changefeed.read_changes(limit=10, projections={'patients': {'patient_id': 1}})
+            self.assertEqual([event['operation'] for _, event in events], ['upsert', 'delete'])
+            self.assertEqual(events[0][1]['document'], {'patient_id': 'PAT000001'})
+            self.assertEqual(changefeed.decode_checkpoint(end)['r'], {'_data': '02'})
+
+            database.watch.return_value = FakeChangeStream([])
+            changefeed.read_changes(end)
+            self.assertEqual(database.watch.call_args.kwargs['resume_after'], {'_data': '02'})
+            # A watermark checkpoint can't resume a change stream
+            watermark = changefeed.encode_checkpoint({'s': 'watermark', 't': datetime(2025, 1, 1), 'id': None})
+            with self.assertRaises(changefeed.CheckpointError):
+                changefeed.read_changes(watermark)
+
+    def test_auto_source_falls_back_to_the_watermark_feed(self):
+        unreachable = mock.Mock()
+        unreachable.watch.side_effect = ServerSelectionTimeoutError('no servers')
+        with mock.patch.object(changefeed, 'SOURCE', 'auto'), mock.patch.object(changefeed, '_detected_source', None):
+            with mock.patch.object(mongo, 'get_db', return_value=unreachable):
+                self.assertEqual(changefeed.source(), 'watermark')
+            # A connection failure isn't remembered; a database without change streams is
+            self.assertIsNone(changefeed._detected_source)
+            with mock.patch.object(mongo, 'get_db', return_value=MemoryDatabase()):
+                self.assertEqual(changefeed.source(), 'watermark')
+            self.assertEqual(changefeed._detected_source, 'watermark')
+
+
+# ===== BULK APPOINTMENT CHANGES =====
+class BulkAppointmentTests(MongoViewTestCase):
+
+    def setUp(self):
+        super().setUp()
+        doctor_cache.get_cache().clear()
+        patients = make_people(2, 'Patient')
+        doctors = make_people(2, 'Doctor')
+        for number, doctor in enumerate(doctors, 1):
+            doctor['doctor_id'] = f'DOC{number:06d}'
+        bookings = [('2025-03-03', '09:00 AM - 10:00 AM'), ('2025-03-03', '10:00 AM - 11:00 AM'),
+                    ('2025-03-03', '11:00 AM - 12:00 PM'), ('2025-03-04', '09:00 AM - 10:00 AM')]
+        appointments = make_appointments(patients, doctors[:1], len(bookings))
+        for appointment, (day, slot) in zip(appointments, bookings):
+            appointment.update(appointment_date=parse_day(day), time_slot=slot)
+        self.use_collections(patients, doctors, appointments)
+        for appointment in appointments:
+            scheduling.reserve(*scheduling.slot_of(appointment))
+
+    def post(self, body):
+        return self.client.post(reverse('api-appointment-bulk'), encoding.dumps(body), content_type='application/json')
+
+    def booked(self, day):
+        doctor_id = self.doctors.documents[0]['_id']
+        schedule = self.schedules.find_one({'doctor_id': doctor_id, 'date': day})
+        return sorted(schedule['booked']) if schedule else []
+
+    def test_cancel_a_doctors_day(self):
+        body = {'select': {'doctor_id': 'DOC000001', 'from': '2025-03-03', 'to': '2025-03-03'},
+                'set': {'status': 'Cancelled'}, 'dry_run': True}
+        response = self.post(body)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['summary']['updated'], 3)
+        self.assertEqual(len(self.booked('2025-03-03')), 3)
+
+        body['dry_run'] = False
+        self.assertEqual(self.post(body).json()['summary'], {'updated': 3, 'unchanged': 0, 'conflict': 0, 'error': 0})
+        self.assertEqual([a['status'] for a in self.appointments.documents],
+                         ['Cancelled', 'Cancelled', 'Cancelled', 'Scheduled'])
+        self.assertEqual(self.booked('2025-03-03'), [])
+        self.assertEqual(self.booked('2025-03-04'), ['09:00 AM - 10:00 AM'])
+        self.assertTrue(all('updated_at' in a for a in self.appointments.documents[:3]))
+        # Cancelling again changes nothing
+        self.assertEqual(self.post(body).json()['summary']['unchanged'], 3)
+
+    def test_reschedules_swap_slots_and_report_conflicts_and_errors(self):
+        changes = [
+            {'appointment_id': 'APT000001', 'time_slot': '10:00 AM - 11:00 AM'},
+            {'appointment_id': 'APT000002', 'time_slot': '09:00 AM - 10:00 AM'},
+            {'appointment_id': 'APT000003', 'appointment_date': '2025-03-04', 'time_slot': '09:00 AM - 10:00 AM'},
+            {'appointment_id': 'APT000004', 'status': 'Postponed'},
+            {'appointment_id': 'APT999999', 'status': 'Cancelled'},
+        ]
+        results = self.post({'changes': changes}).json()['results']
+        self.assertEqual([r['status'] for r in results], ['updated', 'updated', 'conflict', 'error', 'error'])
+        self.assertIn('already booked', results[2]['error'])
+        self.assertEqual(results[4]['error'], 'appointment not found')
+        self.assertEqual([a['time_slot'] for a in self.appointments.documents[:3]],
+                         ['10:00 AM - 11:00 AM', '09:00 AM - 10:00 AM', '11:00 AM - 12:00 PM'])
+        self.assertEqual(self.booked('2025-03-03'),
+                         ['09:00 AM - 10:00 AM', '10:00 AM - 11:00 AM', '11:00 AM - 12:00 PM'])
+
+        # Two changes can't claim the same free slot
+        results = self.post({'changes': [
+            {'appointment_id': 'APT000001', 'time_slot': '02:00 PM - 03:00 PM'},
+            {'appointment_id': 'APT000002', 'time_slot': '02:00 PM - 03:00 PM'},
+        ]}).json()['results']
+        self.assertEqual([r['status'] for r in results], ['updated', 'conflict'])
+        self.assertEqual(self.post({'changes': 'all'}).status_code, 400)
+
+    def racing_bulk_write(self, race):
+        """``schedules.bulk_write`` that runs ``race()`` before the first call, and the booked slots after each."""
+        real, snapshots = self.schedules.bulk_write, []
+
+        def bulk_write(requests, ordered=True):
+            try:
+                if not snapshots:
+                    race()
+                return real(requests, ordered=ordered)
+            finally:
+                snapshots.append(self.booked('2025-03-03'))
+        return mock.patch.object(self.schedules, 'bulk_write', side_effect=bulk_write), snapshots
+
+    def test_a_move_that_loses_its_new_slot_never_gives_up_the_old_one(self):
+        doctor_id = self.doctors.documents[0]['_id']
+        patch, snapshots = self.racing_bulk_write(
+            lambda: scheduling.reserve(doctor_id, '2025-03-03', '02:00 PM - 03:00 PM'))
+        with patch:
+            result = bulk.apply_changes([{'appointment_id': 'APT000001', 'time_slot': '02:00 PM - 03:00 PM'}],
+                                        self.appointments, doctor_cache.doctor_options(self.doctors),
+                                        patients=self.patients)
+        self.assertEqual(result['summary']['conflict'], 1)
+        self.assertTrue(all('09:00 AM - 10:00 AM' in booked for booked in snapshots))
+        self.assertEqual(self.appointments.documents[0]['time_slot'], '09:00 AM - 10:00 AM')
+        self.assertEqual(self.booked('2025-03-03'), ['02:00 PM - 03:00 PM', '09:00 AM - 10:00 AM',
+                                                     '10:00 AM - 11:00 AM', '11:00 AM - 12:00 PM'])
+
+    def test_a_days_first_claim_survives_a_racing_first_booking(self):
+        doctor_id = self.doctors.documents[0]['_id']
+
+        def race():
+            # Another booking creates the day's document between our claim's filter and its insert
+            self.schedules.insert_one({'doctor_id': doctor_id, 'date': '2025-03-05',
+                                       'booked': ['10:00 AM - 11:00 AM']})
+            raise BulkWriteError({'writeErrors': [{'index': 0, 'code': 11000, 'errmsg': 'E11000'}]})
+
+        patch, _ = self.racing_bulk_write(race)
+        with patch:
+            result = bulk.apply_changes([{'appointment_id': 'APT000004', 'appointment_date': '2025-03-05'}],
+                                        self.appointments, doctor_cache.doctor_options(self.doctors),
+                                        patients=self.patients)
+        self.assertEqual(result['summary']['updated'], 1)
+        self.assertEqual(self.booked('2025-03-05'), ['09:00 AM - 10:00 AM', '10:00 AM - 11:00 AM'])
+        self.assertEqual(self.booked('2025-03-04'), [])
+
+    def test_query_count_does_not_grow_with_the_batch(self):
+        def queries(count):
+            appointments = make_appointments(self.patients.documents, self.doctors.documents[1:], count)
+            for number, appointment in enumerate(appointments):
+                appointment.update(appointment_id=f'APB{count}{number:04d}',
+                                   appointment_date=parse_day('2025-05-01') + timedelta(days=count + number))
+            self.appointments.documents.extend(appointments)
+            changes = [{'appointment_id': a['appointment_id'], 'time_slot': '03:00 PM - 04:00 PM'}
+                       for a in appointments]
+            with self.assertMaxMongoQueries(100) as profile:
+                summary = bulk.apply_changes(changes, self.appointments, doctor_cache.doctor_options(self.doctors),
+                                             patients=self.patients)
+            self.assertEqual(summary['summary']['updated'], count)
+            return len(profile.records)
+
+        doctor_cache.doctor_options(self.doctors)
+        self.assertEqual(queries(2), queries(50))
+
+    def test_command_shifts_a_selection(self):
+        out = io.StringIO()
+        with mock.patch('hospital_app.management.commands.bulk_appointments.appointments_collection',
+                        self.appointments), \
+                mock.patch('hospital_app.management.commands.bulk_appointments.doctors_collection', self.doctors), \
+                mock.patch('hospital_app.management.commands.bulk_appointments.patients_collection', self.patients):
+            call_command('bulk_appointments', doctor='DOC000001', date_from='2025-03-04', shift_days=7, stdout=out)
+        self.assertIn('1 updated', out.getvalue())
+        self.assertEqual(self.appointments.documents[3]['appointment_date'], parse_day('2025-03-11'))
+        self.assertEqual(self.booked('2025-03-04'), [])
+        self.assertEqual(self.booked('2025-03-11'), ['09:00 AM - 10:00 AM'])
+
+
+# ===== PATIENT HISTORY =====
+class PatientHistoryTests(MongoViewTestCase):
+
+    def setUp(self):
+        super().setUp()
+        doctor_cache.get_cache().clear()
+        patients = make_people(2, 'Patient')
+        for number, patient in enumerate(patients, 1):
+            patient['patient_id'] = f'PAT{number:06d}'
+        self.use_collections(patients, make_people(1, 'Doctor'))
+        self.patient = self.patients.documents[0]
+
+    def book(self, days, slot='09:00 AM - 10:00 AM'):
+        self.client.post(reverse('book-appointment'), {
+            'patient_id': str(self.patient['_id']), 'doctor_id': str(self.doctors.documents[0]['_id']),
+            'appointment_date': str((today() + timedelta(days=days)).date()), 'time_slot': slot, 'purpose': 'Checkup',
+        })
+        return self.appointments.documents[-1]
+
+    def test_summary_follows_bookings_updates_and_deletes(self):
+        later = self.book(5)
+        self.assertEqual(self.patient['next_appointment']['appointment_id'], later['appointment_id'])
+        sooner = self.book(2, '10:00 AM - 11:00 AM')
+        self.assertEqual(self.patient['next_appointment']['appointment_id'], sooner['appointment_id'])
+        # Same day, earlier slot
+        earliest = self.book(2)
+        self.assertEqual(self.patient['next_appointment']['appointment_id'], earliest['appointment_id'])
+
+        self.client.post(reverse('update-appointment', args=[earliest['_id']]), {
+            'patient_id': str(self.patient['_id']), 'doctor_id': str(earliest['doctor_id']),
+            'appointment_date': str(earliest['appointment_date'].date()), 'time_slot': earliest['time_slot'],
+            'purpose': 'Checkup', 'status': 'Completed',
+        })
+        self.assertEqual(self.patient['visit_count'], 1)
+        self.assertEqual(self.patient['last_visit'], earliest['appointment_date'])
+        self.assertEqual(self.patient['next_appointment']['appointment_id'], sooner['appointment_id'])
+
+        for appointment in (sooner, later):
+            self.client.post(reverse('delete-appointment', args=[appointment['_id']]))
+        self.assertIsNone(self.patient['next_appointment'])
+        self.assertEqual(self.patient['visit_count'], 1)
+
+    def test_chart_is_the_patient_read_plus_one_history_page(self):
+        for days in range(3):
+            self.book(days + 1)
+        url = reverse('patient-detail', args=[self.patient['_id']])
+        self.client.get(url)
+        with self.assertMaxMongoQueries(2) as profile:
+            response = self.client.get(url)
+        self.assertEqual([q.collection for q in profile.records], ['patients', 'appointments'])
+        self.assertContains(response, 'Appointment History')
+        self.assertEqual([a['appointment_id'] for a in response.context['appointments']],
+                         ['APT000003', 'APT000002', 'APT000001'])
+        self.assertEqual(response.context['summary']['next_appointment']['appointment_id'], 'APT000001')
+
+        body = self.client.get(reverse('api-patient-history', args=['PAT000001']) + '?page_size=2').json()
+        self.assertEqual(body['data']['next_appointment']['appointment_id'], 'APT000001')
+        self.assertEqual([record['appointment_id'] for record in body['history']], ['APT000003', 'APT000002'])
+        self.assertIsNotNone(body['next_cursor'])
+        self.assertEqual(self.client.get(reverse('api-patient-history', args=['PAT999999'])).status_code, 404)
+
+    def test_rebuild_repairs_drifted_summaries(self):
+        self.book(1)
+        self.patient.update(visit_count=7, next_appointment=None)
+        out = io.StringIO()
+        with mock.patch('hospital_app.management.commands.rebuild_patient_history.patients_collection',
+                        self.patients), \
+                mock.patch('hospital_app.management.commands.rebuild_patient_history.appointments_collection',
+                           self.appointments):
+            call_command('rebuild_patient_history', batch_size=1, stdout=out)
+        self.assertIn('Checked 2 patients; repaired 2 summaries', out.getvalue())
+        self.assertEqual(self.patient['visit_count'], 0)
+        self.assertEqual(self.patient['next_appointment']['appointment_id'], 'APT000001')
+        self.assertEqual(self.patients.documents[1]['visit_count'], 0)
+
+
+# ===== DOCTOR ANALYTICS =====
+class AnalyticsTests(MongoViewTestCase):
+
+    def setUp(self):
+        super().setUp()
+        doctor_cache.get_cache().clear()
+        patients = make_people(1, 'Patient')
+        doctors = make_people(2, 'Doctor')
+        for doctor, (department, fee) in zip(doctors, (('Cardiology', 150.0), ('Neurology', 200.0))):
+            doctor.update(department=department, consultation_fee=fee)
+        self.use_collections(patients, doctors)
+        self.day = today() - timedelta(days=3)
+
+    def book(self, doctor, slot):
+        self.client.post(reverse('book-appointment'), {
+            'patient_id': str(self.patients.documents[0]['_id']), 'doctor_id': str(doctor['_id']),
+            'appointment_date': str(self.day.date()), 'time_slot': slot, 'purpose': 'Checkup',
+        })
+        return self.appointments.documents[-1]
+
+    def set_status(self, appointment, status):
+        self.client.post(reverse('update-appointment', args=[appointment['_id']]), {
+            'patient_id': str(appointment['patient_id']), 'doctor_id': str(appointment['doctor_id']),
+            'appointment_date': str(appointment['appointment_date'].date()), 'time_slot': appointment['time_slot'],
+            'purpose': 'Checkup', 'status': status,
+        })
+
+    def test_writes_keep_the_buckets_current(self):
+        cardiologist, neurologist = self.doctors.documents
+        slots = ['09:00 AM - 10:00 AM', '10:00 AM - 11:00 AM', '11:00 AM - 12:00 PM']
+        booked = [self.book(cardiologist, slot) for slot in slots] + [self.book(neurologist, slots[0])]
+        self.set_status(booked[0], 'Completed')
+        self.set_status(booked[1], 'Cancelled')
+        self.set_status(booked[3], 'Completed')
+        self.client.post(reverse('delete-appointment', args=[booked[3]['_id']]))
+
+        bucket = self.rollups.find_one({'doctor_id': cardiologist['_id']})
+        self.assertEqual({field: bucket.get(field, 0) for field in analytics.BUCKET_FIELDS},
+                         {'total': 3, 'scheduled': 1, 'confirmed': 0, 'completed': 1, 'cancelled': 1, 'revenue': 150.0})
+        self.assertEqual(self.rollups.find_one({'doctor_id': neurologist['_id']})['total'], 0)
+
+        # Scanned again from the appointments, the buckets come out the same
+        expected = [dict(bucket) for bucket in self.rollups.documents]
+        self.rollups.documents.clear()
+        with mock.patch('hospital_app.management.commands.backfill_appointment_rollups.appointments_collection',
+                        self.appointments), \
+                mock.patch('hospital_app.management.commands.backfill_appointment_rollups.doctors_collection',
+                           self.doctors):
+            call_command('backfill_appointment_rollups', batch_size=2, stdout=io.StringIO())
+        self.assertEqual([{field: b.get(field, 0) for field in analytics.BUCKET_FIELDS} for b in self.rollups.documents],
+                         [{field: b.get(field, 0) for field in analytics.BUCKET_FIELDS} for b in expected[:1]])
+
+    def test_page_reads_only_the_buckets(self):
+        cardiologist, neurologist = self.doctors.documents
+        self.rollups.documents.extend([
+            {'date': str(self.day.date()), 'doctor_id': cardiologist['_id'], 'total': 4, 'scheduled': 1,
+             'confirmed': 0, 'completed': 2, 'cancelled': 1, 'revenue': 300.0},
+            {'date': str((self.day + timedelta(days=1)).date()), 'doctor_id': neurologist['_id'], 'total': 1,
+             'scheduled': 0, 'confirmed': 0, 'completed': 1, 'cancelled': 0, 'revenue': 200.0},
+        ])
+        self.client.get(reverse('analytics'))
+        with self.assertMaxMongoQueries(1) as profile:
+            response = self.client.get(reverse('analytics'), {'group': 'week'})
+        self.assertEqual([query.collection for query in profile.records], ['appointment_rollups'])
+        totals = response.context['totals']
+        self.assertEqual((totals['total'], totals['revenue'], totals['no_show']), (5, 500.0, 1))
+        cardiology = response.context['doctors'][0]
+        self.assertEqual((cardiology['department'], cardiology['daily_load']), ('Cardiology', 3.0))
+        self.assertAlmostEqual(cardiology['no_show_rate'], 1 / 3)
+        self.assertEqual([row['department'] for row in response.context['departments']], ['Cardiology', 'Neurology'])
+        self.assertContains(response, '25%')
+
+        response = self.client.get(reverse('analytics'), {'department': 'Neurology'})
+        self.assertEqual(response.context['totals']['total'], 1)
+
+
+# ===== SOFT DELETE AND ARCHIVE =====
+class ArchiveTests(MongoViewTestCase):
+
+    def setUp(self):
+        super().setUp()
+        doctor_cache.get_cache().clear()
+        patients = make_people(2, 'Patient')
+        for number, patient in enumerate(patients, 1):
+            patient.update(patient_id=f'PAT{number:06d}', registration_date=datetime(2024, 1, number))
+            patient['search'] = search_fields(patient)
+        doctors = make_people(2, 'Doctor')
+        for number, doctor in enumerate(doctors, 1):
+            doctor.update(doctor_id=f'DOC{number:06d}', specialization='Cardiology')
+        self.use_collections(patients, doctors)
+        self.slot = '09:00 AM - 10:00 AM'
+        past, upcoming = today() - timedelta(days=10), today() + timedelta(days=3)
+        for number, (day, status) in enumerate(((past, 'Completed'), (upcoming, 'Scheduled')), 1):
+            self.appointments.documents.append({
+                '_id': ObjectId(), 'appointment_id': f'APT{number:06d}', 'patient_id': patients[0]['_id'],
+                'doctor_id': doctors[0]['_id'], 'appointment_date': day, 'time_slot': self.slot,
+                'purpose': 'Checkup', 'status': status,
+            })
+        self.schedules.documents.append({'doctor_id': doctors[0]['_id'], 'date': scheduling.day_key(upcoming),
+                                         'booked': [self.slot]})
+
+    def statuses(self):
+        return [appointment['status'] for appointment in self.appointments.documents]
+
+    def test_deleting_a_patient_archives_it_and_cancels_what_is_ahead(self):
+        patient = self.patients.documents[0]
+        self.client.post(reverse('delete-patient', args=[patient['_id']]))
+
+        self.assertIs(patient['archived'], True)
+        self.assertEqual(self.statuses(), ['Completed', 'Cancelled'])
+        self.assertEqual(self.schedules.documents[0]['booked'], [])
+        self.assertEqual(len(self.patients.documents), 2)
+        self.assertEqual(len(self.tombstones.documents), 0)
+
+        # Gone from lists and searches, still named on its appointments
+        self.assertNotContains(self.client.get(reverse('patient-list')), 'Patient0')
+        self.assertEqual(self.client.get(reverse('patient-lookup'), {'q': 'patient'}).json()['results'],
+                         [{'id': str(self.patients.documents[1]['_id']), 'label': 'PAT000002 - Patient1 Test'}])
+        self.assertEqual([record['patient_id'] for record in self.client.get(reverse('api-list', args=['patients']))
+                          .json()['data']], ['PAT000002'])
+        self.assertContains(self.client.get(reverse('appointment-list')), 'Patient0 Test')
+        self.assertContains(self.client.get(reverse('patient-detail', args=[patient['_id']])), 'Archived')
+
+        # Deleting again finds no active patient and changes nothing
+        archived_at = patient['archived_at']
+        self.client.post(reverse('delete-patient', args=[patient['_id']]))
+        self.assertEqual(patient['archived_at'], archived_at)
+
+    def test_archived_doctors_cannot_be_booked(self):
+        doctor = self.doctors.documents[0]
+        self.client.post(reverse('delete-doctor', args=[doctor['_id']]))
+        self.assertEqual(self.statuses(), ['Completed', 'Cancelled'])
+
+        self.assertEqual([result['id'] for result in
+                          self.client.get(reverse('doctor-lookup'), {'q': 'doctor'}).json()['results']],
+                         [str(self.doctors.documents[1]['_id'])])
+        self.client.post(reverse('book-appointment'), {
+            'patient_id': str(self.patients.documents[1]['_id']), 'doctor_id': str(doctor['_id']),
+            'appointment_date': str((today() + timedelta(days=5)).date()), 'time_slot': self.slot,
+            'purpose': 'Checkup',
+        })
+        self.assertEqual(len(self.appointments.documents), 2)
+        result = bulk.apply_changes([{'appointment_id': 'APT000001', 'doctor_id': 'DOC000001'}], self.appointments,
+                                    doctor_cache.doctor_options(self.doctors), patients=self.patients)
+        self.assertEqual(result['results'][0]['error'], "doctor 'DOC000001' is archived")
+
+    def test_archiver_moves_cold_records_in_batches(self):
+        for patient in self.patients.documents[:2]:
+            patient.update(archived=True, archived_at=datetime.now() - timedelta(days=4 * 365))
+        self.doctors.documents[1].update(archived=True, archived_at=datetime.now() - timedelta(days=30))
+
+        with mock.patch('hospital_app.management.commands.archive_records.patients_collection', self.patients), \
+                mock.patch('hospital_app.management.commands.archive_records.doctors_collection', self.doctors):
+            call_command('archive_records', batch_size=1, stdout=io.StringIO())
+
+        self.assertEqual(self.patients.documents, [])
+        self.assertEqual([patient['patient_id'] for patient in self.archives['patients'].documents],
+                         ['PAT000001', 'PAT000002'])
+        # Archived a month ago is not cold yet
+        self.assertEqual(len(self.doctors.documents), 2)
+        self.assertEqual([(tombstone['collection'], tombstone['key']) for tombstone in self.tombstones.documents],
+                         [('patients', 'PAT000001'), ('patients', 'PAT000002')])
+
+        # Names of people moved to the archive are looked up there
+        response = self.client.get(reverse('appointment-list'))
+        self.assertContains(response, 'Patient0 Test')
+        self.assertNotContains(response, 'Unknown')
+
+    def test_ensure_indexes_marks_pre_upgrade_records_active_first(self):
+        legacy = {'_id': ObjectId(), 'first_name': 'Legacy', 'last_name': 'Record'}
+        self.patients.documents.append(legacy)
+        db = mock.MagicMock()
+        db.__getitem__.side_effect = lambda name: {'patients': self.patients, 'doctors': self.doctors}.get(name, db)
+        db.index_information.return_value = {}
+        with mock.patch.object(self.patients, 'index_information', create=True, return_value={}), \
+                mock.patch.object(self.doctors, 'index_information', create=True, return_value={}), \
+                mock.patch.object(self.patients, 'create_indexes', create=True,
+                                  side_effect=lambda models: self.assertIs(legacy['archived'], False)) as create, \
+                mock.patch.object(self.doctors, 'create_indexes', create=True), \
+                mock.patch('hospital_app.management.commands.ensure_mongo_indexes.db', db):
+            out = io.StringIO()
+            call_command('ensure_mongo_indexes', stdout=out)
+        create.assert_called_once()
+        self.assertIn('patients: marked 1 records active', out.getvalue())
+
+        # A dry run doesn't write
+        self.patients.documents.append({'_id': ObjectId(), 'first_name': 'Other', 'last_name': 'Record'})
+        with mock.patch.object(self.patients, 'index_information', create=True, return_value={}), \
+                mock.patch.object(self.doctors, 'index_information', create=True, return_value={}), \
+                mock.patch('hospital_app.management.commands.ensure_mongo_indexes.db', db):
+            call_command('ensure_mongo_indexes', dry_run=True, stdout=io.StringIO())
+        self.assertNotIn('archived', self.patients.documents[-1])
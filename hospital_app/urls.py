@@ -1,30 +1,54 @@
+from django.conf import settings
 from django.urls import path
 from django.contrib.auth import views as auth_views  # ADD THIS LINE
-from . import views
+from . import api, views
+
+# Read-heavy views can be served by their async counterparts under ASGI
+if getattr(settings, 'HOSPITAL_ASYNC_VIEWS', False):
+    from . import async_views as read_views
+else:
+    read_views = views
 
 
 urlpatterns = [
     path('', views.home, name='home'),
-    path('patients/', views.patient_list, name='patient-list'),
+    path('patients/', read_views.patient_list, name='patient-list'),
     path('patients/add/', views.add_patient, name='add-patient'),
+    path('patients/import/', views.import_patients, name='import-patients'),
+    path('patients/lookup/', views.patient_lookup, name='patient-lookup'),
+    path('patients/<str:patient_id>/', views.patient_detail, name='patient-detail'),
     path('patients/update/<str:patient_id>/', views.update_patient, name='update-patient'),
     path('patients/delete/<str:patient_id>/', views.delete_patient, name='delete-patient'),
-    path('doctors/', views.doctor_list, name='doctor-list'),
+    path('doctors/', read_views.doctor_list, name='doctor-list'),
     path('doctors/add/', views.add_doctor, name='add-doctor'),
+    path('doctors/lookup/', views.doctor_lookup, name='doctor-lookup'),
     path('doctors/update/<str:doctor_id>/', views.update_doctor, name='update-doctor'),
     path('doctors/delete/<str:doctor_id>/', views.delete_doctor, name='delete-doctor'),
-    path('appointments/', views.appointment_list, name='appointment-list'),
+    path('appointments/', read_views.appointment_list, name='appointment-list'),
     path('appointments/book/', views.book_appointment, name='book-appointment'),
+    path('appointments/earliest/', views.earliest_slot, name='earliest-slot'),
+    path('doctors/<str:doctor_id>/slots/', views.doctor_slots, name='doctor-slots'),
     path('appointments/update/<str:appointment_id>/', views.update_appointment, name='update-appointment'),
     path('appointments/delete/<str:appointment_id>/', views.delete_appointment, name='delete-appointment'),
-    path('search/patients/', views.search_patients, name='search-patients'),
-    path('search/doctors/', views.search_doctors, name='search-doctors'),
-    path('search/appointments/', views.search_appointments, name='search-appointments'),
+    path('search/patients/', read_views.search_patients, name='search-patients'),
+    path('search/doctors/', read_views.search_doctors, name='search-doctors'),
+    path('search/appointments/', read_views.search_appointments, name='search-appointments'),
+    path('export/<str:name>/', views.export_data, name='export-data'),
+    path('analytics/', views.analytics_dashboard, name='analytics'),
+    path('metrics/', views.metrics, name='metrics'),
+    # JSON API for integration partners (see hospital_app.api)
+    path('api/v1/changes/', api.changes, name='api-changes'),
+    path('api/v1/appointments/bulk/', api.appointment_bulk, name='api-appointment-bulk'),
+    path('api/v1/patients/<str:record_id>/history/', api.patient_history, name='api-patient-history'),
+    path('api/v1/<str:resource>/', api.record_list, name='api-list'),
+    path('api/v1/<str:resource>/batch-get/', api.batch_get, name='api-batch-get'),
+    path('api/v1/<str:resource>/batch/', api.batch_write, name='api-batch'),
+    path('api/v1/<str:resource>/<str:record_id>/', api.record_detail, name='api-detail'),
     # Staff Authentication URLs
     path('staff/signup/', views.staff_signup, name='staff_signup'),
     path('staff/login/', views.staff_login, name='staff_login'),
     path('staff/logout/', views.staff_logout, name='staff_logout'),
-    path('staff/dashboard/', views.staff_dashboard, name='staff_dashboard'),
+    path('staff/dashboard/', read_views.staff_dashboard, name='staff_dashboard'),
     
     # Password Reset URLs (Built-in Django)
     path('password-reset/', 
@@ -0,0 +1,173 @@
+"""Change versions for conditional GETs and cached list fragments.
+
+Every write view bumps the version of the collection it changed. The
+versions live in one tiny ``change_versions`` collection (one document per
+collection, keyed by name), so all workers see the same values::
+
+    {'_id': 'patients', 'version': 42, 'updated_at': datetime}
+
+A list page is a function of the versions of the collections it shows
+plus its query string. :func:`conditional_list` reads those versions with
+a single ``_id`` lookup and
+
+* answers ``304 Not Modified`` when the browser's ``If-None-Match`` /
+  ``If-Modified-Since`` still match, before the view runs at all;
+* otherwise lets the view run and stamps ``ETag``/``Last-Modified`` on the
+  response.
+
+The rendered rows are cached too (:func:`cached_fragment`), keyed on the
+same versions and query string, so a new visitor, or a clerk whose
+browser dropped its copy, gets the page without the list query or the row
+rendering. Fragments are shared across users: the CSRF token the row forms
+need is rendered as a placeholder and filled in per request.
+"""
+import calendar
+import hashlib
+from datetime import datetime, timezone
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.utils.safestring import mark_safe
+
+from .mongo import async_collection, collection
+
+FRAGMENT_CACHE = getattr(settings, 'HOSPITAL_FRAGMENT_CACHE', 'default')
+FRAGMENT_SECONDS = getattr(settings, 'HOSPITAL_FRAGMENT_CACHE_SECONDS', 300)
+# Changes with each deploy so browsers and caches don't keep old markup
+RELEASE = getattr(settings, 'HOSPITAL_RELEASE', '')
+CSRF_PLACEHOLDER = 'csrf-placeholder-0c2f8e'
+
+versions_collection = collection('change_versions')
+async_versions_collection = async_collection('change_versions')
+
+
+def bump(*names):
+    """Record that the ``names`` collections changed."""
+    for name in names:
+        versions_collection.update_one(
+            {'_id': name},
+            {'$inc': {'version': 1}, '$set': {'updated_at': datetime.now(timezone.utc)}},
+            upsert=True,
+        )
+
+
+def _versions(documents, names):
+    found = {document['_id']: document for document in documents}
+    return {name: (found.get(name, {}).get('version', 0), found.get(name, {}).get('updated_at')) for name in names}
+
+
+def get_versions(names):
+    """``{name: (version, updated_at)}`` for ``names``, in one query."""
+    return _versions(versions_collection.find({'_id': {'$in': list(names)}}), names)
+
+
+async def aget_versions(names):
+    cursor = async_versions_collection.find({'_id': {'$in': list(names)}})
+    return _versions(await cursor.to_list(None), names)
+
+
+def _digest(*parts):
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def version_key(versions):
+    # The timestamps keep keys unique even if change_versions is ever reset
+    return tuple((name, version, str(updated_at)) for name, (version, updated_at) in sorted(versions.items()))
+
+
+class Freshness:
+    """ETag and Last-Modified of one list page for one browser."""
+
+    def __init__(self, request, versions):
+        self.versions = versions
+        # The page also shows the user's name and embeds their CSRF token.
+        # get_token() makes sure the CSRF secret exists before it's hashed.
+        get_token(request)
+        self.etag = '"%s"' % _digest(RELEASE, version_key(versions), request.GET.urlencode(),
+                                     request.user.pk, request.META['CSRF_COOKIE'])
+        stamps = [updated_at for _, updated_at in versions.values() if updated_at]
+        self.last_modified = (
+            calendar.timegm(max(stamps).utctimetuple()) if len(stamps) == len(versions) else None)
+
+    def not_modified(self, request):
+        return get_conditional_response(request, etag=self.etag, last_modified=self.last_modified)
+
+    def stamp(self, response):
+        if response.status_code == 200 and not response.has_header('ETag'):
+            response['ETag'] = self.etag
+            if self.last_modified is not None and not response.has_header('Last-Modified'):
+                response['Last-Modified'] = http_date(self.last_modified)
+            # Always revalidate; the page is per-user
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+def _conditional(request):
+    return request.method in ('GET', 'HEAD')
+
+
+def conditional_list(*names):
+    """Serve 304s for an unchanged list page; see the module docstring."""
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                if not _conditional(request):
+                    return await view(request, *args, **kwargs)
+                request.user = await request.auser()
+                request.change_versions = await aget_versions(names)
+                freshness = Freshness(request, request.change_versions)
+                return freshness.not_modified(request) or freshness.stamp(await view(request, *args, **kwargs))
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not _conditional(request):
+                return view(request, *args, **kwargs)
+            request.change_versions = get_versions(names)
+            freshness = Freshness(request, request.change_versions)
+            return freshness.not_modified(request) or freshness.stamp(view(request, *args, **kwargs))
+        return wrapper
+    return decorator
+
+
+def _fragment_key(request, name, versions):
+    return f'fragment:{name}:{_digest(RELEASE, version_key(versions), request.GET.urlencode())}'
+
+
+def _fill(request, html):
+    return mark_safe(html.replace(CSRF_PLACEHOLDER, get_token(request)))
+
+
+def fragment_context(context):
+    """``context`` for rendering a shareable fragment (placeholder CSRF token)."""
+    return dict(context, csrf_token=CSRF_PLACEHOLDER)
+
+
+def cached_fragment(request, name, names, render):
+    """HTML of fragment ``name``, rendered by ``render()`` unless cached for the current versions."""
+    versions = getattr(request, 'change_versions', None) or get_versions(names)
+    cache = caches[FRAGMENT_CACHE]
+    key = _fragment_key(request, name, versions)
+    html = cache.get(key)
+    if html is None:
+        html = str(render())
+        cache.set(key, html, FRAGMENT_SECONDS)
+    return _fill(request, html)
+
+
+async def acached_fragment(request, name, names, render):
+    """Async :func:`cached_fragment`; ``render()`` returns an awaitable."""
+    versions = getattr(request, 'change_versions', None) or await aget_versions(names)
+    cache = caches[FRAGMENT_CACHE]
+    key = _fragment_key(request, name, versions)
+    html = await cache.aget(key)
+    if html is None:
+        html = str(await render())
+        await cache.aset(key, html, FRAGMENT_SECONDS)
+    return _fill(request, html)
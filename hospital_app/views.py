@@ -1,19 +1,50 @@
-import pymongo
 from bson.objectid import ObjectId
-from datetime import datetime
+from datetime import datetime, timedelta
 from django.shortcuts import render, redirect
-from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from django.contrib.auth.decorators import login_required
+from django.conf import settings
 from django.contrib import messages
-
-# MongoDB connection
-client = pymongo.MongoClient('mongodb://localhost:27017/')
-db = client['hospital_management']
-patients_collection = db['patients']
-doctors_collection = db['doctors']
-appointments_collection = db['appointments']
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare
+from pymongo.errors import DuplicateKeyError
+
+from . import (
+    analytics, archive, changefeed, doctor_cache, export, history, importer, metrics as app_metrics, scheduling, versions,
+)
+from .dates import day_range, parse_day
+from .ids import IdAllocator
+from .lookups import attach_names
+from .mongo import (
+    appointments_collection, counters_collection, doctors_collection, patients_collection,
+)
+from .pagination import paginate, count_results
+from .rows import AppointmentRow, DoctorRow, PatientRow, rows as row_collection
+from .search import SEARCH_LIMIT, match_doctors, search_fields, search_patients as find_patients
+from .stats import dashboard_stats
+
+# Business ID sequences (PAT/DOC/APT), allocated atomically from counters
+ID_BLOCK_SIZE = getattr(settings, 'HOSPITAL_ID_BLOCK_SIZE', 1)
+patient_ids = IdAllocator(counters_collection, 'patient_id', 'PAT', block_size=ID_BLOCK_SIZE)
+doctor_ids = IdAllocator(counters_collection, 'doctor_id', 'DOC', block_size=ID_BLOCK_SIZE)
+appointment_ids = IdAllocator(counters_collection, 'appointment_id', 'APT', block_size=ID_BLOCK_SIZE)
+
+# Raised by the email_unique indexes (see indexes.INDEXES)
+EMAIL_TAKEN = 'That email address is already registered.'
+
+# The appointment list shows patient and doctor names, so renames change it too
+APPOINTMENT_LIST_SOURCES = ('appointments', 'patients', 'doctors')
+
+# Matches returned per keystroke by the appointment form pickers
+LOOKUP_LIMIT = getattr(settings, 'HOSPITAL_LOOKUP_LIMIT', 10)
+PATIENT_CHOICE_FIELDS = {'patient_id': 1, 'first_name': 1, 'last_name': 1}
+
+# Columns of a patient's appointment history
+PATIENT_HISTORY_FIELDS = {'appointment_id': 1, 'doctor_id': 1, 'appointment_date': 1, 'time_slot': 1, 'purpose': 1,
+                          'status': 1}
 
 # ===== HOME PAGE =====
 def home(request):
@@ -22,25 +53,22 @@ def home(request):
 
 # ===== PATIENT MANAGEMENT =====
 @login_required
+@versions.conditional_list('patients')
 def patient_list(request):
-    patients = list(patients_collection.find())
-    for patient in patients:
-        patient['id'] = str(patient['_id'])
-    return render(request, 'hospital_app/patient_list.html', {'patients': patients})
+    def rows():
+        page = paginate(row_collection(patients_collection, PatientRow), archive.ACTIVE, '-registration_date',
+                        request, PatientRow.projection)
+        return render_to_string('hospital_app/patient_rows.html',
+                                versions.fragment_context({'patients': page.items, 'page': page}), request)
+
+    rows_html = versions.cached_fragment(request, 'patient_list', ('patients',), rows)
+    return render(request, 'hospital_app/patient_list.html', {'rows': rows_html})
 
 @login_required
 def add_patient(request):
     if request.method == 'POST':
-        # Generate patient ID
-        last_patient = patients_collection.find_one(sort=[("patient_id", -1)])
-        if last_patient and 'patient_id' in last_patient:
-            last_id = int(last_patient['patient_id'][3:])
-            new_patient_id = f"PAT{last_id + 1:06d}"
-        else:
-            new_patient_id = "PAT000001"
-
         new_patient = {
-            'patient_id': new_patient_id,
+            'patient_id': patient_ids.next_id(),
             'first_name': request.POST.get('first_name'),
             'last_name': request.POST.get('last_name'),
             'email': request.POST.get('email'),
@@ -50,14 +78,42 @@ def add_patient(request):
             'address': request.POST.get('address'),
             'blood_group': request.POST.get('blood_group'),
             'emergency_contact': request.POST.get('emergency_contact'),
-            'registration_date': datetime.now()
+            'registration_date': datetime.now(),
+            'archived': False,
         }
-
-        patients_collection.insert_one(new_patient)
+        new_patient['search'] = search_fields(new_patient)
+        new_patient.update(history.EMPTY_SUMMARY)
+
+        try:
+            patients_collection.insert_one(changefeed.stamp(new_patient))
+        except DuplicateKeyError:
+            messages.error(request, EMAIL_TAKEN)
+            return render(request, 'hospital_app/add_patient.html', {'patient': new_patient})
+        versions.bump('patients')
         return redirect('patient-list')
 
     return render(request, 'hospital_app/add_patient.html')
 
+@login_required
+def import_patients(request):
+    report = None
+    if request.method == 'POST':
+        upload = request.FILES.get('file')
+        file_format = request.POST.get('format') or importer.detect_format(upload.name if upload else '')
+        if upload is None:
+            messages.error(request, 'Choose a file to import.')
+        elif file_format not in importer.FORMATS:
+            messages.error(request, 'Unsupported file type; upload a .csv or .jsonl file.')
+        else:
+            rows = importer.read_rows(importer.text_stream(upload), file_format)
+            report = importer.import_patients(rows, patients_collection, patient_ids)
+            if report.inserted or report.updated:
+                versions.bump('patients')
+            messages.success(request, f'Imported {report.rows} rows: {report.inserted} new, '
+                                      f'{report.updated} updated, {report.invalid + report.failed} rejected.')
+
+    return render(request, 'hospital_app/import_patients.html', {'report': report, 'formats': importer.FORMATS})
+
 @login_required
 def update_patient(request, patient_id):
     patient = patients_collection.find_one({'_id': ObjectId(patient_id)})
@@ -77,45 +133,82 @@ def update_patient(request, patient_id):
             'blood_group': request.POST.get('blood_group'),
             'emergency_contact': request.POST.get('emergency_contact'),
         }
-
-        patients_collection.update_one({'_id': ObjectId(patient_id)}, {'$set': updated_patient})
+        updated_patient['search'] = search_fields(updated_patient)
+
+        try:
+            patients_collection.update_one({'_id': ObjectId(patient_id)},
+                                           {'$set': changefeed.stamp(updated_patient)})
+        except DuplicateKeyError:
+            messages.error(request, EMAIL_TAKEN)
+            return render(request, 'hospital_app/update_patient.html',
+                          {'patient': dict(patient, **updated_patient, id=patient_id)})
+        versions.bump('patients')
         messages.success(request, 'Patient updated successfully.')
         return redirect('patient-list')
 
     patient['id'] = str(patient['_id'])
     return render(request, 'hospital_app/update_patient.html', {'patient': patient})
 
+def archived_message(kind, cancelled):
+    message = f'{kind} deleted successfully.'
+    if cancelled:
+        message += f" {cancelled} upcoming appointment{'s' if cancelled != 1 else ''} cancelled."
+    return message
+
 @login_required
 def delete_patient(request, patient_id):
+    # Soft delete: the patient is archived and their upcoming appointments cancelled
     if request.method == 'POST':
-        result = patients_collection.delete_one({'_id': ObjectId(patient_id)})
-        if result.deleted_count > 0:
-            messages.success(request, 'Patient deleted successfully.')
+        patient, cancelled = archive.soft_delete('patients', patients_collection, ObjectId(patient_id),
+                                                 appointments_collection,
+                                                 doctor_cache.doctor_options(doctors_collection), patients_collection)
+        if patient:
+            versions.bump('patients')
+            messages.success(request, archived_message('Patient', cancelled))
         else:
             messages.error(request, 'Patient not found.')
     return redirect('patient-list')
 
+@login_required
+def patient_detail(request, patient_id):
+    # The summary is on the patient; the history is a range read of the patient_history index
+    patient = patients_collection.find_one({'_id': ObjectId(patient_id)})
+    if not patient:
+        messages.error(request, 'Patient not found.')
+        return redirect('patient-list')
+
+    summary = history.current_summary(patient, patients_collection, appointments_collection)
+    page = paginate(appointments_collection, {'patient_id': patient['_id']}, '-appointment_date', request,
+                    PATIENT_HISTORY_FIELDS)
+    doctors = {doctor['_id']: doctor for doctor in doctor_cache.doctor_options(doctors_collection)}
+    for appointment in page.items:
+        appointment['id'] = str(appointment['_id'])
+        appointment['doctor'] = doctors.get(appointment.get('doctor_id'))
+    if summary['next_appointment']:
+        summary['next_appointment']['doctor'] = doctors.get(summary['next_appointment'].get('doctor_id'))
+    patient['id'] = str(patient['_id'])
+    return render(request, 'hospital_app/patient_detail.html', {
+        'patient': patient, 'summary': summary, 'appointments': page.items, 'page': page,
+    })
+
 # ===== DOCTOR MANAGEMENT =====
 @login_required
+@versions.conditional_list('doctors')
 def doctor_list(request):
-    doctors = list(doctors_collection.find())
-    for doctor in doctors:
-        doctor['id'] = str(doctor['_id'])
-    return render(request, 'hospital_app/doctor_list.html', {'doctors': doctors})
+    def rows():
+        page = doctor_cache.doctor_page(row_collection(doctors_collection, DoctorRow), archive.ACTIVE,
+                                        'specialization', request, DoctorRow.projection)
+        return render_to_string('hospital_app/doctor_rows.html',
+                                versions.fragment_context({'doctors': page.items, 'page': page}), request)
+
+    rows_html = versions.cached_fragment(request, 'doctor_list', ('doctors',), rows)
+    return render(request, 'hospital_app/doctor_list.html', {'rows': rows_html})
 
 @login_required
 def add_doctor(request):
     if request.method == 'POST':
-        # Generate doctor ID
-        last_doctor = doctors_collection.find_one(sort=[("doctor_id", -1)])
-        if last_doctor and 'doctor_id' in last_doctor:
-            last_id = int(last_doctor['doctor_id'][3:])
-            new_doctor_id = f"DOC{last_id + 1:06d}"
-        else:
-            new_doctor_id = "DOC000001"
-
         new_doctor = {
-            'doctor_id': new_doctor_id,
+            'doctor_id': doctor_ids.next_id(),
             'first_name': request.POST.get('first_name'),
             'last_name': request.POST.get('last_name'),
             'email': request.POST.get('email'),
@@ -126,10 +219,17 @@ def add_doctor(request):
             'experience': int(request.POST.get('experience', 0)),
             'consultation_fee': float(request.POST.get('consultation_fee', 0)),
             'availability': 'Available',
-            'status': 'Active'
+            'status': 'Active',
+            'archived': False,
         }
 
-        doctors_collection.insert_one(new_doctor)
+        try:
+            doctors_collection.insert_one(changefeed.stamp(new_doctor))
+        except DuplicateKeyError:
+            messages.error(request, EMAIL_TAKEN)
+            return render(request, 'hospital_app/add_doctor.html', {'doctor': new_doctor})
+        doctor_cache.invalidate()
+        versions.bump('doctors')
         return redirect('doctor-list')
 
     return render(request, 'hospital_app/add_doctor.html')
@@ -156,7 +256,14 @@ def update_doctor(request, doctor_id):
             'status': request.POST.get('status'),
         }
 
-        doctors_collection.update_one({'_id': ObjectId(doctor_id)}, {'$set': updated_doctor})
+        try:
+            doctors_collection.update_one({'_id': ObjectId(doctor_id)}, {'$set': changefeed.stamp(updated_doctor)})
+        except DuplicateKeyError:
+            messages.error(request, EMAIL_TAKEN)
+            return render(request, 'hospital_app/update_doctor.html',
+                          {'doctor': dict(doctor, **updated_doctor, id=doctor_id)})
+        doctor_cache.invalidate()
+        versions.bump('doctors')
         messages.success(request, 'Doctor updated successfully.')
         return redirect('doctor-list')
 
@@ -165,49 +272,111 @@ def update_doctor(request, doctor_id):
 
 @login_required
 def delete_doctor(request, doctor_id):
+    # Soft delete: the doctor is archived and their upcoming appointments cancelled
     if request.method == 'POST':
-        result = doctors_collection.delete_one({'_id': ObjectId(doctor_id)})
-        if result.deleted_count > 0:
-            messages.success(request, 'Doctor deleted successfully.')
+        doctor, cancelled = archive.soft_delete('doctors', doctors_collection, ObjectId(doctor_id),
+                                                appointments_collection,
+                                                doctor_cache.doctor_options(doctors_collection), patients_collection)
+        if doctor:
+            doctor_cache.invalidate()
+            versions.bump('doctors')
+            messages.success(request, archived_message('Doctor', cancelled))
         else:
             messages.error(request, 'Doctor not found.')
     return redirect('doctor-list')
 
 # ===== APPOINTMENT MANAGEMENT =====
 @login_required
+@versions.conditional_list(*APPOINTMENT_LIST_SOURCES)
 def appointment_list(request):
-    appointments = list(appointments_collection.find().sort('appointment_date', -1))
-    
-    # Get patient and doctor names
-    for appointment in appointments:
-        appointment['id'] = str(appointment['_id'])
+    def rows():
+        page = paginate(row_collection(appointments_collection, AppointmentRow), {}, '-appointment_date', request,
+                        AppointmentRow.projection)
+        # Resolve patient and doctor names in one query per collection
+        attach_names(page.items, patients_collection, doctors_collection, archive.archive_collections)
+        return render_to_string('hospital_app/appointment_rows.html',
+                                versions.fragment_context({'appointments': page.items, 'page': page}), request)
+
+    rows_html = versions.cached_fragment(request, 'appointment_list', APPOINTMENT_LIST_SOURCES, rows)
+    return render(request, 'hospital_app/appointment_list.html', {'rows': rows_html})
+
+def doctor_option(doctor_id):
+    """The cached booking-form entry for active doctor ``doctor_id`` (a string), or ``None``."""
+    return next((d for d in doctor_cache.active_doctor_options(doctors_collection) if str(d['_id']) == doctor_id),
+                None)
+
+def active_patient(patient_id):
+    """Whether ``patient_id`` (an ObjectId) names a patient who hasn't been archived."""
+    return patients_collection.find_one({'_id': patient_id, **archive.ACTIVE}, {'_id': 1}) is not None
+
+# ===== APPOINTMENT FORM PICKERS =====
+def patient_choice(patient):
+    return {
+        'id': str(patient['_id']),
+        'label': f"{patient.get('patient_id', '')} - {patient.get('first_name', '')} {patient.get('last_name', '')}",
+    }
 
-        # Get patient name
-        patient = patients_collection.find_one({'_id': appointment['patient_id']})
-        appointment['patient_name'] = f"{patient['first_name']} {patient['last_name']}" if patient else "Unknown"
+def doctor_choice(doctor):
+    return {
+        'id': str(doctor['_id']),
+        'label': f"Dr. {doctor.get('first_name', '')} {doctor.get('last_name', '')} - {doctor.get('specialization', '')}",
+        'slots_url': reverse('doctor-slots', args=[str(doctor['_id'])]),
+    }
 
-        # Get doctor name
-        doctor = doctors_collection.find_one({'_id': appointment['doctor_id']})
-        appointment['doctor_name'] = f"Dr. {doctor['first_name']} {doctor['last_name']}" if doctor else "Unknown"
-    
-    return render(request, 'hospital_app/appointment_list.html', {'appointments': appointments})
+def form_choices(patient_id, doctor_id):
+    """The pickers' current patient and doctor: one indexed lookup at most, whatever the registry size."""
+    patient = None
+    if patient_id and ObjectId.is_valid(str(patient_id)):
+        patient = patients_collection.find_one({'_id': ObjectId(patient_id)}, PATIENT_CHOICE_FIELDS)
+    doctor = doctor_option(str(doctor_id)) if doctor_id else None
+    return {
+        'patient_choice': patient_choice(patient) if patient else None,
+        'doctor_choice': doctor_choice(doctor) if doctor else None,
+    }
+
+@login_required
+def patient_lookup(request):
+    # Served from the search indexes, projected to what a picker shows
+    patients = find_patients(patients_collection, request.GET.get('q', ''), limit=LOOKUP_LIMIT,
+                             projection=PATIENT_CHOICE_FIELDS)
+    return JsonResponse({'results': [patient_choice(patient) for patient in patients]})
+
+@login_required
+def doctor_lookup(request):
+    # Filters the cached doctor options, so typing costs no queries
+    doctors = match_doctors(doctor_cache.active_doctor_options(doctors_collection), request.GET.get('q', ''),
+                            LOOKUP_LIMIT)
+    return JsonResponse({'results': [doctor_choice(doctor) for doctor in doctors]})
+
+def posted_date(request):
+    """The posted ``appointment_date`` as a BSON-storable date, or ``None`` if invalid."""
+    try:
+        return parse_day(request.POST.get('appointment_date'))
+    except ValueError:
+        return None
+
+def slot_error(doctor, appointment_date, time_slot):
+    """Why a doctor/date/slot can't be booked, or ``None`` if it is bookable."""
+    if doctor is None:
+        return 'Doctor not found.'
+    if appointment_date is None:
+        return 'Enter a valid appointment date.'
+    if time_slot not in scheduling.working_slots(doctor):
+        return f'Dr. {doctor["last_name"]} does not work the {time_slot} slot.'
+    return None
+
+def record_appointment_changes(changes):
+    """Bring patient history summaries and analytics rollups up to date with ``(before, after)`` appointments."""
+    history.record(changes, patients_collection, appointments_collection)
+    analytics.record(changes, doctor_cache.doctor_options(doctors_collection))
 
 @login_required
 def book_appointment(request):
     if request.method == 'POST':
-        # Generate appointment ID
-        last_appointment = appointments_collection.find_one(sort=[("appointment_id", -1)])
-        if last_appointment and 'appointment_id' in last_appointment:
-            last_id = int(last_appointment['appointment_id'][4:])
-            new_appointment_id = f"APT{last_id + 1:06d}"
-        else:
-            new_appointment_id = "APT000001"
-
         new_appointment = {
-            'appointment_id': new_appointment_id,
             'patient_id': ObjectId(request.POST.get('patient_id')),
             'doctor_id': ObjectId(request.POST.get('doctor_id')),
-            'appointment_date': request.POST.get('appointment_date'),
+            'appointment_date': posted_date(request),
             'time_slot': request.POST.get('time_slot'),
             'purpose': request.POST.get('purpose'),
             'notes': request.POST.get('notes', ''),
@@ -215,22 +384,30 @@ def book_appointment(request):
             'created_at': datetime.now()
         }
 
-        appointments_collection.insert_one(new_appointment)
-        return redirect('appointment-list')
-
-    # GET request - show booking form
-    patients = list(patients_collection.find())
-    doctors = list(doctors_collection.find())
-
-    for patient in patients:
-        patient['id'] = str(patient['_id'])
-    for doctor in doctors:
-        doctor['id'] = str(doctor['_id'])
-
-    return render(request, 'hospital_app/book_appointment.html', {
-        'patients': patients,
-        'doctors': doctors
-    })
+        error = None if active_patient(new_appointment['patient_id']) else 'Patient not found.'
+        error = error or slot_error(doctor_option(request.POST.get('doctor_id')),
+                                    new_appointment['appointment_date'], new_appointment['time_slot'])
+        if error is None:
+            try:
+                scheduling.reserve(*scheduling.slot_of(new_appointment))
+            except scheduling.SlotUnavailable as unavailable:
+                error = f'{unavailable} Please pick another slot.'
+        if error is None:
+            # Numbered only once the booking is accepted, so rejections don't leave gaps
+            new_appointment = {'appointment_id': appointment_ids.next_id(), **new_appointment}
+            try:
+                appointments_collection.insert_one(changefeed.stamp(new_appointment))
+            except Exception:
+                scheduling.release(*scheduling.slot_of(new_appointment))
+                raise
+            record_appointment_changes([(None, new_appointment)])
+            versions.bump('appointments')
+            return redirect('appointment-list')
+        messages.error(request, error)
+
+    # GET request (or rejected booking) - the pickers load their options as staff type
+    return render(request, 'hospital_app/book_appointment.html',
+                  form_choices(request.POST.get('patient_id'), request.POST.get('doctor_id')))
 
 @login_required
 def update_appointment(request, appointment_id):
@@ -243,79 +420,116 @@ def update_appointment(request, appointment_id):
         updated_appointment = {
             'patient_id': ObjectId(request.POST.get('patient_id')),
             'doctor_id': ObjectId(request.POST.get('doctor_id')),
-            'appointment_date': request.POST.get('appointment_date'),
+            'appointment_date': posted_date(request),
             'time_slot': request.POST.get('time_slot'),
             'purpose': request.POST.get('purpose'),
             'notes': request.POST.get('notes', ''),
             'status': request.POST.get('status'),
         }
 
-        appointments_collection.update_one({'_id': ObjectId(appointment_id)}, {'$set': updated_appointment})
+        error = slot_error(doctor_option(request.POST.get('doctor_id')),
+                           updated_appointment['appointment_date'], updated_appointment['time_slot'])
+        if error is None:
+            try:
+                scheduling.move(appointment, updated_appointment)
+            except scheduling.SlotUnavailable as unavailable:
+                error = f'{unavailable} Please pick another slot.'
+        if error:
+            messages.error(request, error)
+            return redirect('update-appointment', appointment_id=appointment_id)
+
+        try:
+            appointments_collection.update_one({'_id': ObjectId(appointment_id)},
+                                               {'$set': changefeed.stamp(updated_appointment)})
+        except Exception:
+            # Give the original slot back and free the new one
+            scheduling.move(updated_appointment, appointment)
+            raise
+        record_appointment_changes([(appointment, dict(appointment, **updated_appointment))])
+        versions.bump('appointments')
         messages.success(request, 'Appointment updated successfully.')
         return redirect('appointment-list')
 
     # GET request - show update form
-    patients = list(patients_collection.find())
-    doctors = list(doctors_collection.find())
-
-    for patient in patients:
-        patient['id'] = str(patient['_id'])
-    for doctor in doctors:
-        doctor['id'] = str(doctor['_id'])
-
     appointment['id'] = str(appointment['_id'])
-    return render(request, 'hospital_app/update_appointment.html', {
-        'appointment': appointment,
-        'patients': patients,
-        'doctors': doctors
-    })
+    context = form_choices(appointment.get('patient_id'), appointment.get('doctor_id'))
+    context['appointment'] = appointment
+    return render(request, 'hospital_app/update_appointment.html', context)
 
 @login_required
 def delete_appointment(request, appointment_id):
     if request.method == 'POST':
-        result = appointments_collection.delete_one({'_id': ObjectId(appointment_id)})
-        if result.deleted_count > 0:
+        appointment = appointments_collection.find_one_and_delete({'_id': ObjectId(appointment_id)})
+        if appointment:
+            changefeed.record_delete('appointments', appointment)
+            if scheduling.holds_slot(appointment):
+                scheduling.release(*scheduling.slot_of(appointment))
+            record_appointment_changes([(appointment, None)])
+            versions.bump('appointments')
             messages.success(request, 'Appointment deleted successfully.')
         else:
             messages.error(request, 'Appointment not found.')
     return redirect('appointment-list')
 
+@login_required
+def doctor_slots(request, doctor_id):
+    doctor = doctor_option(doctor_id)
+    if doctor is None:
+        raise Http404('Doctor not found.')
+    day = request.GET.get('date') or str(datetime.now().date())
+    try:
+        free = scheduling.free_slots(doctor, day)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid date; use YYYY-MM-DD.'}, status=400)
+    return JsonResponse({'doctor_id': doctor_id, 'date': scheduling.day_key(day), 'free_slots': free})
+
+@login_required
+def earliest_slot(request):
+    specialization = request.GET.get('specialization', '')
+    doctors = [d for d in doctor_cache.active_doctor_options(doctors_collection)
+               if d.get('specialization') == specialization]
+    try:
+        found = scheduling.earliest_free_slot(doctors, request.GET.get('from') or datetime.now().date())
+    except ValueError:
+        return JsonResponse({'error': 'Invalid date; use YYYY-MM-DD.'}, status=400)
+    if found is None:
+        return JsonResponse({'specialization': specialization, 'slot': None})
+    day, slot, doctor = found
+    return JsonResponse({'specialization': specialization, 'slot': {
+        'date': day,
+        'time_slot': slot,
+        'doctor_id': str(doctor['_id']),
+        'doctor_name': f"Dr. {doctor.get('first_name', '')} {doctor.get('last_name', '')}",
+    }})
+
 # ===== SEARCH FUNCTIONALITY =====
 def search_patients(request):
-    query = request.GET.get('q', '')
-    
-    search_criteria = {}
+    query = request.GET.get('q', '').strip()
+
     if query:
-        search_criteria['$or'] = [
-            {'first_name': {'$regex': query, '$options': 'i'}},
-            {'last_name': {'$regex': query, '$options': 'i'}},
-            {'patient_id': {'$regex': query, '$options': 'i'}},
-            {'email': {'$regex': query, '$options': 'i'}},
-            {'phone': {'$regex': query, '$options': 'i'}}
-        ]
-    
-    if search_criteria:
-        patients = list(patients_collection.find(search_criteria))
+        # Ranked, capped matches served from the search indexes
+        patients = find_patients(patients_collection, query)
+        for patient in patients:
+            patient['id'] = str(patient['_id'])
+        page = None
+        total_results = len(patients)
     else:
-        patients = list(patients_collection.find())
-    
-    for patient in patients:
-        patient['id'] = str(patient['_id'])
-    
+        page = paginate(row_collection(patients_collection, PatientRow), archive.ACTIVE, '-registration_date',
+                        request, PatientRow.projection)
+        patients = page.items
+        total_results = count_results(patients_collection, archive.ACTIVE)
+
     return render(request, 'hospital_app/search_patients.html', {
         'patients': patients,
+        'page': page,
         'query': query,
-        'total_results': len(patients)
+        'total_results': total_results,
+        'result_limit': SEARCH_LIMIT,
     })
 
-@login_required
-def search_doctors(request):
-    query = request.GET.get('q', '')
-    specialization_filter = request.GET.get('specialization', '')
-    department_filter = request.GET.get('department', '')
-    
-    search_criteria = {}
-    
+def doctor_search_criteria(query, specialization_filter, department_filter):
+    search_criteria = dict(archive.ACTIVE)
+
     if query:
         search_criteria['$or'] = [
             {'first_name': {'$regex': query, '$options': 'i'}},
@@ -323,41 +537,41 @@ def search_doctors(request):
             {'doctor_id': {'$regex': query, '$options': 'i'}},
             {'specialization': {'$regex': query, '$options': 'i'}}
         ]
-    
+
     if specialization_filter:
         search_criteria['specialization'] = specialization_filter
-    
+
     if department_filter:
         search_criteria['department'] = department_filter
-    
-    if search_criteria:
-        doctors = list(doctors_collection.find(search_criteria))
-    else:
-        doctors = list(doctors_collection.find())
-    
-    for doctor in doctors:
-        doctor['id'] = str(doctor['_id'])
-    
+
+    return search_criteria
+
+@login_required
+def search_doctors(request):
+    query = request.GET.get('q', '')
+    specialization_filter = request.GET.get('specialization', '')
+    department_filter = request.GET.get('department', '')
+
+    search_criteria = doctor_search_criteria(query, specialization_filter, department_filter)
+
+    page = doctor_cache.doctor_page(row_collection(doctors_collection, DoctorRow), search_criteria, 'specialization',
+                                    request, DoctorRow.projection)
+
     # Get unique specializations and departments for filters
-    specializations = doctors_collection.distinct('specialization')
-    departments = doctors_collection.distinct('department')
+    facets = doctor_cache.facets(doctors_collection)
     
     return render(request, 'hospital_app/search_doctors.html', {
-        'doctors': doctors,
+        'doctors': page.items,
+        'page': page,
         'query': query,
-        'specializations': specializations,
-        'departments': departments,
+        'specializations': facets['specializations'],
+        'departments': facets['departments'],
         'selected_specialization': specialization_filter,
         'selected_department': department_filter,
-        'total_results': len(doctors)
+        'total_results': doctor_cache.doctor_count(doctors_collection, search_criteria)
     })
 
-@login_required
-def search_appointments(request):
-    query = request.GET.get('q', '')
-    status_filter = request.GET.get('status', '')
-    date_filter = request.GET.get('date', '')
-
+def appointment_search_criteria(query, status_filter, date_filter, date_from='', date_to=''):
     search_criteria = {}
 
     if query:
@@ -366,31 +580,77 @@ def search_appointments(request):
     if status_filter:
         search_criteria['status'] = status_filter
 
+    # A single date is a one-day range; invalid dates are ignored
     if date_filter:
-        search_criteria['appointment_date'] = date_filter
+        date_from = date_to = date_filter
+    try:
+        date_range = day_range(date_from, date_to)
+    except ValueError:
+        date_range = {}
+    if date_range:
+        search_criteria['appointment_date'] = date_range
 
-    appointments = list(appointments_collection.find(search_criteria).sort('appointment_date', -1))
+    return search_criteria
 
-    # Get patient and doctor names
-    for appointment in appointments:
-        appointment['id'] = str(appointment['_id'])
+@login_required
+def search_appointments(request):
+    query = request.GET.get('q', '')
+    status_filter = request.GET.get('status', '')
+    date_filter = request.GET.get('date', '')
+    date_from = request.GET.get('from', '')
+    date_to = request.GET.get('to', '')
+
+    search_criteria = appointment_search_criteria(query, status_filter, date_filter, date_from, date_to)
 
-        # Get patient name
-        patient = patients_collection.find_one({'_id': appointment['patient_id']})
-        appointment['patient_name'] = f"{patient['first_name']} {patient['last_name']}" if patient else "Unknown"
+    page = paginate(row_collection(appointments_collection, AppointmentRow), search_criteria, '-appointment_date',
+                    request, AppointmentRow.projection)
 
-        # Get doctor name
-        doctor = doctors_collection.find_one({'_id': appointment['doctor_id']})
-        appointment['doctor_name'] = f"Dr. {doctor['first_name']} {doctor['last_name']}" if doctor else "Unknown"
+    # Resolve patient and doctor names in one query per collection
+    attach_names(page.items, patients_collection, doctors_collection, archive.archive_collections)
 
     return render(request, 'hospital_app/search_appointments.html', {
-        'appointments': appointments,
+        'appointments': page.items,
+        'page': page,
         'query': query,
         'selected_status': status_filter,
         'selected_date': date_filter,
-        'total_results': len(appointments)
+        'selected_from': date_from,
+        'selected_to': date_to,
+        'total_results': count_results(appointments_collection, search_criteria)
     })
 
+# ===== EXPORT =====
+@login_required
+def export_data(request, name):
+    if name not in export.EXPORTS:
+        raise Http404('Unknown export.')
+    file_format = request.GET.get('format', 'csv')
+    compress = request.GET.get('gzip') == '1'
+    collection = patients_collection if name == 'patients' else appointments_collection
+    try:
+        fields = export.export_fields(name, request.GET.get('fields'))
+        criteria = export.date_criteria(name, request.GET.get('from'), request.GET.get('to'))
+        chunks = export.export_chunks(
+            name, file_format, collection, fields, criteria, compress=compress,
+            patients_collection=patients_collection, doctors_collection=doctors_collection,
+        )
+    except export.ExportError as error:
+        return HttpResponseBadRequest(str(error))
+
+    response = StreamingHttpResponse(chunks, content_type=export.CONTENT_TYPES[file_format])
+    filename = export.export_filename(name, file_format, compress)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+# ===== METRICS =====
+def metrics(request):
+    """Prometheus scrape endpoint; guarded by HOSPITAL_METRICS_TOKEN when set."""
+    token = getattr(settings, 'HOSPITAL_METRICS_TOKEN', None)
+    if token and not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse('Unauthorized', status=401, content_type='text/plain')
+    body = app_metrics.render(app_metrics.collect())
+    return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
 # ===== STAFF AUTHENTICATION =====
 def staff_signup(request):
     if request.method == 'POST':
@@ -435,19 +695,24 @@ def staff_logout(request):
 
 @login_required
 def staff_dashboard(request):
-    # Get statistics for staff dashboard
-    total_patients = patients_collection.count_documents({})
-    total_doctors = doctors_collection.count_documents({})
-    
-    today = datetime.now().date()
-    today_appointments = appointments_collection.count_documents({
-        'appointment_date': str(today)
-    })
-    
-    context = {
-        'total_patients': total_patients,
-        'total_doctors': total_doctors,
-        'today_appointments': today_appointments,
-        'user': request.user,
-    }
-    return render(request, 'hospital_app/staff_dashboard.html', context)
\ No newline at end of file
+    # Get statistics for staff dashboard (shared, periodically refreshed snapshot)
+    context = dict(dashboard_stats(), user=request.user)
+    return render(request, 'hospital_app/staff_dashboard.html', context)
+
+@login_required
+def analytics_dashboard(request):
+    # Pre-aggregated daily buckets (see hospital_app.analytics); raw appointments are never scanned
+    try:
+        end = parse_day(request.GET.get('to') or datetime.now().date()).date()
+        start = parse_day(request.GET.get('from') or end - timedelta(days=analytics.REPORT_DAYS - 1)).date()
+    except ValueError:
+        messages.error(request, 'Enter dates as YYYY-MM-DD.')
+        end = datetime.now().date()
+        start = end - timedelta(days=analytics.REPORT_DAYS - 1)
+    grouping = request.GET.get('group') if request.GET.get('group') in analytics.GROUPINGS else 'day'
+    department = request.GET.get('department') or None
+    doctors = doctor_cache.doctor_options(doctors_collection)
+    context = analytics.report(start, end, doctors, grouping, department)
+    context.update(start=start, end=end, grouping=grouping, groupings=analytics.GROUPINGS, department=department,
+                   department_names=sorted({d['department'] for d in doctors if d.get('department')}))
+    return render(request, 'hospital_app/analytics.html', context)
\ No newline at end of file